@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the memory held by listed service accounts, materialized as full
+ServiceAccount resources and as lean AccountRecords. Requires python 3.4+.
+
+    PYTHONPATH=. python benchmarks/account_memory.py [accounts]
+"""
+from __future__ import print_function
+
+import gc
+import sys
+import uuid
+import tracemalloc
+
+from passaporte_web.main import ServiceAccount, AccountRecord
+
+HOST = 'http://sandbox.app.passaporteweb.com.br'
+
+
+def listed_account(index):
+    account_uuid = str(uuid.UUID(int=index))
+    account_url = '{0}/organizations/api/accounts/{1}/'.format(HOST, account_uuid)
+    return {
+        'account_data': {'name': 'Account {0}'.format(index), 'uuid': account_uuid},
+        'plan_slug': 'unittest',
+        'roles': ['owner'],
+        'expiration': '2030-01-01 00:00:00',
+        'url': account_url,
+        'history_url': account_url + 'history/',
+        'add_member_url': account_url + 'members/',
+        'notifications_url': '{0}/notifications/api/accounts/{1}/'.format(HOST, account_uuid),
+        'service_data': {'name': 'Identity Client', 'slug': 'identity_client'},
+        'updated_at': '2014-01-03 20:58:27',
+        'updated_by': HOST + '/admin/applications/identity_client/',
+    }
+
+
+def full(item):
+    account = ServiceAccount(**item)
+    account._session = None
+    return account
+
+
+def lean(item):
+    return AccountRecord.from_data(item)
+
+
+def measure(materialize, count):
+    gc.collect()
+    tracemalloc.start()
+    accounts = [materialize(listed_account(index)) for index in range(count)]
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del accounts
+    return current
+
+
+def main(count=100000):
+    results = [(name, measure(materialize, count)) for name, materialize in (
+        ('ServiceAccount', full), ('AccountRecord', lean),
+    )]
+    baseline = results[0][1]
+    for name, size in results:
+        print('{0:<16} {1:8.1f} MiB  {2:6.0f} bytes/account  {3:5.2f}x'.format(
+            name, size / 2.0 ** 20, size / float(count), baseline / float(size)
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
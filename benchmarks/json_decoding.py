@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the time spent decoding the JSON body of an OPTIONS response while
+building a resource from it, with plain requests responses (decoded on every
+json() call) and with PWebResponse (decoded once), for each installed backend.
+
+    PYTHONPATH=. python benchmarks/json_decoding.py [fields] [repeat]
+"""
+from __future__ import print_function
+
+import sys
+import json
+import timeit
+import importlib
+
+from requests import Response
+
+from passaporte_web.main import PWebResource
+from passaporte_web.transport import PWebResponse
+
+
+def make_response(response_class, body, loads=None):
+    response = response_class()
+    response._content = body
+    response.status_code = 200
+    response.encoding = 'utf-8'
+    response.headers['Allow'] = 'GET, PUT, HEAD, OPTIONS'
+    if loads is not None:
+        response.json_loads = loads
+    return response
+
+
+def build(response_class, body, loads=None):
+    response = make_response(response_class, body, loads)
+    resource = PWebResource.from_response(response, session=None)
+    resource.update_meta(response)
+
+
+def main(fields=2000, repeat=200):
+    body = json.dumps({
+        'fields': dict(('field_{0}'.format(i), {'type': 'CharField', 'required': False}) for i in range(fields)),
+    }).encode('utf-8')
+
+    cases = [('requests.Response', Response, None), ('PWebResponse', PWebResponse, None)]
+    for backend in ('simplejson', 'ujson', 'orjson'):
+        try:
+            cases.append(('PWebResponse + ' + backend, PWebResponse, importlib.import_module(backend).loads))
+        except ImportError:
+            pass
+
+    baseline = None
+    for name, response_class, loads in cases:
+        elapsed = min(timeit.repeat(lambda: build(response_class, body, loads), number=repeat, repeat=3))
+        baseline = baseline or elapsed
+        print('{0:<28} {1:8.3f} ms/resource  {2:5.2f}x'.format(
+            name, elapsed * 1000 / repeat, baseline / elapsed
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio counterpart of passaporte_web.main, running on a pooled aiohttp transport.
+
+Requires Python 3.6+ and aiohttp (pip install python-passaporte-web[async]).
+"""
+import json
+import base64
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import parse_header_links
+from six.moves.urllib.parse import urlsplit
+from api_toolkit.entities import UsingOptions, str_keys
+
+from .main import (
+    PWebSessionFactory, PWebResource, SharedOptions, Notification, Profile, Identity,
+    AccountMember, ServiceAccount, Application,
+)
+
+__all__ = [
+    'AsyncPassaporteWeb', 'AsyncIdentity', 'AsyncServiceAccount', 'AsyncNotification',
+    'AsyncProfile', 'AsyncAccountMember', 'AsyncApplication',
+]
+
+
+def basic_auth(user, password):
+    credentials = '{0}:{1}'.format(user, password).encode('latin1')
+    return 'Basic {0}'.format(base64.b64encode(credentials).decode('ascii'))
+
+
+class AsyncResponse(object):
+    """ The parts of a requests.Response used by the resources, read from an aiohttp response """
+
+    def __init__(self, method, url, status_code, reason, headers, content):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def links(self):
+        resolved_links = {}
+        header = self.headers.get('link')
+        if header:
+            for link in parse_header_links(header):
+                key = link.get('rel') or link.get('url')
+                resolved_links[key] = link
+
+        return resolved_links
+
+    def json(self, **kwargs):
+        return json.loads(self.content.decode('utf-8'), **kwargs)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 500:
+            kind = 'Client Error'
+        elif 500 <= self.status_code < 600:
+            kind = 'Server Error'
+        else:
+            return
+
+        raise requests.HTTPError(
+            '{0.status_code} {1}: {0.reason} for url: {0.url}'.format(self, kind), response=self
+        )
+
+
+class AsyncSession(object):
+    """ An aiohttp ClientSession configured as the sessions built by PWebSessionFactory """
+
+    def __init__(self, token='', secret='', limit=100, limit_per_host=0, keepalive_timeout=15):
+        self.auth = (token, secret)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.headers = dict(
+            (name, value) for name, value in PWebSessionFactory.default_headers.items()
+            # aiohttp manages both the connection and the body length
+            if name not in ('Connection', 'Content-Length')
+        )
+        self._client = None
+
+    @property
+    def client(self):
+        # The client session must be created inside a running event loop
+        if self._client is None or self._client.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._client = aiohttp.ClientSession(connector=connector, headers=self.headers)
+
+        return self._client
+
+    async def request(self, method, url, params=None, data=None, headers=None, auth=None):
+        user, password = auth or self.auth
+        headers = dict(headers or {}, Authorization=basic_auth(user, password))
+        if params:
+            # aiohttp refuses booleans as query values, requests sends them as strings
+            params = [(name, str(value)) for name, value in params]
+
+        async with self.client.request(
+            method, url, params=params, data=data, headers=headers
+        ) as response:
+            content = await response.read()
+            return AsyncResponse(
+                method, str(response.url), response.status, response.reason,
+                CaseInsensitiveDict(response.headers), content
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+
+
+class AsyncUsingOptions(SharedOptions):
+
+    async def load_options(self):
+        if not (self._session and self.url):
+            raise ValueError('Cannot load options for this instance')
+
+        options_response = await self._session.request('OPTIONS', self.url)
+        self.update_meta(options_response)
+        if self.response is None:
+            self.response = options_response
+
+        if self.options_cache is not None and options_response.ok:
+            self.options_cache.set(self.options_cache_key(), self.options_snapshot())
+
+        return options_response
+
+
+class AsyncResource(AsyncUsingOptions):
+
+    @classmethod
+    async def load(cls, url, session, **kwargs):
+        params = PWebSessionFactory.safe_params(**kwargs)
+        response = await session.request('GET', url, params=params)
+        response.raise_for_status()
+
+        instance = cls.from_response(response, session)
+        instance._meta['validators'] = cls.validators(response)
+        if not instance.load_cached_options():
+            await instance.load_options()
+
+        return instance
+
+    @classmethod
+    def load_once(cls, *args, **kwargs):
+        raise AttributeError('Use "await {0}.load()" instead'.format(cls.__name__))
+
+    @staticmethod
+    def validators(response):
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+
+    def prepare_collections(self, *args, **kwargs):
+        pass
+
+    async def refresh(self):
+        """ As PWebResource.refresh, using the validators of the loaded representation """
+        validators = self._meta.get('validators') or {}
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        response = await self._session.request('GET', self.url, headers=headers)
+        if response.status_code == 304:
+            return self
+
+        response.raise_for_status()
+        instance = self.__class__.from_response(response, self._session)
+        instance._meta['validators'] = self.validators(response)
+        instance._meta['allowed_methods'] = self._meta['allowed_methods']
+        instance._meta['fields'] = self._meta['fields']
+        instance.snapshot_fields()
+        return instance
+
+    async def save(self, force=False):
+        """ As PWebResource.save, nothing is sent when no field changed unless force is given """
+        if 'PUT' not in self._meta['allowed_methods']:
+            raise ValueError('This resource cannot be saved.')
+
+        if not force and not self.changed_fields():
+            return self
+
+        if self._meta['fields'] is None:
+            resource_data = self.resource_data
+        else:
+            resource_data = dict(
+                (k, v) for k, v in self.resource_data.items() if k in self._meta['fields']
+            )
+
+        headers = {}
+        if self._meta.get('etag'):
+            headers['If-Match'] = self._meta['etag']
+
+        response = await self._session.request(
+            'PUT', self.url, data=json.dumps(resource_data, sort_keys=True), headers=headers
+        )
+        response.raise_for_status()
+        self.mark_saved()
+        self._meta['validators'] = {}
+
+        try:
+            return self.__class__.from_response(response, self._session)
+        except ValueError:
+            return await self.__class__.load(self.url, session=self._session)
+
+    async def delete(self):
+        if 'DELETE' not in self._meta['allowed_methods']:
+            raise ValueError('This resource cannot be deleted.')
+
+        headers = {}
+        if self._meta.get('etag'):
+            headers['If-Match'] = self._meta['etag']
+
+        response = await self._session.request('DELETE', self.url, headers=headers)
+        response.raise_for_status()
+
+
+class AsyncCollection(AsyncUsingOptions, UsingOptions):
+    resource_class = None
+
+    def __init__(self, url, session, resource_class=None, lazy_options=False):
+        super(AsyncCollection, self).__init__()
+        self.url = url
+        self._session = session
+        self.resource_class = resource_class or self.resource_class or AsyncPWebResource
+        self._options_pending = lazy_options
+
+    async def load_options(self):
+        response = await super(AsyncCollection, self).load_options()
+        self._options_pending = False
+        return response
+
+    async def ensure_options(self):
+        if self._options_pending:
+            if self.load_cached_options():
+                self._options_pending = False
+            else:
+                await self.load_options()
+
+    async def all(self, **kwargs):
+        await self.ensure_options()
+        if 'GET' not in self._meta['allowed_methods']:
+            raise ValueError('This collection is not iterable.')
+
+        url = self.url
+        params = PWebSessionFactory.safe_params(**kwargs)
+        while True:
+            response = await self._session.request('GET', url, params=params)
+            response.raise_for_status()
+            for item in response.json(object_hook=str_keys):
+                instance = self.resource_class(**item)
+                instance._session = self._session
+                yield instance
+
+            if 'next' not in response.links:
+                break
+
+            url = response.links['next']['url']
+
+    def lookup_url(self):
+        return self.url
+
+    async def get(self, identifier, **kwargs):
+        if kwargs.pop('append_slash', True):
+            url_template = '{0}{1}/'
+        else:
+            url_template = '{0}{1}'
+
+        url = url_template.format(self.lookup_url(), identifier)
+        return await self.resource_class.load(url, session=self._session, **kwargs)
+
+    async def create(self, **kwargs):
+        await self.ensure_options()
+        if 'POST' not in self._meta['allowed_methods']:
+            raise ValueError('No items can be created for this collection.')
+
+        response = await self._session.request(
+            'POST', self.url, data=json.dumps(kwargs, sort_keys=True)
+        )
+        response.raise_for_status()
+
+        try:
+            return self.resource_class.from_response(response, self._session)
+        except ValueError:
+            return await self.resource_class.load(response.headers['Location'], session=self._session)
+
+
+class AsyncPWebResource(AsyncResource, PWebResource):
+    pass
+
+
+class AsyncNotification(AsyncResource, Notification):
+    pass
+
+
+class AsyncNotifications(AsyncCollection):
+    resource_class = AsyncNotification
+
+
+class AsyncProfile(AsyncResource, Profile):
+    pass
+
+
+class AsyncIdentity(AsyncResource, Identity):
+
+    @property
+    def profile(self):
+        raise AttributeError('Use "await identity.load_profile()" instead')
+
+    async def load_profile(self):
+        if hasattr(self, 'profile_url'):
+            return await AsyncProfile.load(self.profile_url, session=self._session)
+
+        return None
+
+    async def refresh_profile(self):
+        # Profiles are not kept by asynchronous identities, so they are always loaded
+        return await self.load_profile()
+
+    def prepare_collections(self, *args, **kwargs):
+        url_pieces = urlsplit(self.url)
+        user_accounts_url = '{0.scheme}://{0.netloc}/organizations/api/identities/{1.uuid}/accounts/'.format(url_pieces, self)
+        self.accounts = AsyncIdentityAccounts(
+            url=user_accounts_url, session=self._session,
+            resource_class=AsyncServiceAccount, seed=self.resource_data.get('accounts', [])
+        )
+
+    async def send_notification(self, body, **kwargs):
+        kwargs.update({
+            'body': body,
+            'destination': self.uuid,
+        })
+
+        if self._notifications is None:
+            self._notifications = AsyncNotifications(
+                url=self.resource_data['notifications']['list'], session=self._session
+            )
+        return await self._notifications.create(**kwargs)
+
+
+class AsyncAccountMember(AsyncResource, AccountMember):
+    pass
+
+
+class AsyncAccountMembers(AsyncCollection):
+    resource_class = AsyncAccountMember
+
+
+class AsyncServiceAccount(AsyncResource, ServiceAccount):
+
+    def prepare_collections(self, *args, **kwargs):
+        if 'history_url' in self.resource_data:
+            self.history = AsyncCollection(url=self.history_url, session=self._session)
+
+        if 'notifications_url' in self.resource_data:
+            self.notifications = AsyncNotifications(url=self.notifications_url, session=self._session)
+
+        if 'add_member_url' in self.resource_data:
+            self.members = AsyncAccountMembers(url=self.add_member_url, session=self._session)
+
+    async def send_notification(self, body, **kwargs):
+        kwargs['body'] = body
+
+        if not hasattr(self, 'notifications'):
+            # Accounts listed by an identity do not carry their collections
+            self.prepare_collections()
+
+        return await self.notifications.create(**kwargs)
+
+
+class AsyncIdentityAccounts(AsyncCollection):
+
+    def __init__(self, url, session, **kwargs):
+        self._seed = kwargs.pop('seed', [])
+        super(AsyncIdentityAccounts, self).__init__(url, session, **kwargs)
+
+    def from_seed(self):
+        for item in self._seed:
+            account = self.resource_class(**item)
+            account._session = self._session
+            yield account
+
+    def lookup_url(self):
+        url_pieces = urlsplit(self.url)
+        return '{0.scheme}://{0.netloc}/organizations/api/accounts/'.format(url_pieces)
+
+
+class AsyncUsers(AsyncCollection):
+
+    def _url(self, path):
+        url_pieces = urlsplit(self.url)
+        return '{0.scheme}://{0.netloc}{1}'.format(url_pieces, path)
+
+    async def get(self, **kwargs):
+        url = self._url('/accounts/api/identities/')
+
+        uuid = kwargs.pop('uuid', None)
+        if uuid:
+            url = '{0}{1}/'.format(url, uuid)
+        elif 'email' not in kwargs:
+            raise TypeError('Either "uuid" or "email" must be given')
+
+        return await self.resource_class.load(url, session=self._session, **kwargs)
+
+    async def authenticate(self, **kwargs):
+        url = self._url('/accounts/api/auth/')
+
+        if 'email' in kwargs and 'password' in kwargs:
+            credentials = (kwargs['email'], kwargs['password'])
+        elif 'id_token' in kwargs:
+            credentials = ('', kwargs['id_token'])
+        else:
+            raise TypeError('User credentials are required must be given')
+
+        # The user credentials are only used in this request, the pooled
+        # connections and the application credentials are kept
+        response = await self._session.request('GET', url, auth=credentials)
+        response.raise_for_status()
+
+        # The metadata of the auth endpoint does not describe the identity
+        user = self.resource_class.from_response(response, self._session)
+        user._meta['allowed_methods'] = UsingOptions.ALL_METHODS
+        user._meta['fields'] = None
+        user.load_cached_options()
+
+        return user
+
+
+class AsyncApplication(AsyncResource, Application):
+    pass
+
+
+class AsyncPassaporteWeb(object):
+    """
+    The asyncio counterpart of PassaporteWeb. All collections share a single
+    pooled aiohttp session, which must be closed using close() or ``async with``.
+    """
+
+    def __init__(self, host, token, secret, limit=100, limit_per_host=0, keepalive_timeout=15):
+        self.host = host
+        self._session = AsyncSession(
+            token=token, secret=secret, limit=limit,
+            limit_per_host=limit_per_host, keepalive_timeout=keepalive_timeout,
+        )
+
+        self.accounts = AsyncCollection(
+            url='{0}/organizations/api/accounts/'.format(self.host),
+            session=self._session, resource_class=AsyncServiceAccount, lazy_options=True
+        )
+
+        self.users = AsyncUsers(
+            url='{0}/accounts/api/create/'.format(self.host),
+            session=self._session, resource_class=AsyncIdentity, lazy_options=True
+        )
+
+        self.applications = AsyncCollection(
+            url='{0}/applications/api/'.format(self.host),
+            session=self._session, resource_class=AsyncApplication, lazy_options=True
+        )
+
+    async def close(self):
+        await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
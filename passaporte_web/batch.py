@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import threading
+
+import six
+from six.moves import queue
+
+__all__ = ['BatchError', 'BatchResult', 'iter_batch', 'run_batch']
+
+
+class BatchError(object):
+    """ Takes the place of the result of an item which could not be processed """
+
+    def __init__(self, index, data, error, exc_info=None):
+        self.index = index
+        self.data = data
+        self.error = error
+        self.exc_info = exc_info
+
+    def __repr__(self):
+        return '<BatchError index={0} error={1!r}>'.format(self.index, self.error)
+
+
+class BatchResult(object):
+    """ The results of a batch, in the same order as the items that were given """
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __getitem__(self, index):
+        return self.results[index]
+
+    @property
+    def errors(self):
+        return [result for result in self.results if isinstance(result, BatchError)]
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    @property
+    def succeeded(self):
+        return len(self.results) - self.failed
+
+    @property
+    def throughput(self):
+        """ Processed items per second """
+        if not self.elapsed:
+            return 0.0
+
+        return len(self.results) / float(self.elapsed)
+
+
+def iter_batch(function, items, max_in_flight=8, rate_limiter=None):
+    """
+    Calls function(item) for each of the items using up to max_in_flight threads,
+    yielding (index, item, result) tuples as they complete.
+
+    Errors raised while processing an item are yielded as a BatchError instead of
+    interrupting the batch. Items are consumed lazily, so long iterables are never
+    held in memory at once. When given, rate_limiter.acquire() is called before
+    each item is processed.
+    """
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be at least 1')
+
+    items = enumerate(items)
+    items_lock = threading.Lock()
+    done = queue.Queue(maxsize=max_in_flight)
+    stop = threading.Event()
+    finished, failed = object(), object()
+
+    def put(value):
+        # The consumer may stop before reading every result
+        while not stop.is_set():
+            try:
+                done.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def work():
+        try:
+            while not stop.is_set():
+                with items_lock:
+                    try:
+                        index, item = six.next(items)
+                    except StopIteration:
+                        return
+                    except Exception:
+                        put((failed, sys.exc_info()))
+                        return
+
+                try:
+                    if rate_limiter is not None:
+                        rate_limiter.acquire()
+                    result = function(item)
+                except Exception as error:
+                    result = BatchError(index, item, error, sys.exc_info())
+
+                put((index, item, result))
+        finally:
+            put(finished)
+
+    workers = []
+    for position in range(max_in_flight):
+        worker = threading.Thread(target=work)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    try:
+        running = len(workers)
+        while running:
+            value = done.get()
+            if value is finished:
+                running -= 1
+            elif value[0] is failed:
+                # Iterating over the items failed
+                six.reraise(*value[1])
+            else:
+                yield value
+    finally:
+        stop.set()
+
+
+def run_batch(function, items, max_in_flight=8, rate_limiter=None, timer=time.time):
+    """
+    Processes the items like iter_batch, returning the results as a BatchResult
+    in the same order as the items.
+    """
+    started = timer()
+    results = {}
+    for index, item, result in iter_batch(function, items, max_in_flight, rate_limiter):
+        results[index] = result
+
+    return BatchResult([results[index] for index in range(len(results))], timer() - started)
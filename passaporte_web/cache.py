@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+__all__ = ['LRUCache', 'SQLiteCache', 'IdentityCache']
+
+
+class LRUCache(object):
+    """
+    A thread safe in-process cache with LRU eviction and optional expiration.
+
+    Any object implementing get(key, default=None), set(key, value, ttl=None),
+    delete(key) and clear() can be used wherever an LRUCache is expected. The
+    schema snapshots also use items(), when available, to list every entry.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _expired(self, expires):
+        return expires is not None and expires <= self.timer()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+
+            if self._expired(expires):
+                return default
+
+            # Reinserting the item marks it as the most recently used
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.timer() + ttl
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        with self._lock:
+            return [
+                (key, value) for key, (expires, value) in self._data.items()
+                if not self._expired(expires)
+            ]
+
+
+class SQLiteCache(object):
+    """
+    A cache backed by a sqlite database, which can be shared between processes.
+    Keys and values must be serializable as JSON.
+    """
+
+    def __init__(self, path, ttl=None, timer=time.time, table='passaporte_web_cache'):
+        self.ttl = ttl
+        self.timer = timer
+        self.table = table
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS {0} (key TEXT PRIMARY KEY, value TEXT, expires REAL)'.format(table)
+            )
+
+    def __len__(self):
+        return len(self.items())
+
+    def _execute(self, query, *params):
+        with self._lock:
+            with self._connection:
+                return self._connection.execute(query.format(self.table), params).fetchall()
+
+    def get(self, key, default=None):
+        rows = self._execute(
+            'SELECT value FROM {0} WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            json.dumps(key), self.timer()
+        )
+        if not rows:
+            return default
+
+        return json.loads(rows[0][0])
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.timer() + ttl
+        self._execute(
+            'INSERT OR REPLACE INTO {0} (key, value, expires) VALUES (?, ?, ?)',
+            json.dumps(key), json.dumps(value), expires
+        )
+
+    def delete(self, key):
+        self._execute('DELETE FROM {0} WHERE key = ?', json.dumps(key))
+
+    def clear(self):
+        self._execute('DELETE FROM {0}')
+
+    def items(self):
+        rows = self._execute(
+            'SELECT key, value FROM {0} WHERE expires IS NULL OR expires > ?', self.timer()
+        )
+        items = []
+        for key, value in rows:
+            key = json.loads(key)
+            items.append((tuple(key) if isinstance(key, list) else key, json.loads(value)))
+
+        return items
+
+
+class IdentityCache(object):
+    """
+    Caches identities loaded by uuid or email. The identities are stored in
+    ``backend``, which defaults to an in-process LRUCache.
+    """
+
+    def __init__(self, backend=None, ttl=60, maxsize=1024):
+        self.backend = backend if backend is not None else LRUCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, uuid=None, email=None):
+        if uuid is None and email is not None:
+            uuid = self.backend.get('email:{0}'.format(email))
+
+        state = None if uuid is None else self.backend.get('identity:{0}'.format(uuid))
+        self._count(state is not None)
+
+        # Callers may change the identities they get, the cached state must not change
+        return copy.deepcopy(state)
+
+    def set(self, identity, email=None):
+        state = copy.deepcopy(identity.cached_state())
+        self.backend.set('identity:{0}'.format(identity.uuid), state)
+
+        for alias in set([email, identity.resource_data.get('email')]):
+            if alias is not None:
+                self.backend.set('email:{0}'.format(alias), identity.uuid)
+
+    def invalidate(self, uuid):
+        self.backend.delete('identity:{0}'.format(uuid))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
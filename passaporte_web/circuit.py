@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import threading
+
+from requests.exceptions import RequestException
+from six.moves.urllib.parse import urlsplit
+
+__all__ = ['CircuitBreaker', 'CircuitOpenError', 'endpoint_family']
+
+# The first matching pattern gives the family of a path
+ENDPOINT_FAMILIES = (
+    ('members', re.compile(r'/members/')),
+    ('notifications', re.compile(r'^/notifications/')),
+    ('applications', re.compile(r'^/applications/')),
+    ('accounts', re.compile(r'^/organizations/')),
+    ('identities', re.compile(r'^/accounts/')),
+)
+
+
+def endpoint_family(url):
+    path = urlsplit(url).path
+    for family, pattern in ENDPOINT_FAMILIES:
+        if pattern.search(path):
+            return family
+
+    return 'other'
+
+
+class CircuitOpenError(RequestException):
+    """ Raised instead of sending requests to an endpoint family while its circuit is open """
+
+    def __init__(self, family, retry_after, *args, **kwargs):
+        self.family = family
+        self.retry_after = retry_after
+        message = 'Circuit for {0} is open, retry after {1:.1f}s'.format(family, retry_after)
+        super(CircuitOpenError, self).__init__(message, *args, **kwargs)
+
+
+class Circuit(object):
+
+    def __init__(self):
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probes = 0
+
+
+class CircuitBreaker(object):
+    """
+    Keeps one circuit per endpoint family. A circuit opens after failure_threshold
+    consecutive failures (5xx responses or errors without a response), making the
+    requests to its family fail fast with CircuitOpenError. After reset_timeout
+    seconds up to half_open_probes requests are let through: the circuit closes
+    if they succeed and opens again otherwise.
+
+    on_state_change(family, old_state, new_state) is called on every transition.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    failure_statuses = (500, 502, 503, 504)
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_probes=1,
+                 timer=time.time, on_state_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.timer = timer
+        self.on_state_change = on_state_change
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _transition(self, family, circuit, state, transitions):
+        transitions.append((family, circuit.state, state))
+        circuit.state = state
+        if state == self.OPEN:
+            circuit.opened_at = self.timer()
+        elif state == self.CLOSED:
+            circuit.failures = 0
+
+    def _notify(self, transitions):
+        if self.on_state_change is not None:
+            for transition in transitions:
+                self.on_state_change(*transition)
+
+    def before_request(self, url):
+        """ Returns the family of url, raising CircuitOpenError if its circuit is open """
+        family = endpoint_family(url)
+        transitions = []
+        try:
+            with self._lock:
+                circuit = self._circuits.setdefault(family, Circuit())
+                if circuit.state == self.OPEN:
+                    elapsed = self.timer() - circuit.opened_at
+                    if elapsed < self.reset_timeout:
+                        raise CircuitOpenError(family, self.reset_timeout - elapsed)
+
+                    self._transition(family, circuit, self.HALF_OPEN, transitions)
+                    circuit.probes = 0
+
+                if circuit.state == self.HALF_OPEN:
+                    if circuit.probes >= self.half_open_probes:
+                        raise CircuitOpenError(family, 0)
+                    circuit.probes += 1
+        finally:
+            self._notify(transitions)
+
+        return family
+
+    def after_request(self, family, status=None):
+        """ Records the outcome of a request. A status of None means it failed without a response """
+        failed = status is None or status in self.failure_statuses
+        transitions = []
+        with self._lock:
+            circuit = self._circuits.setdefault(family, Circuit())
+            if circuit.state == self.HALF_OPEN:
+                circuit.probes -= 1
+                self._transition(family, circuit, self.OPEN if failed else self.CLOSED, transitions)
+            elif circuit.state == self.CLOSED:
+                circuit.failures = circuit.failures + 1 if failed else 0
+                if circuit.failures >= self.failure_threshold:
+                    self._transition(family, circuit, self.OPEN, transitions)
+
+        self._notify(transitions)
+
+    def state(self, family):
+        with self._lock:
+            circuit = self._circuits.get(family)
+            return circuit.state if circuit is not None else self.CLOSED
+
+    def states(self):
+        with self._lock:
+            return dict((family, circuit.state) for family, circuit in self._circuits.items())
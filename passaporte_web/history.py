@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+
+from .batch import BatchError, iter_batch
+from .main import PWebCollection
+
+__all__ = ['HistoryCheckpoints', 'HistoryConsumer', 'HistoryRecord']
+
+HistoryRecord = namedtuple('HistoryRecord', ['account', 'entry'])
+
+
+def entry_timestamp(entry):
+    return entry.resource_data.get('created_at') or ''
+
+
+def entry_fingerprint(entry):
+    dumped_data = json.dumps(entry.resource_data, sort_keys=True)
+    return hashlib.sha1(dumped_data.encode('utf-8')).hexdigest()
+
+
+class HistoryCheckpoints(object):
+    """
+    Keeps in a sqlite database, for each account uuid, the created_at of the last
+    consumed history entry and the fingerprints of the entries consumed with that
+    same created_at (history entries have no identifier of their own).
+    """
+
+    def __init__(self, path=':memory:'):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS history_checkpoints '
+                '(account TEXT PRIMARY KEY, created_at TEXT NOT NULL, seen TEXT NOT NULL)'
+            )
+
+    def get(self, account):
+        """ Returns the (created_at, fingerprints) checkpoint of account, or None """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT created_at, seen FROM history_checkpoints WHERE account = ?', (account,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], set(json.loads(row[1]))
+
+    def set(self, account, created_at, seen):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO history_checkpoints (account, created_at, seen) VALUES (?, ?, ?)',
+                (account, created_at, json.dumps(sorted(seen))),
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class HistoryConsumer(object):
+    """
+    Consumes the history of many service accounts, yielding only the entries that
+    were not consumed before, oldest first within each account.
+
+    The history of up to max_in_flight accounts is fetched at a time. The api has
+    no filter for new entries, so every page is read unless newest_first is set:
+    then the history is expected newest first and reading stops at the first
+    entry older than the checkpoint.
+
+    The checkpoint of an account is advanced once all of its new entries were
+    yielded and the next record is asked for, so entries are delivered at least
+    once. Accounts whose history could not be read are kept as BatchErrors in
+    the errors attribute and have their checkpoints untouched.
+    """
+
+    def __init__(self, checkpoints=None, max_in_flight=8, newest_first=False):
+        self.checkpoints = checkpoints if checkpoints is not None else HistoryCheckpoints()
+        self.max_in_flight = max_in_flight
+        self.newest_first = newest_first
+        self.errors = []
+
+    @staticmethod
+    def history_of(account):
+        history = getattr(account, 'history', None)
+        if history is None:
+            # Listed accounts have their collections prepared only after load_options
+            if 'history_url' not in account.resource_data:
+                raise ValueError('The history of {0} is not available'.format(account.uuid))
+            history = PWebCollection(url=account.history_url, session=account._session)
+
+        return history
+
+    @staticmethod
+    def is_new(entry, checkpoint):
+        if checkpoint is None:
+            return True
+
+        last_timestamp, seen = checkpoint
+        timestamp = entry_timestamp(entry)
+        return timestamp > last_timestamp or (
+            timestamp == last_timestamp and entry_fingerprint(entry) not in seen
+        )
+
+    def new_entries(self, account):
+        """ Reads the entries of the history of account after its checkpoint """
+        checkpoint = self.checkpoints.get(account.uuid)
+        entries = []
+        history = self.history_of(account).all()
+        try:
+            for entry in history:
+                if self.is_new(entry, checkpoint):
+                    entries.append(entry)
+                elif self.newest_first and entry_timestamp(entry) < checkpoint[0]:
+                    break
+        finally:
+            history.close()
+
+        if self.newest_first:
+            entries.reverse()
+        entries.sort(key=entry_timestamp)
+        return entries
+
+    def advance(self, account, entries):
+        if not entries:
+            return
+
+        checkpoint = self.checkpoints.get(account.uuid)
+        last_timestamp = entry_timestamp(entries[-1])
+        seen = set(entry_fingerprint(entry) for entry in entries if entry_timestamp(entry) == last_timestamp)
+        if checkpoint is not None and checkpoint[0] == last_timestamp:
+            seen |= checkpoint[1]
+
+        self.checkpoints.set(account.uuid, last_timestamp, seen)
+
+    def consume(self, accounts):
+        """ Yields a HistoryRecord for each new entry of the history of accounts """
+        self.errors = []
+        for index, account, entries in iter_batch(self.new_entries, accounts, max_in_flight=self.max_in_flight):
+            if isinstance(entries, BatchError):
+                self.errors.append(entries)
+                continue
+
+            for entry in entries:
+                yield HistoryRecord(account, entry)
+
+            self.advance(account, entries)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+__all__ = [
+    'InstrumentationHook', 'Instrumentation', 'LatencyAggregator',
+    'operation', 'current_resource_class', 'instrumentation_for',
+]
+
+_context = threading.local()
+
+
+@contextmanager
+def operation(resource_class):
+    """ Attributes the requests made inside the block to resource_class """
+    previous = getattr(_context, 'resource_class', None)
+    _context.resource_class = resource_class
+    try:
+        yield
+    finally:
+        _context.resource_class = previous
+
+
+def current_resource_class():
+    return getattr(_context, 'resource_class', None)
+
+
+def instrumentation_for(session, url):
+    """ The Instrumentation of the adapter used by session to reach url, if any """
+    return getattr(session.get_adapter(url), 'instrumentation', None)
+
+
+class InstrumentationHook(object):
+    """
+    Base class for the hooks given to Instrumentation, whose methods do nothing.
+
+    Every method receives the endpoint family, the HTTP method and the resource
+    class (or None) of the request, besides the data of the event. Subclasses
+    may forward these events to a metrics system.
+
+    The bytes_in of streamed responses is their Content-Length, or None.
+    """
+
+    def request_started(self, family, method, resource_class, url, bytes_out):
+        pass
+
+    def request_finished(self, family, method, resource_class, url, status, duration,
+                         bytes_in, bytes_out):
+        pass
+
+    def request_retried(self, family, method, resource_class, url, attempt, delay):
+        pass
+
+    def json_decoded(self, family, method, resource_class, duration, size):
+        pass
+
+    def cache_hit(self, family, method, resource_class, cache):
+        pass
+
+    def cache_miss(self, family, method, resource_class, cache):
+        pass
+
+
+class Instrumentation(object):
+    """ Dispatches the events of a client to its hooks """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+
+    def add(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def emit(self, event, **data):
+        for hook in self.hooks:
+            getattr(hook, event)(**data)
+
+
+class LatencyAggregator(InstrumentationHook):
+    """
+    Keeps the latencies of the last ``samples`` requests of each operation, an
+    operation being an (endpoint family, HTTP method, resource class name) tuple.
+    """
+
+    def __init__(self, samples=10000):
+        self.samples = samples
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def request_finished(self, family, method, resource_class, url, status, duration,
+                         bytes_in, bytes_out):
+        key = (family, method, resource_class.__name__ if resource_class is not None else None)
+        with self._lock:
+            latencies = self._latencies.setdefault(key, deque(maxlen=self.samples))
+            latencies.append(duration)
+
+    @staticmethod
+    def percentile(ordered, percent):
+        # Nearest rank
+        rank = int(math.ceil(percent / 100.0 * len(ordered)))
+        return ordered[max(rank, 1) - 1]
+
+    def report(self):
+        """ Returns the count and the p50, p95 and p99 latencies of each operation """
+        with self._lock:
+            latencies = dict((key, sorted(values)) for key, values in self._latencies.items())
+
+        return dict(
+            (key, {
+                'count': len(ordered),
+                'p50': self.percentile(ordered, 50),
+                'p95': self.percentile(ordered, 95),
+                'p99': self.percentile(ordered, 99),
+            })
+            for key, ordered in latencies.items()
+        )
@@ -1,9 +1,28 @@
 # -*- coding: utf-8 -*-
+import os
+import re
+import copy
+import json
+import threading
+import six
 from six.moves.urllib.parse import urlsplit
+from datetime import date
 from collections import OrderedDict
-from api_toolkit.entities import Collection, Resource, SessionFactory
+from api_toolkit.entities import Collection, Resource, SessionFactory, UsingOptions
 
-__all__ = ['Notification', 'Profile', 'Identity', 'ServiceAccount', 'PassaporteWeb',]
+from .batch import BatchError, iter_batch, run_batch
+from .cache import LRUCache
+from .circuit import endpoint_family
+from .instrumentation import instrumentation_for, operation
+from .pagination import PageIterator
+from .singleflight import single_flight_for
+from .throttle import TokenBucket
+from .transport import PWebAdapter
+
+__all__ = [
+    'Notification', 'Profile', 'Identity', 'ServiceAccount', 'AccountRecord', 'AccountIndex',
+    'MembershipSyncReport', 'PassaporteWeb',
+]
 
 
 class PWebSessionFactory(SessionFactory):
@@ -15,6 +34,23 @@ class PWebSessionFactory(SessionFactory):
         'User-Agent': 'api_toolkit',
         'Connection': 'keep-alive',
     }
+    transport_options = (
+        'pool_connections', 'pool_maxsize', 'max_retries', 'pool_block', 'keepalive_timeout',
+        'rate_limit', 'rate_burst', 'adaptive_concurrency', 'retry_policy', 'circuit_breaker',
+        'instrumentation', 'json_backend', 'coalesce',
+    )
+
+    @classmethod
+    def make(cls, **credentials):
+        session = super(PWebSessionFactory, cls).make(**credentials)
+
+        adapter = PWebAdapter(**dict(
+            (name, credentials[name]) for name in cls.transport_options if name in credentials
+        ))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
 
     @classmethod
     def get_auth(cls, **credentials):
@@ -35,28 +71,372 @@ class PWebSessionFactory(SessionFactory):
         return sorted(kwargs.items(), key=lambda t: t[0])
 
 
-class PWebResource(Resource):
+IDENTIFIER_SEGMENT = re.compile(r'^([0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}|\d+)$')
+
+
+def url_pattern(url):
+    """ Replaces the identifiers in the path of ``url`` by a placeholder """
+    url_pieces = urlsplit(url)
+    path = '/'.join(
+        '{id}' if IDENTIFIER_SEGMENT.match(segment) else segment
+        for segment in url_pieces.path.split('/')
+    )
+    return '{0.scheme}://{0.netloc}{1}'.format(url_pieces, path)
+
+
+def instrument(session, url, resource_class, event, **data):
+    """ Reports event to the instrumentation of the adapter used by session to reach url """
+    instrumentation = instrumentation_for(session, url) if session is not None and url else None
+    if instrumentation is not None:
+        instrumentation.emit(
+            event, family=endpoint_family(url), resource_class=resource_class, **data
+        )
+
+
+class SharedOptions(object):
+    # Set options_cache to an LRUCache (or any object with the same get/set
+    # interface) to share the OPTIONS metadata between instances of the same
+    # kind. Setting it here makes the cache process-wide. Caches without items()
+    # only share the metadata of the collections in schema snapshots.
+    options_cache = None
+
+    def options_cache_key(self):
+        return (self.__class__.__name__, url_pattern(self.url))
+
+    def instrumented_class(self):
+        """ The resource class to which the requests of this instance are attributed """
+        return self.__class__
+
+    def load_cached_options(self):
+        if self.options_cache is None or not self.url:
+            return False
+
+        cached_meta = self.options_cache.get(self.options_cache_key())
+        instrument(
+            getattr(self, '_session', None), self.url, self.instrumented_class(),
+            'cache_miss' if cached_meta is None else 'cache_hit', method='OPTIONS', cache='options'
+        )
+        if cached_meta is None:
+            return False
+
+        fields = cached_meta['fields']
+        self._meta['allowed_methods'] = cached_meta['allowed_methods']
+        self._meta['fields'] = None if fields is None else list(fields)
+
+        return True
+
+    def load_options(self):
+        with operation(self.instrumented_class()):
+            response = super(SharedOptions, self).load_options()
+        # Failed replies (a 401, for instance) would share the default metadata
+        if self.options_cache is not None and response.ok:
+            self.options_cache.set(self.options_cache_key(), self.options_snapshot())
+
+        return response
+
+    def options_snapshot(self):
+        fields = self._meta['fields']
+        return {
+            'url': self.url,
+            'allowed_methods': self._meta['allowed_methods'],
+            'fields': None if fields is None else list(fields),
+        }
+
+
+class PWebResource(SharedOptions, Resource):
     session_factory = PWebSessionFactory
+    # The writable fields, when known without loading the OPTIONS metadata
+    known_fields = None
+
+    def __init__(self, *args, **kwargs):
+        super(PWebResource, self).__init__(*args, **kwargs)
+        if self.known_fields is not None:
+            self._meta['fields'] = list(self.known_fields)
+
+        self.mark_saved()
+
+    def __setattr__(self, name, value):
+        if isinstance(value, UsingOptions):
+            # Collections, sync or async, are not data: resource_data keeps the seed
+            # they were prepared from
+            object.__setattr__(self, name, value)
+            return
+
+        super(PWebResource, self).__setattr__(name, value)
+
+    def load_cached_options(self):
+        loaded = super(PWebResource, self).load_cached_options()
+        if loaded:
+            self.snapshot_fields()
+
+        return loaded
+
+    def mark_saved(self):
+        """
+        Takes the current values as the saved ones. Only the writable fields, when
+        known, are copied: the other values are kept by reference, which catches
+        the values replaced but not those changed in place.
+        """
+        self._meta['saved'] = dict(self.resource_data)
+        self._meta['copied'] = set()
+        self.snapshot_fields()
+
+    def snapshot_fields(self):
+        """ Copies the saved values of the writable fields, once these are known """
+        saved = self._meta['saved']
+        copied = self._meta.setdefault('copied', set())
+        for name in self._meta['fields'] or ():
+            if name in copied or name not in saved:
+                continue
+
+            # A value replaced since it was saved is not the saved one anymore
+            if saved[name] is self.resource_data.get(name):
+                saved[name] = copy.deepcopy(saved[name])
+            copied.add(name)
+
+    def changed_fields(self):
+        """ The writable fields changed since this resource was loaded or saved """
+        saved = self._meta.get('saved') or {}
+        fields = self._meta['fields']
+        missing = object()
+        return sorted(
+            name for name in (self.resource_data if fields is None else fields)
+            if name in self.resource_data and saved.get(name, missing) != self.resource_data[name]
+        )
 
     @classmethod
     def load(cls, url, **kwargs):
-        instance = super(PWebResource, cls).load(url, **kwargs)
-        instance.load_options()
+        """
+        Loads the resource at ``url`` followed by its OPTIONS metadata.
+
+        ``auth`` sends other credentials in this request only, keeping the
+        session (and its pooled connections) untouched.
+
+        When the session coalesces requests, concurrent loads of the same url
+        share a single GET (and OPTIONS), each caller getting its own copy of
+        the loaded resource.
+        """
+        load_options = kwargs.pop('load_options', True)
+        auth = kwargs.pop('auth', None)
+        session = kwargs.pop('session', None) or cls.session_factory.make(**kwargs)
+
+        params = cls.session_factory.safe_params(**kwargs)
+        single_flight = single_flight_for(session, url) if auth is None else None
+        if single_flight is None:
+            return cls.load_once(url, session, params, auth, load_options)
+
+        instance, shared = single_flight.do(
+            (cls, url, repr(params), load_options),
+            lambda: cls.load_once(url, session, params, None, load_options),
+        )
+        return instance.clone() if shared else instance
+
+    @classmethod
+    def load_once(cls, url, session, params, auth, load_options):
+        with operation(cls):
+            response = session.get(url, params=params, auth=auth)
+            response.raise_for_status()
+
+            instance = cls.from_response(response, session)
+        if load_options and not instance.load_cached_options():
+            instance.load_options()
         return instance
 
+    @classmethod
+    def from_cached_state(cls, state, session):
+        """ Rebuilds a resource from the data returned by cached_state, without any request """
+        instance = cls(**state['resource_data'])
+        instance._session = session
+        instance._meta['allowed_methods'] = state['allowed_methods']
+        instance._meta['fields'] = state['fields']
+        instance.snapshot_fields()
+        instance.prepare_collections()
+        return instance
+
+    def clone(self):
+        """ A copy of this resource, sharing only its session and response """
+        fields = self._meta['fields']
+        instance = self.__class__(**copy.deepcopy(self.resource_data))
+        instance._session = self._session
+        instance._meta = copy.deepcopy(dict(self._meta, fields=None if fields is None else list(fields)))
+        instance._response = self._response
+        instance.prepare_collections()
+        return instance
+
+    def cached_state(self):
+        fields = self._meta['fields']
+        return {
+            'resource_data': self.resource_data,
+            'allowed_methods': self._meta['allowed_methods'],
+            'fields': None if fields is None else list(fields),
+        }
+
     def update_meta(self, response):
         super(PWebResource, self).update_meta(response)
         content = response.json()
         if 'fields' in content:
             self._meta['fields'] = content['fields'].keys()
+            if 'saved' in self._meta:
+                self.snapshot_fields()
         else:
             self._meta['fields'] = self._meta.get('fields', None)
 
+        request = getattr(response, 'request', None)
+        if request is not None and request.method == 'GET':
+            # Validators of the loaded representation, used by refresh
+            self._meta['validators'] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+
+    def save(self, force=False):
+        """
+        Sends the writable fields and returns the updated resource. Unless force is
+        given, nothing is sent when no field changed and this same instance is
+        returned instead.
+        """
+        if not force and 'PUT' in self._meta['allowed_methods'] and not self.changed_fields():
+            return self
+
+        with operation(self.__class__):
+            instance = super(PWebResource, self).save()
+
+        self.mark_saved()
+        # The validators of this instance describe the previous representation. Its
+        # etag is kept, so saving or deleting it again is still conditional.
+        self._meta['validators'] = {}
+        return instance
+
+    def delete(self):
+        with operation(self.__class__):
+            return super(PWebResource, self).delete()
+
+    def refresh(self):
+        """
+        Loads this resource again. A conditional request is made when the server gave
+        validators for the current representation, returning this same instance if it
+        was not modified.
+        """
+        validators = self._meta.get('validators') or {}
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        with operation(self.__class__):
+            response = self._session.get(self.url, headers=headers)
+            if response.status_code == 304:
+                return self
+
+            response.raise_for_status()
+            instance = self.__class__.from_response(response, self._session)
+        instance._meta['allowed_methods'] = self._meta['allowed_methods']
+        instance._meta['fields'] = self._meta['fields']
+        instance.snapshot_fields()
+        return instance
+
 
-class PWebCollection(Collection):
+class PWebCollection(SharedOptions, Collection):
     session_factory = PWebSessionFactory
     resource_class = PWebResource
 
+    def __init__(self, url, **kwargs):
+        # With lazy_options the OPTIONS request is deferred until the
+        # collection metadata is actually needed
+        lazy_options = kwargs.pop('lazy_options', False)
+
+        # Collection.__init__ would build a new session even when one is given
+        UsingOptions.__init__(self, url, **kwargs)
+        self.url = url
+        self._session = kwargs.pop('session', None) or self.session_factory.make(**kwargs)
+        self.resource_class = kwargs.get('resource_class', self.resource_class)
+
+        self._options_pending = lazy_options
+        self._options_lock = threading.Lock()
+
+    def load_options(self):
+        response = super(PWebCollection, self).load_options()
+        self._options_pending = False
+        return response
+
+    def ensure_options(self):
+        if self._options_pending:
+            with self._options_lock:
+                if self._options_pending:
+                    if self.load_cached_options():
+                        self._options_pending = False
+                    else:
+                        self.load_options()
+
+    def all(self, **kwargs):
+        """
+        Iterates over the items of every page. With prefetch=N, up to N pages are
+        fetched in background while the current one is consumed. The timings of
+        each page are kept in the timings attribute of the returned iterator.
+
+        With lean, resource classes providing lean_record (like ServiceAccount)
+        give read-only records instead of full resources.
+        """
+        self.ensure_options()
+        return PageIterator(self, **kwargs)
+
+    def create(self, **kwargs):
+        """
+        With idempotency_key, the request carries an Idempotency-Key header, which
+        allows the retry policy of the session to send it again.
+        """
+        idempotency_key = kwargs.pop('idempotency_key', None)
+        self.ensure_options()
+
+        if 'POST' not in self._meta['allowed_methods']:
+            raise ValueError('No items can be created for this collection.')
+
+        resource_data = json.dumps(kwargs, sort_keys=True)
+        headers = {'content-length': str(len(resource_data))}
+        if idempotency_key is not None:
+            headers['Idempotency-Key'] = idempotency_key
+
+        with operation(self.resource_class):
+            response = self._session.post(self.url, headers=headers, data=resource_data)
+            response.raise_for_status()
+
+            try:
+                instance = self.resource_class.from_response(response=response, session=self._session)
+            except ValueError:
+                instance = self.resource_class.load(url=response.headers['Location'], session=self._session)
+
+        return instance
+
+    def create_many(self, items, max_in_flight=8):
+        """
+        Creates one item for each dict in items, with up to max_in_flight requests
+        at a time. Returns a BatchResult where items that could not be created are
+        replaced by a BatchError holding the exception.
+        """
+        self.ensure_options()
+        if 'POST' not in self._meta['allowed_methods']:
+            raise ValueError('No items can be created for this collection.')
+
+        return run_batch(lambda data: self.create(**data), items, max_in_flight=max_in_flight)
+
+    def instrumented_class(self):
+        return self.resource_class
+
+    def lookup_url(self):
+        """ The url under which the items of this collection are found by get """
+        return self.url
+
+    def get(self, identifier, **kwargs):
+        if kwargs.pop('append_slash', True):
+            url_template = '{0}{1}/'
+        else:
+            url_template = '{0}{1}'
+
+        url = url_template.format(self.lookup_url(), identifier)
+        kwargs['session'] = self._session
+        return self.resource_class.load(url, **kwargs)
+
 
 class Notification(PWebResource):
     url_attribute_name = 'absolute_url'
@@ -67,6 +447,10 @@ class Notifications(PWebCollection):
 
 
 class Profile(PWebResource):
+    known_fields = (
+        'bio', 'birth_date', 'city', 'company', 'country', 'gender', 'language',
+        'nickname', 'position', 'profession', 'state', 'timezone',
+    )
 
     @property
     def url(self):
@@ -78,13 +462,39 @@ class Profile(PWebResource):
 
 class Identity(PWebResource):
     url_attribute_name = 'update_info_url'
+    _profile = None
+    _notifications = None
+    # The IdentityCache of the Users collection that gave this identity
+    _identity_cache = None
 
     @property
     def profile(self):
-        if hasattr(self, 'profile_url'):
-            return Profile.load(self.profile_url, session=self._session)
-        else:
-            return None
+        # The profile is loaded once, use refresh_profile to revalidate it
+        if self._profile is None and hasattr(self, 'profile_url'):
+            self._profile = Profile.load(self.profile_url, session=self._session)
+
+        return self._profile
+
+    def refresh_profile(self):
+        if self._profile is not None:
+            self._profile = self._profile.refresh()
+
+        return self.profile
+
+    def save(self, force=False):
+        instance = super(Identity, self).save(force=force)
+        if instance is not self:
+            self._profile = None
+            if self._identity_cache is not None:
+                self._identity_cache.invalidate(self.uuid)
+                instance._identity_cache = self._identity_cache
+
+        return instance
+
+    def refresh(self):
+        # The profile is not covered by the validators of the identity
+        self._profile = None
+        return super(Identity, self).refresh()
 
     def prepare_collections(self, *args, **kwargs):
         url_pieces = urlsplit(self.url)
@@ -100,33 +510,103 @@ class Identity(PWebResource):
             'destination': self.uuid,
         })
 
-        notifications = Notifications(
-            url=self.resource_data['notifications']['list'], session=self._session
-        )
-        notification = notifications.create(**kwargs)
+        if self._notifications is None:
+            self._notifications = Notifications(
+                url=self.resource_data['notifications']['list'], session=self._session
+            )
+        notification = self._notifications.create(**kwargs)
 
         return notification
 
 
 class AccountMember(PWebResource):
     url_attribute_name = 'membership_details_url'
-
-    def __init__(self, *args, **kwargs):
-        super(AccountMember, self).__init__(*args, **kwargs)
-
-        self._meta['fields'] = ['roles']
+    known_fields = ('roles',)
 
     @property
     def url(self):
         return super(AccountMember, self).url or self._response.url
 
 
+class MembershipSyncReport(object):
+    """
+    The outcome of AccountMembers.sync: the identity uuids of the members created,
+    updated, deleted and left unchanged, and a BatchError for each failed change,
+    whose data is the (action, identity uuid, roles) of the change.
+    """
+
+    def __init__(self, changes, unchanged, results):
+        self.unchanged = unchanged
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        self.errors = results.errors
+        self.elapsed = results.elapsed
+
+        for change, result in zip(changes, results):
+            if not isinstance(result, BatchError):
+                getattr(self, change[0]).append(change[1])
+
+    def __repr__(self):
+        return '<MembershipSyncReport created={0} updated={1} deleted={2} unchanged={3} errors={4}>'.format(
+            len(self.created), len(self.updated), len(self.deleted), len(self.unchanged), len(self.errors)
+        )
+
+
 class AccountMembers(PWebCollection):
     resource_class = AccountMember
+    # The roles given to members created or updated without any
+    default_roles = ['user']
+
+    def same_roles(self, current, desired):
+        return set(current or self.default_roles) == set(desired or self.default_roles)
+
+    def sync(self, members, delete=True, max_in_flight=8):
+        """
+        Makes the members of the account match ``members``, a dict of identity uuids
+        to their roles. The current members are listed once and only the needed
+        changes are made, with up to max_in_flight requests at a time: members
+        missing from the account are created, those with other roles are updated
+        and, unless delete is False, those not in ``members`` are deleted.
+
+        Returns a MembershipSyncReport.
+        """
+        current = dict((member.identity['uuid'], member) for member in self.all())
+
+        changes, unchanged = [], []
+        for uuid, roles in members.items():
+            member = current.get(uuid)
+            if member is None:
+                changes.append(('created', uuid, list(roles)))
+            elif self.same_roles(member.roles, roles):
+                unchanged.append(uuid)
+            else:
+                changes.append(('updated', uuid, list(roles)))
+
+        if delete:
+            changes.extend(
+                ('deleted', uuid, member.roles) for uuid, member in current.items() if uuid not in members
+            )
+
+        def apply_change(change):
+            action, uuid, roles = change
+            if action == 'created':
+                return self.create(identity=uuid, roles=roles)
+
+            member = current[uuid]
+            if action == 'updated':
+                member.roles = roles
+                return member.save()
+
+            return member.delete()
+
+        results = run_batch(apply_change, changes, max_in_flight=max_in_flight)
+        return MembershipSyncReport(changes, unchanged, results)
 
 
 class Account(object):
     # Accounts can only be manipulated via ServiceAccounts
+    __slots__ = ('name', 'uuid', '_session')
 
     def __init__(self, name, uuid):
         self.name = name
@@ -137,13 +617,63 @@ class Account(object):
         return {'name': self.name, 'uuid': self.uuid}
 
 
+class AccountRecord(object):
+    """
+    A read-only and memory-lean view of a listed service account, keeping only
+    its main attributes. promote() loads the full ServiceAccount.
+    """
+    __slots__ = ('uuid', 'name', 'plan_slug', 'expiration', 'roles', 'url', '_session')
+
+    def __init__(self, uuid, name, plan_slug=None, expiration=None, roles=(), url=None, session=None):
+        for attrname, value in (
+                ('uuid', uuid), ('name', name), ('plan_slug', plan_slug), ('expiration', expiration),
+                ('roles', tuple(roles or ())), ('url', url), ('_session', session)):
+            object.__setattr__(self, attrname, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Account records are read-only')
+
+    def __repr__(self):
+        return '<AccountRecord uuid="{0.uuid}" name="{0.name}">'.format(self)
+
+    @classmethod
+    def from_data(cls, data, session=None):
+        account_data = data.get('account_data') or {}
+        expiration = data.get('expiration')
+        if expiration:
+            # The api gives a datetime, as in ServiceAccount
+            expiration = expiration.split()[0]
+
+        return cls(
+            uuid=data.get('uuid') or account_data.get('uuid'),
+            name=data.get('name') or account_data.get('name'),
+            plan_slug=data.get('plan_slug'), expiration=expiration, roles=data.get('roles'),
+            url=data.get('url'), session=session,
+        )
+
+    @property
+    def account(self):
+        return Account(name=self.name, uuid=self.uuid)
+
+    @property
+    def resource_data(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__ if name != '_session')
+
+    def promote(self):
+        """ Loads the ServiceAccount this record was built from """
+        if self.url is None:
+            raise ValueError('The url of this account is not known')
+
+        return ServiceAccount.load(self.url, session=self._session)
+
+
 class ServiceAccount(PWebResource):
+    known_fields = ('expiration', 'plan_slug')
 
     def __new__(cls, *args, **kwargs):
-        instance_keys = sorted(kwargs.keys())
-        if instance_keys == ['name', 'uuid']:
+        if len(kwargs) == 2 and 'name' in kwargs and 'uuid' in kwargs:
             instance = Account(**kwargs)
-        elif instance_keys == ['account_data']:
+        elif len(kwargs) == 1 and 'account_data' in kwargs:
             instance = Account(**kwargs['account_data'])
         else:
             instance = super(ServiceAccount, cls).__new__(cls)
@@ -152,12 +682,13 @@ class ServiceAccount(PWebResource):
         return instance
 
     def __init__(self, *args, **kwargs):
+        if kwargs.get('expiration'):
+            # The api gives a datetime but expects a date
+            kwargs['expiration'] = kwargs['expiration'].split()[0]
+
         super(ServiceAccount, self).__init__(*args, **kwargs)
 
         self.account = Account(name=self.name, uuid=self.uuid)
-        if getattr(self, 'expiration', None):
-            # The api gives a datetime but expects a date
-            self.expiration = self.expiration.split()[0]
 
     @property
     def uuid(self):
@@ -174,6 +705,10 @@ class ServiceAccount(PWebResource):
 
         return attrvalue
 
+    @classmethod
+    def lean_record(cls, data, session):
+        return AccountRecord.from_data(data, session)
+
     def prepare_collections(self, *args, **kwargs):
         if 'history_url' in self.resource_data:
             self.history = PWebCollection(url=self.history_url, session=self._session)
@@ -187,38 +722,168 @@ class ServiceAccount(PWebResource):
     def send_notification(self, body, **kwargs):
         kwargs['body'] = body
 
+        if not hasattr(self, 'notifications'):
+            # Listed accounts have their collections prepared only after load_options
+            self.prepare_collections()
+
         return self.notifications.create(**kwargs)
 
 
+class AccountIndex(object):
+    """
+    Indexes the data of service accounts by uuid, plan_slug and role. Both the
+    format of the identity seed and the format of the accounts api are accepted.
+    """
+
+    def __init__(self, items=()):
+        self._items = []
+        self._by_uuid = {}
+        self._by_plan = {}
+        self._by_role = {}
+        self._lock = threading.Lock()
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def item_uuid(item):
+        return item.get('uuid') or (item.get('account_data') or {}).get('uuid')
+
+    def add(self, item):
+        """ Indexes item, replacing the data previously indexed for its uuid """
+        uuid = self.item_uuid(item)
+        with self._lock:
+            position = self._by_uuid.get(uuid)
+            if position is None:
+                position = len(self._items)
+                self._items.append(item)
+                self._by_uuid[uuid] = position
+            else:
+                previous = self._items[position]
+                self._by_plan[previous.get('plan_slug')].discard(position)
+                for role in previous.get('roles') or ():
+                    self._by_role[role].discard(position)
+                self._items[position] = item
+
+            self._by_plan.setdefault(item.get('plan_slug'), set()).add(position)
+            for role in item.get('roles') or ():
+                self._by_role.setdefault(role, set()).add(position)
+
+    def get(self, uuid):
+        position = self._by_uuid.get(uuid)
+        return None if position is None else self._items[position]
+
+    def find(self, plan_slug=None, role=None, expired=None, today=None):
+        """
+        Returns the data of the accounts matching every given filter, in the order
+        they were indexed. An account is expired when its expiration is before today.
+        """
+        candidates = None
+        if plan_slug is not None:
+            candidates = self._by_plan.get(plan_slug, set())
+        if role is not None:
+            by_role = self._by_role.get(role, set())
+            candidates = by_role if candidates is None else candidates & by_role
+
+        positions = range(len(self._items)) if candidates is None else sorted(candidates)
+        items = [self._items[position] for position in positions]
+        if expired is not None:
+            today = today or date.today().isoformat()
+            items = [item for item in items if self.is_expired(item, today) == expired]
+
+        return items
+
+    @staticmethod
+    def is_expired(item, today):
+        expiration = item.get('expiration')
+        return bool(expiration) and expiration.split()[0] < today
+
+
 class IdentityAccounts(PWebCollection):
+    # The seed is kept as given by the identity, accounts are only built when asked for
     _seed = []
+    _index = None
 
     def __init__(self, url, **kwargs):
         self._seed = kwargs.pop('seed', [])
         super(IdentityAccounts, self).__init__(url, **kwargs)
 
-    def from_seed(self):
+    @property
+    def index(self):
+        """ The AccountIndex of these accounts, built from the seed unless built before """
+        if self._index is None:
+            self.build_index()
+
+        return self._index
+
+    def build_index(self, fetch=False, **params):
+        """
+        Indexes the seeded accounts or, with fetch, the accounts listed by a single
+        iteration over the collection, filtered by params.
+        """
+        if fetch:
+            items = [account.resource_data for account in self.all(**params)]
+        else:
+            items = self._seed
+
+        self._index = AccountIndex(items)
+        return self._index
+
+    def materialize(self, item):
+        account = ServiceAccount(**item)
+        account._session = self._session
+        return account
+
+    def by_uuid(self, uuid, default=None):
+        """ Builds only the indexed account with the given uuid """
+        item = self.index.get(uuid)
+        if item is None:
+            return default
+
+        return self.materialize(item)
+
+    def find(self, **filters):
+        """ Builds the indexed accounts matching the filters of AccountIndex.find """
+        return [self.materialize(item) for item in self.index.find(**filters)]
+
+    def create(self, **kwargs):
+        account = super(IdentityAccounts, self).create(**kwargs)
+        # The seed belongs to the identity, so the account is kept by the index only
+        self.index.add(account.resource_data)
+
+        return account
+
+    def from_seed(self, lean=False):
+        """ With lean, the accounts are given as AccountRecords """
         for item in self._seed:
+            if lean:
+                yield AccountRecord.from_data(item, self._session)
+                continue
+
             account = ServiceAccount(**item)
             account._session = self._session
             yield account
 
-    def get(self, *args, **kwargs):
-        try:
-            identity_account_url = self.url
-            url_pieces = urlsplit(self.url)
-            self.url = '{0.scheme}://{0.netloc}/organizations/api/accounts/'.format(url_pieces)
-            return super(IdentityAccounts, self).get(*args, **kwargs)
-        finally:
-            self.url = identity_account_url
+    def lookup_url(self):
+        # Accounts are listed under the identity, but must be loaded from the accounts api
+        url_pieces = urlsplit(self.url)
+        return '{0.scheme}://{0.netloc}/organizations/api/accounts/'.format(url_pieces)
 
 
 class Users(PWebCollection):
 
+    def __init__(self, url, **kwargs):
+        # Only the lookups by uuid or email, without other parameters, are cached
+        self.identity_cache = kwargs.pop('identity_cache', None)
+        super(Users, self).__init__(url, **kwargs)
+
     def get(self, **kwargs):
         url_pieces = urlsplit(self.url)
         url = '{0.scheme}://{0.netloc}/accounts/api/identities/'.format(url_pieces)
 
+        cacheable = self.identity_cache is not None and len(kwargs) == 1
         kwargs['session'] = self._session
         uuid = kwargs.pop('uuid', None)
         if uuid:
@@ -226,25 +891,45 @@ class Users(PWebCollection):
         elif 'email' not in kwargs:
             raise TypeError('Either "uuid" or "email" must be given')
 
-        return self.resource_class.load(url, **kwargs)
+        if cacheable:
+            state = self.identity_cache.get(uuid=uuid, email=kwargs.get('email'))
+            instrument(
+                self._session, url, self.resource_class, 'cache_miss' if state is None else 'cache_hit',
+                method='GET', cache='identity'
+            )
+            if state is not None:
+                user = self.resource_class.from_cached_state(state, self._session)
+                user._identity_cache = self.identity_cache
+                return user
+
+        user = self.resource_class.load(url, **kwargs)
+        if cacheable:
+            self.identity_cache.set(user, email=kwargs.get('email'))
+            user._identity_cache = self.identity_cache
+
+        return user
 
     def authenticate(self, **kwargs):
         url_pieces = urlsplit(self.url)
         url = '{0.scheme}://{0.netloc}/accounts/api/auth/'.format(url_pieces)
 
         if 'email' in kwargs and 'password' in kwargs:
-            user = self.resource_class.load(url, user=kwargs['email'], password=kwargs['password'])
+            credentials = (kwargs['email'], kwargs['password'])
         elif 'id_token' in kwargs:
-            user = self.resource_class.load(url, password=kwargs['id_token'])
+            credentials = ('', kwargs['id_token'])
         else:
             raise TypeError('User credentials are required must be given')
 
-        # The user credentials must not be used anymore
-        del(user._session)
-        user._session = self._session
+        # The user credentials are only sent in this request, the identity
+        # uses the application session from the start
+        user = self.resource_class.load(
+            url, session=self._session, auth=credentials, load_options=False
+        )
 
-        # FIXME: Prepare collections must be called again in order to use the right credentials
-        user.prepare_collections()
+        # The metadata of the auth endpoint does not describe the identity
+        user._meta['allowed_methods'] = UsingOptions.ALL_METHODS
+        user._meta['fields'] = None
+        user.load_cached_options()
 
         return user
 
@@ -254,29 +939,213 @@ class Application(PWebResource):
 
 
 class PassaporteWeb(PWebResource):
-
-    def __init__(self, host, token, secret):
+    schema_version = 1
+
+    def __init__(self, host, token, secret, eager=False, schema=None, identity_cache=None,
+                 **transport_options):
+        """
+        All collections share a single session. The transport_options (pool_connections,
+        pool_maxsize, max_retries, pool_block and keepalive_timeout) configure its connection
+        pools, pool_maxsize being a hard limit on the connections per host only with pool_block,
+        while rate_limit, rate_burst and adaptive_concurrency throttle all of its requests
+        and retry_policy decides which of them are retried. circuit_breaker makes the
+        requests to failing endpoint families fail fast, and coalesce makes concurrent
+        loads of the same resource share a single request.
+
+        users.get caches the identities in identity_cache (an IdentityCache), when given.
+        """
         self.host = host
         self.token = token
         self.secret = secret
+        self.eager = eager
+        self.identity_cache = identity_cache
         super(PassaporteWeb, self).__init__()
+        self._session = self.session_factory.make(token=token, secret=secret, **transport_options)
+        if schema is not None:
+            self.load_schema(schema)
         self.prepare_collections()
 
     def prepare_collections(self, *args, **kwargs):
+        # Unless eager is set, the collections metadata is only loaded when first used
+        lazy_options = not self.eager
+
         self.accounts = PWebCollection(
             url='{0}/organizations/api/accounts/'.format(self.host),
-            token=self.token, secret=self.secret, resource_class=ServiceAccount
+            session=self._session, resource_class=ServiceAccount,
+            lazy_options=lazy_options
         )
-        self.accounts.load_options()
 
         self.users = Users(
             url='{0}/accounts/api/create/'.format(self.host),
-            token=self.token, secret=self.secret, resource_class=Identity
+            session=self._session, resource_class=Identity,
+            lazy_options=lazy_options, identity_cache=self.identity_cache
         )
-        self.users.load_options()
 
         self.applications = PWebCollection(
             url='{0}/applications/api/'.format(self.host),
-            token=self.token, secret=self.secret, resource_class=Application
+            session=self._session, resource_class=Application,
+            lazy_options=lazy_options
+        )
+
+        if self.eager:
+            for collection in (self.accounts, self.users, self.applications):
+                collection.load_options()
+
+    @property
+    def collections(self):
+        return (self.accounts, self.users, self.applications)
+
+    def send_notifications(self, body, destinations, max_in_flight=8, rate=None, **kwargs):
+        """
+        Sends the notification to each of the destinations, which may be identity
+        uuids, Identities, ServiceAccounts or AccountRecords, with up to max_in_flight
+        requests at a time and at most rate requests per second. AccountRecords are
+        promoted to learn where their notifications are sent.
+
+        Yields (destination, notification) tuples as the notifications are sent. A
+        BatchError takes the place of the notifications that could not be sent, and
+        a TypeError is raised when any other kind of destination is reached.
+        """
+        notifications = Notifications(
+            url='{0}/notifications/api/'.format(self.host), session=self._session
         )
-        self.applications.load_options()
+        # One collection for each notifications_url of the accounts given
+        account_notifications = {}
+        account_notifications_lock = threading.Lock()
+        rate_limiter = TokenBucket(rate) if rate else None
+
+        def notifications_for(account):
+            with account_notifications_lock:
+                url = account.notifications_url
+                if url not in account_notifications:
+                    account_notifications[url] = Notifications(url=url, session=self._session)
+
+                return account_notifications[url]
+
+        def checked(destinations):
+            for destination in destinations:
+                # Accounts are notified through their ServiceAccounts, not as identities
+                if not isinstance(destination, (six.string_types, Identity, ServiceAccount, AccountRecord)):
+                    raise TypeError('Notifications cannot be sent to {0!r}'.format(destination))
+                yield destination
+
+        def send(destination):
+            if isinstance(destination, AccountRecord):
+                return notifications_for(destination.promote()).create(**dict(kwargs, body=body))
+            if isinstance(destination, ServiceAccount):
+                return notifications_for(destination).create(**dict(kwargs, body=body))
+
+            uuid = getattr(destination, 'uuid', destination)
+            return notifications.create(**dict(kwargs, body=body, destination=uuid))
+
+        batch = iter_batch(send, checked(destinations), max_in_flight, rate_limiter)
+        for index, destination, result in batch:
+            yield destination, result
+
+    def pool_stats(self):
+        """ Gauges describing the connection pools shared by all collections """
+        return self._session.get_adapter(self.host).pool_stats()
+
+    def dump_schema(self, path):
+        """
+        Writes the OPTIONS metadata discovered so far to ``path``.
+
+        The metadata of accounts, users and applications is always included.
+        Members, notifications and every other kind of resource are included
+        once they are present in SharedOptions.options_cache.
+        """
+        for collection in self.collections:
+            collection.ensure_options()
+
+        entries = dict(self.cached_options())
+
+        for collection in self.collections:
+            entries[collection.options_cache_key()] = collection.options_snapshot()
+
+        schema = {
+            'version': self.schema_version,
+            'host': self.host,
+            'entries': [
+                dict(meta, kind=kind, pattern=pattern)
+                for (kind, pattern), meta in sorted(entries.items(), key=lambda t: t[0])
+            ]
+        }
+
+        # Write to a temporary file first, so that readers never see a partial snapshot
+        temporary_path = '{0}.tmp'.format(path)
+        with open(temporary_path, 'w') as schema_file:
+            json.dump(schema, schema_file, sort_keys=True, indent=2)
+        getattr(os, 'replace', os.rename)(temporary_path, path)
+
+    def cached_options(self):
+        """
+        The (key, metadata) pairs in SharedOptions.options_cache. Only the entries of
+        the collections are found in caches which cannot list their items.
+        """
+        options_cache = SharedOptions.options_cache
+        if options_cache is None:
+            return []
+        if hasattr(options_cache, 'items'):
+            return list(options_cache.items())
+
+        entries = []
+        for collection in self.collections:
+            key = collection.options_cache_key()
+            cached_meta = options_cache.get(key)
+            if cached_meta is not None:
+                entries.append((key, cached_meta))
+
+        return entries
+
+    def load_schema(self, path):
+        """
+        Warm starts SharedOptions.options_cache using a snapshot created by dump_schema.
+        A process-wide cache without expiration is installed if none is configured.
+        """
+        with open(path) as schema_file:
+            schema = json.load(schema_file)
+
+        if schema.get('version') != self.schema_version:
+            raise ValueError('Unsupported schema version: {0}'.format(schema.get('version')))
+
+        if SharedOptions.options_cache is None:
+            SharedOptions.options_cache = LRUCache(maxsize=None)
+
+        for entry in schema['entries']:
+            key = (entry.pop('kind'), entry.pop('pattern'))
+            SharedOptions.options_cache.set(key, entry)
+
+    def refresh_schema(self, background=False):
+        """
+        Validates every cached OPTIONS metadata against the live API, updating the
+        entries that changed. Returns the keys of the stale entries, or the worker
+        thread if ``background`` is set.
+        """
+        if background:
+            worker = threading.Thread(target=self.refresh_schema)
+            worker.daemon = True
+            worker.start()
+            return worker
+
+        session = self._session
+        stale_keys = []
+        for key, cached_meta in self.cached_options():
+            response = session.options(cached_meta['url'])
+            if not response.ok:
+                continue
+
+            current_meta = dict(cached_meta)
+            current_meta['allowed_methods'] = response.headers.get('Allow', cached_meta['allowed_methods'])
+            changed = current_meta['allowed_methods'] != cached_meta['allowed_methods']
+
+            # Collections and resources without known fields only track the allowed methods
+            content = response.json() if cached_meta['fields'] is not None else {}
+            if 'fields' in content:
+                current_meta['fields'] = list(content['fields'].keys())
+                changed = changed or sorted(current_meta['fields']) != sorted(cached_meta['fields'])
+
+            if changed:
+                SharedOptions.options_cache.set(key, current_meta)
+                stale_keys.append(key)
+
+        return stale_keys
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import threading
+from collections import namedtuple
+
+import six
+from six.moves import queue
+from api_toolkit.entities import str_keys
+
+from .instrumentation import operation
+
+__all__ = ['PageIterator', 'PageTiming']
+
+# fetch is the duration of the request, wait is how long the consumer was blocked
+# waiting for the page. With prefetching, wait is smaller than fetch.
+PageTiming = namedtuple('PageTiming', ['url', 'items', 'fetch', 'wait'])
+
+
+class PageIterator(six.Iterator):
+    """
+    Iterates over the items of every page of a collection.
+
+    With prefetch, a background thread fetches up to that number of pages ahead
+    of the consumer. At most prefetch + 2 pages are held in memory: the queued
+    ones, the one being consumed and the one waiting for room in the queue.
+    """
+
+    def __init__(self, collection, prefetch=0, timer=time.time, **kwargs):
+        self.collection = collection
+        self.prefetch = prefetch
+        self.timer = timer
+        self.load_options = kwargs.pop('load_options', False)
+        self.lean = kwargs.pop('lean', False)
+        if self.lean and not hasattr(collection.resource_class, 'lean_record'):
+            raise ValueError('{0} has no lean representation'.format(collection.resource_class.__name__))
+        self.params = collection.session_factory.safe_params(**kwargs)
+        self.timings = []
+        self._items = None
+        self._stop = threading.Event()
+        self._worker = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._items is None:
+            self._items = self.iter_items()
+
+        return six.next(self._items)
+
+    def close(self):
+        """ Stops the iteration, and the background fetching of pages """
+        self._stop.set()
+        if self._items is not None:
+            self._items.close()
+
+    def iter_items(self):
+        if 'GET' not in self.collection._meta['allowed_methods']:
+            raise ValueError('This collection is not iterable.')
+
+        pages = self.prefetched_pages() if self.prefetch else self.fetched_pages()
+        for items in pages:
+            for item in items:
+                if self.lean:
+                    yield self.collection.resource_class.lean_record(item, self.collection._session)
+                    continue
+
+                instance = self.collection.resource_class(**item)
+                instance._session = self.collection._session
+                if self.load_options:
+                    instance.load_options()
+                yield instance
+
+    def fetch(self, url):
+        return fetch_page(self.collection, url, self.params, self.timer)
+
+    def fetched_pages(self):
+        url = self.collection.url
+        while url:
+            page_url = url
+            items, url, elapsed = self.fetch(page_url)
+            self.timings.append(PageTiming(page_url, len(items), elapsed, elapsed))
+            yield items
+
+    def prefetched_pages(self):
+        pages = queue.Queue(maxsize=self.prefetch)
+        # The worker must not hold this iterator, which is then stopped when dropped
+        self._worker = threading.Thread(
+            target=fetch_pages, args=(self.collection, self.params, self.timer, pages, self._stop)
+        )
+        self._worker.daemon = True
+        self._worker.start()
+
+        try:
+            while True:
+                started = self.timer()
+                page = pages.get()
+                waited = self.timer() - started
+                if page is None:
+                    break
+
+                error, page_url, items, elapsed = page
+                if error is not None:
+                    six.reraise(*error)
+
+                self.timings.append(PageTiming(page_url, len(items), elapsed, waited))
+                yield items
+        finally:
+            self._stop.set()
+
+
+def fetch_page(collection, url, params, timer):
+    started = timer()
+    with operation(collection.resource_class):
+        response = collection._session.get(url, params=params)
+        response.raise_for_status()
+        items = response.json(object_hook=str_keys)
+    elapsed = timer() - started
+
+    return items, response.links.get('next', {}).get('url'), elapsed
+
+
+def fetch_pages(collection, params, timer, pages, stop):
+    url = collection.url
+    while url and not stop.is_set():
+        page_url = url
+        try:
+            items, url, elapsed = fetch_page(collection, page_url, params, timer)
+        except Exception:
+            put_page(pages, (sys.exc_info(), page_url, None, None), stop)
+            return
+
+        put_page(pages, (None, page_url, items, elapsed), stop)
+
+    put_page(pages, None, stop)
+
+
+def put_page(pages, page, stop):
+    # The consumer may stop before reading every page
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=0.1)
+            return
+        except queue.Full:
+            pass
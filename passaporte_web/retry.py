@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import time
+import random
+import threading
+
+__all__ = ['RetryPolicy', 'RetryBudget']
+
+
+class RetryBudget(object):
+    """
+    Limits the retries to about ``ratio`` of the requests, allowing bursts of up to
+    ``reserve`` retries. Each request deposits ratio and each retry withdraws one.
+    """
+
+    def __init__(self, ratio=0.1, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._balance = float(reserve)
+        self._lock = threading.Lock()
+
+    @property
+    def balance(self):
+        return self._balance
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self.reserve, self._balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._balance < 1:
+                return False
+
+            self._balance -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests are sent again and how long to wait before that.
+
+    Only idempotent methods are retried, besides POST requests carrying an
+    Idempotency-Key header. Delays grow exponentially from ``backoff`` up to
+    ``max_backoff`` seconds, with full jitter unless jitter is False. A
+    Retry-After header given in seconds takes precedence.
+    """
+    idempotent_methods = ('GET', 'HEAD', 'OPTIONS', 'PUT')
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff=0.1, max_backoff=10, jitter=True, budget=None,
+                 random=random.random, sleep=time.sleep):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget = budget if budget is not None else RetryBudget()
+        self.random = random
+        self.sleep = sleep
+
+    def is_retriable(self, request):
+        if request.method in self.idempotent_methods:
+            return True
+
+        return request.method == 'POST' and 'Idempotency-Key' in request.headers
+
+    def record(self, request):
+        """ Called once for every request, before its first attempt """
+        self.budget.deposit()
+
+    def should_retry(self, request, attempt, response=None):
+        """ Whether attempt (starting from 0) should be followed by another one """
+        if attempt >= self.retries or not self.is_retriable(request):
+            return False
+
+        if response is not None and response.status_code not in self.retry_statuses:
+            return False
+
+        return self.budget.withdraw()
+
+    def delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        if retry_after.isdigit():
+            return min(self.max_backoff, int(retry_after))
+
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            delay = self.random() * delay
+
+        return delay
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+
+import six
+
+__all__ = ['SingleFlight', 'single_flight_for']
+
+
+def single_flight_for(session, url):
+    """ The SingleFlight of the adapter used by session to reach url, if any """
+    return getattr(session.get_adapter(url), 'single_flight', None)
+
+
+class Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls with the same key: the first caller (the leader)
+    runs the function while the others wait for its result or exception.
+
+    The calls and collapsed attributes count the calls that were run and those
+    that waited for another one.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Returns (result, shared), shared telling whether the result was given to more
+        than one caller. Results that were shared should not be modified.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+                self.calls += 1
+            else:
+                call.followers += 1
+                self.collapsed += 1
+
+        if leader:
+            try:
+                call.result = function()
+            except BaseException:
+                # Including KeyboardInterrupt and SystemExit, the followers must
+                # not take the missing result for a successful one
+                call.exc_info = sys.exc_info()
+            finally:
+                # No caller joins the call once it is removed
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.exc_info is not None:
+            six.reraise(*call.exc_info)
+
+        return call.result, not leader or call.followers > 0
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import hashlib
+from datetime import date
+from collections import namedtuple
+
+from .main import AccountIndex
+
+__all__ = ['AccountChange', 'AccountSync']
+
+# account is None for removed accounts
+AccountChange = namedtuple('AccountChange', ['kind', 'uuid', 'account'])
+
+
+def content_hash(resource_data):
+    dumped_data = json.dumps(resource_data, sort_keys=True, default=str)
+    return hashlib.sha1(dumped_data.encode('utf-8')).hexdigest()
+
+
+class AccountSync(object):
+    """
+    Mirrors a listing of accounts, keeping in a sqlite database a snapshot with
+    the uuid, a hash of the resource_data and the expiration status of each one.
+
+    run() reads the listing once, as it is streamed, and yields the accounts that
+    were added, changed or expired since the previous run, followed by those that
+    are no longer listed. The snapshot is rewritten in a single transaction, which
+    is committed only when the listing is fully read: an interrupted run leaves
+    the previous snapshot untouched. Memory use does not depend on the number of
+    accounts.
+    """
+    ADDED = 'added'
+    CHANGED = 'changed'
+    EXPIRED = 'expired'
+    REMOVED = 'removed'
+
+    def __init__(self, path=':memory:'):
+        # Transactions are handled by run
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS account_snapshot '
+            '(uuid TEXT PRIMARY KEY, hash TEXT NOT NULL, expired INTEGER NOT NULL, run INTEGER NOT NULL)'
+        )
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM account_snapshot').fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def run(self, accounts, today=None):
+        """
+        Yields an AccountChange for each account of ``accounts`` (an iterable like
+        the one returned by PassaporteWeb.accounts.all()) that is new, changed or
+        expired, and for each account of the snapshot missing from it.
+        """
+        today = today or date.today().isoformat()
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            run = connection.execute('SELECT COALESCE(MAX(run), 0) + 1 FROM account_snapshot').fetchone()[0]
+            for account in accounts:
+                change = self.update(run, account, today)
+                if change is not None:
+                    yield change
+
+            removed = connection.execute('SELECT uuid FROM account_snapshot WHERE run < ?', (run,))
+            for (uuid,) in removed:
+                yield AccountChange(self.REMOVED, uuid, None)
+
+            connection.execute('DELETE FROM account_snapshot WHERE run < ?', (run,))
+        except BaseException:
+            # Including GeneratorExit, when the run is not consumed to the end
+            connection.execute('ROLLBACK')
+            raise
+
+        connection.execute('COMMIT')
+
+    def update(self, run, account, today):
+        resource_data = account.resource_data
+        digest = content_hash(resource_data)
+        expired = AccountIndex.is_expired(resource_data, today)
+
+        previous = self._connection.execute(
+            'SELECT hash, expired FROM account_snapshot WHERE uuid = ?', (account.uuid,)
+        ).fetchone()
+        self._connection.execute(
+            'INSERT OR REPLACE INTO account_snapshot (uuid, hash, expired, run) VALUES (?, ?, ?, ?)',
+            (account.uuid, digest, int(expired), run),
+        )
+
+        if previous is None:
+            kind = self.ADDED
+        elif expired and not previous[1]:
+            kind = self.EXPIRED
+        elif digest != previous[0]:
+            kind = self.CHANGED
+        else:
+            return None
+
+        return AccountChange(kind, account.uuid, account)
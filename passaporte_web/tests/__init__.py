@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import sys
 from .helpers import use_cassette
 
 from .application import *
@@ -7,3 +8,21 @@ from .service_account import *
 from .notification import *
 from .members import *
 from .history import *
+from .cache import *
+from .transport import *
+from .pagination import *
+from .batch import *
+from .throttle import *
+from .retry import *
+from .circuit import *
+from .instrumentation import *
+from .sync import *
+from .singleflight import *
+
+if sys.version_info >= (3, 6):
+    try:
+        import aiohttp
+    except ImportError:
+        pass
+    else:
+        from .aio import *
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+import json
+import asyncio
+import unittest
+
+import requests
+
+from passaporte_web.aio import (
+    AsyncPassaporteWeb, AsyncIdentity, AsyncIdentityAccounts, AsyncServiceAccount, AsyncNotification, basic_auth
+)
+from api_toolkit.entities import UsingOptions
+from passaporte_web.main import Account
+from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS, StubServerTestMixin
+
+__all__ = ['AsyncPassaporteWebTest']
+
+ACCOUNT_UUID = 'a4c9bce4-2a8c-452f-ae13-0a0b69dfd4ba'
+
+
+class AsyncPassaporteWebTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(AsyncPassaporteWebTest, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        self.app = AsyncPassaporteWeb(
+            host=self.server.url, token=APP_CREDENTIALS['token'], secret=APP_CREDENTIALS['secret']
+        )
+
+        identity_url = '{0}/accounts/api/identities/{1}/'.format(self.server.url, TEST_USER['uuid'])
+        self.identity_data = {
+            'uuid': TEST_USER['uuid'],
+            'email': TEST_USER['email'],
+            'update_info_url': identity_url,
+            'notifications': {'count': 0, 'list': '{0}/notifications/api/'.format(self.server.url)},
+            'accounts': [
+                {'uuid': ACCOUNT_UUID, 'name': 'Test Account', 'plan_slug': 'unittest', 'roles': ['owner']},
+                {'uuid': '1bcde52d-7da8-4800-bd59-dfea96933ce4', 'name': 'Other service'},
+            ],
+        }
+        self.server.routes.update({
+            ('GET', '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])): (200, {}, self.identity_data),
+            ('GET', '/accounts/api/identities/'): (200, {}, self.identity_data),
+            ('OPTIONS', '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])): (
+                200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {'fields': {'first_name': 'CharField'}}
+            ),
+            ('GET', '/accounts/api/auth/'): (200, {}, self.identity_data),
+            ('OPTIONS', '/accounts/api/create/'): (200, {'Allow': 'POST, OPTIONS'}, {}),
+            ('OPTIONS', '/organizations/api/accounts/'): (200, {'Allow': 'GET, HEAD, OPTIONS'}, {}),
+            ('POST', '/notifications/api/'): self.create_notification,
+        })
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.app.close())
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def create_notification(self, request):
+        notification = json.loads(request.body.decode('utf-8'))
+        notification['absolute_url'] = '{0}/notifications/api/1/'.format(self.server.url)
+        return (201, {}, notification)
+
+    def requests_for(self, method, path):
+        return [item for item in self.server.requests if (item.method, item.path) == (method, path)]
+
+    def test_get_user_by_uuid(self):
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+
+        self.assertTrue(isinstance(user, AsyncIdentity))
+        self.assertEqual(user.email, TEST_USER['email'])
+        self.assertEqual(list(user._meta['fields']), ['first_name'])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_get_user_by_email(self):
+        user = self.run_async(self.app.users.get(email=TEST_USER['email']))
+
+        self.assertEqual(user.uuid, TEST_USER['uuid'])
+        self.assertEqual(self.requests_for('GET', '/accounts/api/identities/')[0].query, {
+            'email': TEST_USER['email']
+        })
+
+    def test_get_by_unknown_parameter_raises_TypeError(self):
+        self.assertRaises(TypeError, self.run_async, self.app.users.get(first_name='Myfc ID'))
+
+    def test_get_unknown_user_raises_HTTPError(self):
+        self.assertRaises(requests.HTTPError, self.run_async, self.app.users.get(uuid='001'))
+
+    def test_users_are_not_iterable(self):
+        async def first_user():
+            async for user in self.app.users.all():
+                return user
+
+        self.assertRaises(ValueError, self.run_async, first_user())
+
+    def test_authenticate_uses_user_credentials_only_once(self):
+        user = self.run_async(self.app.users.authenticate(
+            email=TEST_USER['email'], password=TEST_USER['password']
+        ))
+
+        self.assertTrue(isinstance(user, AsyncIdentity))
+        self.assertEqual(user._session, self.app.users._session)
+        self.assertEqual(
+            self.requests_for('GET', '/accounts/api/auth/')[0].headers['Authorization'],
+            basic_auth(TEST_USER['email'], TEST_USER['password'])
+        )
+
+    def test_authenticated_identity_is_not_described_by_the_auth_endpoint(self):
+        self.server.routes[('OPTIONS', '/accounts/api/auth/')] = (200, {'Allow': 'GET, OPTIONS'}, {})
+        user = self.run_async(self.app.users.authenticate(
+            email=TEST_USER['email'], password=TEST_USER['password']
+        ))
+
+        self.assertEqual(user._meta['allowed_methods'], UsingOptions.ALL_METHODS)
+        self.assertEqual(user._meta['fields'], None)
+        self.assertEqual(self.requests_for('OPTIONS', '/accounts/api/auth/'), [])
+
+    def test_authenticated_identity_can_be_saved(self):
+        identity_path = '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])
+        self.server.routes[('PUT', identity_path)] = lambda request: (
+            200, {}, dict(self.identity_data, **json.loads(request.body.decode('utf-8')))
+        )
+        self.identity_data['first_name'] = 'Test'
+        user = self.run_async(self.app.users.authenticate(
+            email=TEST_USER['email'], password=TEST_USER['password']
+        ))
+        user.first_name = 'Identity'
+        updated_user = self.run_async(user.save())
+
+        sent_data = json.loads(self.requests_for('PUT', identity_path)[0].body.decode('utf-8'))
+        self.assertEqual(sent_data['first_name'], 'Identity')
+        self.assertEqual(sent_data['accounts'], self.identity_data['accounts'])
+        self.assertTrue(isinstance(user.accounts, AsyncIdentityAccounts))
+        self.assertEqual(updated_user.first_name, 'Identity')
+
+    def test_authenticate_requires_credentials(self):
+        self.assertRaises(TypeError, self.run_async, self.app.users.authenticate())
+
+    def test_accounts_are_iterated_over_all_pages(self):
+        accounts_path = '/organizations/api/accounts/'
+        next_page = '<{0}{1}?page=2>; rel="next"'.format(self.server.url, accounts_path)
+        self.server.routes[('GET', accounts_path)] = lambda request: (
+            (200, {}, [{'uuid': ACCOUNT_UUID, 'plan_slug': 'unittest', 'account_data': {'name': 'Second'}}])
+            if request.query.get('page') == '2' else
+            (200, {'Link': next_page}, [{'uuid': ACCOUNT_UUID, 'plan_slug': 'unittest', 'account_data': {'name': 'First'}}])
+        )
+
+        async def list_accounts():
+            return [account async for account in self.app.accounts.all()]
+
+        accounts = self.run_async(list_accounts())
+
+        self.assertEqual([account.name for account in accounts], ['First', 'Second'])
+        for account in accounts:
+            self.assertTrue(isinstance(account, AsyncServiceAccount))
+
+    def test_identity_accounts_from_seed(self):
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+        accounts = list(user.accounts.from_seed())
+
+        self.assertTrue(isinstance(accounts[0], AsyncServiceAccount))
+        self.assertTrue(isinstance(accounts[1], Account))
+
+    def test_identity_send_notification(self):
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+        notification = self.run_async(user.send_notification('Notification de teste', tags=['test']))
+
+        self.assertTrue(isinstance(notification, AsyncNotification))
+        self.assertEqual(notification.destination, TEST_USER['uuid'])
+        self.assertEqual(notification.tags, ['test'])
+
+    def test_identity_reuses_its_notifications_collection(self):
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+        self.run_async(user.send_notification('First'))
+        notifications = user._notifications
+        self.run_async(user.send_notification('Second'))
+
+        self.assertTrue(user._notifications is notifications)
+        self.assertEqual(len(self.requests_for('POST', '/notifications/api/')), 2)
+
+    def test_save_sends_only_changed_resources(self):
+        identity_path = '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])
+        self.server.routes[('PUT', identity_path)] = lambda request: (
+            200, {}, dict(self.identity_data, **json.loads(request.body.decode('utf-8')))
+        )
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+
+        self.assertTrue(self.run_async(user.save()) is user)
+        self.assertEqual(self.requests_for('PUT', identity_path), [])
+
+        user.resource_data['first_name'] = 'Identity'
+        self.run_async(user.save(force=True))
+        user.first_name = 'Other'
+        updated_user = self.run_async(user.save())
+
+        self.assertEqual(updated_user.first_name, 'Other')
+        self.assertEqual(
+            [json.loads(item.body.decode('utf-8')) for item in self.requests_for('PUT', identity_path)],
+            [{'first_name': 'Identity'}, {'first_name': 'Other'}]
+        )
+        self.assertEqual(user.changed_fields(), [])
+
+    def test_refresh_is_conditional(self):
+        identity_path = '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])
+        self.server.routes[('GET', identity_path)] = lambda request: (
+            (304, {}, None) if request.headers.get('If-None-Match') == '"1"' else
+            (200, {'ETag': '"1"'}, self.identity_data)
+        )
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+
+        self.assertTrue(self.run_async(user.refresh()) is user)
+        self.assertEqual(self.requests_for('GET', identity_path)[-1].headers['If-None-Match'], '"1"')
+
+        self.identity_data['email'] = 'changed@example.com'
+        user._meta['validators'] = {}
+        refreshed_user = self.run_async(user.refresh())
+
+        self.assertTrue(isinstance(refreshed_user, AsyncIdentity))
+        self.assertEqual(refreshed_user.email, 'changed@example.com')
+        self.assertEqual(list(refreshed_user._meta['fields']), ['first_name'])
+
+    def test_refresh_profile_loads_the_profile(self):
+        profile_path = '/accounts/api/identities/{0}/profile/'.format(TEST_USER['uuid'])
+        self.identity_data['profile_url'] = '{0}{1}'.format(self.server.url, profile_path)
+        self.server.routes.update({
+            ('GET', profile_path): (200, {}, {
+                'bio': 'Bio', 'identity_info_url': self.identity_data['update_info_url'].rstrip('/'),
+            }),
+            ('OPTIONS', profile_path): (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {}),
+        })
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+
+        self.assertEqual(self.run_async(user.refresh_profile()).bio, 'Bio')
+        self.assertEqual(len(self.requests_for('GET', profile_path)), 1)
+
+    def test_clone_keeps_the_asynchronous_collections(self):
+        user = self.run_async(self.app.users.get(uuid=TEST_USER['uuid']))
+        clone = user.clone()
+        clone.email = 'changed@example.com'
+
+        self.assertTrue(isinstance(clone, AsyncIdentity))
+        self.assertTrue(isinstance(clone.accounts, AsyncIdentityAccounts))
+        self.assertEqual([account.uuid for account in clone.accounts.from_seed()], [
+            account.uuid for account in user.accounts.from_seed()
+        ])
+        self.assertEqual(user.email, TEST_USER['email'])
+
+    def test_synchronous_loads_are_not_available(self):
+        self.assertRaises(AttributeError, AsyncIdentity.load_once, self.server.url, None, {}, None, True)
+
+    def test_collections_share_a_single_session(self):
+        self.assertTrue(self.app.accounts._session is self.app.users._session)
+        self.assertTrue(self.app.users._session is self.app.applications._session)
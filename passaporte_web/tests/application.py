@@ -10,14 +10,14 @@ from passaporte_web.main import PassaporteWeb, ServiceAccount, Account, Identity
 from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS
 from passaporte_web.tests.service_account import CanGetServiceAccount
 
-__all__ = ['PassaporteWebTest', 'UsersTest', 'AccountsTest', 'ApplicationsTest']
+__all__ = ['PassaporteWebTest', 'LazyPassaporteWebTest', 'UsersTest', 'AccountsTest', 'ApplicationsTest']
 
 
 class PassaporteWebTest(unittest.TestCase):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
     def test_instance_has_accounts_users_and_applications(self):
         self.assertTrue(hasattr(self.app, 'accounts'))
@@ -29,12 +29,52 @@ class PassaporteWebTest(unittest.TestCase):
         self.assertTrue(hasattr(self.app, 'applications'))
         self.assertTrue(isinstance(self.app.applications, api_toolkit.Collection))
 
+    def test_eager_instance_loads_the_collections_options(self):
+        with use_pw_cassette('application/collections_options') as cassette:
+            PassaporteWeb(eager=True, **APP_CREDENTIALS)
+
+        self.assertEqual(cassette.play_count, 3)
+
+
+class LazyPassaporteWebTest(unittest.TestCase):
+
+    def setUp(self):
+        with use_pw_cassette('application/collections_options') as cassette:
+            self.app = PassaporteWeb(**APP_CREDENTIALS)
+
+        self.construction_requests = cassette.play_count
+
+    def test_instance_is_created_without_requests(self):
+        self.assertEqual(self.construction_requests, 0)
+
+    def test_collection_options_are_loaded_on_first_use(self):
+        with use_pw_cassette('application/collections_options') as cassette:
+            app_users = self.app.users.all()
+            self.assertRaises(ValueError, six.next, app_users)
+
+        self.assertEqual(cassette.play_count, 1)
+        self.assertFalse('GET' in self.app.users._meta['allowed_methods'])
+
+    def test_collection_options_are_loaded_only_once(self):
+        with use_pw_cassette('application/collections_options') as cassette:
+            self.assertRaises(ValueError, six.next, self.app.users.all())
+            self.assertRaises(ValueError, six.next, self.app.users.all())
+
+        self.assertEqual(cassette.play_count, 1)
+
+    def test_explicit_load_options_clears_the_pending_load(self):
+        with use_pw_cassette('application/collections_options') as cassette:
+            self.app.users.load_options()
+            self.app.users.ensure_options()
+
+        self.assertEqual(cassette.play_count, 1)
+
 
 class UsersTest(unittest.TestCase):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
     def test_application_users_are_not_iterable(self):
         app_users = self.app.users.all()
@@ -232,6 +272,17 @@ class UsersTest(unittest.TestCase):
             APP_CREDENTIALS['token'], APP_CREDENTIALS['secret']
         ))
 
+    def test_authentication_does_not_create_a_new_session(self):
+        with use_pw_cassette('user/authenticate_with_email_and_password') as cassette:
+            user = self.app.users.authenticate(email=TEST_USER['email'], password=TEST_USER['password'])
+
+        self.assertEqual(cassette.play_count, 1)
+        self.assertTrue(user._session is self.app.users._session)
+        self.assertTrue(user.accounts._session is self.app.users._session)
+        self.assertEqual(self.app.users._session.auth, (
+            APP_CREDENTIALS['token'], APP_CREDENTIALS['secret']
+        ))
+
 
 class CanLoadServiceAccounts(unittest.TestCase):
 
@@ -264,7 +315,7 @@ class AccountsTest(CanGetServiceAccount, CanLoadServiceAccounts):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
         self.collection = self.app.accounts
 
@@ -284,7 +335,19 @@ class AccountsTest(CanGetServiceAccount, CanLoadServiceAccounts):
             first_account.load_options()
 
         with use_pw_cassette('accounts/update_with_same_data'):
-            updated_account = first_account.save()
+            updated_account = first_account.save(force=True)
+
+    def test_application_accounts_can_be_updated_without_loading_options(self):
+        with use_pw_cassette('application/account_list'):
+            first_account = six.next(self.app.accounts.all())
+
+        self.assertEqual(first_account.expiration, '2014-05-01')
+        self.assertEqual(first_account.changed_fields(), [])
+
+        with use_pw_cassette('accounts/update_with_same_data') as cassette:
+            self.assertTrue(first_account.save() is first_account)
+            first_account.save(force=True)
+            self.assertEqual(cassette.play_count, 1)
 
     def test_application_accounts_cannot_be_created(self):
         with use_pw_cassette('application/account_list'):
@@ -300,7 +363,7 @@ class ApplicationsTest(unittest.TestCase):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
         self.collection = self.app.applications
 
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import json
+import functools
+import time
+import threading
+import unittest
+
+import requests
+
+from passaporte_web.main import Identity, ServiceAccount, Notification
+from passaporte_web.batch import BatchError, iter_batch, run_batch
+from passaporte_web.tests.helpers import TEST_USER, StubServerTestMixin
+
+__all__ = ['RunBatchTest', 'CreateManyTest', 'NotificationFanOutTest']
+
+ACCOUNTS_PATH = '/organizations/api/accounts/'
+
+
+class RunBatchTest(unittest.TestCase):
+
+    def test_results_are_in_the_order_of_the_items(self):
+        def slow_double(value):
+            time.sleep(0.01 * (5 - value))
+            return value * 2
+
+        results = run_batch(slow_double, range(5), max_in_flight=5)
+
+        self.assertEqual(list(results), [0, 2, 4, 6, 8])
+        self.assertEqual(results.succeeded, 5)
+
+    def test_errors_are_kept_per_item(self):
+        def invert(value):
+            return 1.0 / value
+
+        results = run_batch(invert, [1, 0, 2])
+
+        self.assertEqual(results[0], 1.0)
+        self.assertEqual(results[2], 0.5)
+        self.assertTrue(isinstance(results[1], BatchError))
+        self.assertTrue(isinstance(results[1].error, ZeroDivisionError))
+        self.assertEqual((results[1].index, results[1].data), (1, 0))
+        self.assertEqual(results.errors, [results[1]])
+
+    def test_items_in_flight_are_bounded(self):
+        lock = threading.Lock()
+        state = {'in_flight': 0, 'peak': 0}
+
+        def track(value):
+            with lock:
+                state['in_flight'] += 1
+                state['peak'] = max(state['peak'], state['in_flight'])
+            time.sleep(0.01)
+            with lock:
+                state['in_flight'] -= 1
+
+        run_batch(track, range(20), max_in_flight=3)
+
+        self.assertEqual(state['peak'], 3)
+
+    def test_throughput(self):
+        results = run_batch(lambda value: value, range(10), timer=functools.partial(next, iter([0.0, 2.0])))
+
+        self.assertEqual(results.elapsed, 2.0)
+        self.assertEqual(results.throughput, 5.0)
+
+    def test_max_in_flight_must_be_positive(self):
+        self.assertRaises(ValueError, run_batch, str, [], max_in_flight=0)
+
+    def test_results_are_streamed_as_they_complete(self):
+        def wait(value):
+            time.sleep(value)
+            return value
+
+        results = list(iter_batch(wait, [0.1, 0.0], max_in_flight=2))
+
+        self.assertEqual(results, [(1, 0.0, 0.0), (0, 0.1, 0.1)])
+
+    def test_rate_limiter_is_acquired_for_each_item(self):
+        class CountingLimiter(object):
+            acquired = 0
+
+            def acquire(self):
+                self.acquired += 1
+
+        limiter = CountingLimiter()
+        run_batch(str, range(7), rate_limiter=limiter)
+
+        self.assertEqual(limiter.acquired, 7)
+
+    def test_errors_raised_by_the_items_are_raised(self):
+        def items():
+            yield 1
+            raise KeyError('broken')
+
+        self.assertRaises(KeyError, run_batch, str, items(), max_in_flight=1)
+
+
+class CreateManyTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(CreateManyTest, self).setUp()
+        self.server.routes.update({
+            ('OPTIONS', ACCOUNTS_PATH): (200, {'Allow': 'GET, POST, HEAD, OPTIONS'}, {}),
+            ('POST', ACCOUNTS_PATH): self.create_account,
+        })
+        self.existing = set(['Test Account'])
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+
+        self.app = self.make_app()
+
+    def create_account(self, request):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight -= 1
+
+        data = json.loads(request.body.decode('utf-8'))
+        if data['name'] in self.existing:
+            return (409, {}, {'detail': 'Duplicated account'})
+        if data.get('expiration') == 'Primeiro de maio de 2010':
+            return (400, {}, {'field_errors': {'expiration': ['Invalid date']}})
+
+        return (201, {}, {'uuid': data['name'], 'plan_slug': data['plan_slug'], 'account_data': {
+            'uuid': data['name'], 'name': data['name']
+        }, 'expiration': None})
+
+    def test_accounts_are_created_in_order(self):
+        items = [{'name': 'Account {0}'.format(index), 'plan_slug': 'unittest'} for index in range(10)]
+        results = self.app.accounts.create_many(items, max_in_flight=4)
+
+        self.assertEqual(results.succeeded, 10)
+        self.assertEqual([account.name for account in results], [item['name'] for item in items])
+        for account in results:
+            self.assertTrue(isinstance(account, ServiceAccount))
+
+        self.assertTrue(1 < self.peak <= 4)
+
+    def test_failures_do_not_interrupt_the_batch(self):
+        results = self.app.accounts.create_many([
+            {'name': 'Test Account', 'plan_slug': 'unittest'},
+            {'name': 'Back to the future', 'plan_slug': 'unittest', 'expiration': 'Primeiro de maio de 2010'},
+            {'name': 'New account', 'plan_slug': 'unittest'},
+        ])
+
+        self.assertEqual((results.succeeded, results.failed), (1, 2))
+        self.assertTrue(isinstance(results[0].error, requests.HTTPError))
+        self.assertEqual(results[0].error.response.status_code, 409)
+        self.assertEqual(results[1].error.response.status_code, 400)
+        self.assertEqual(results[2].name, 'New account')
+
+    def test_collection_must_accept_creations(self):
+        self.server.routes[('OPTIONS', ACCOUNTS_PATH)] = (200, {'Allow': 'GET, HEAD, OPTIONS'}, {})
+
+        self.assertRaises(ValueError, self.app.accounts.create_many, [{'name': 'New account'}])
+        self.assertEqual([item for item in self.server.requests if item.method == 'POST'], [])
+
+
+class NotificationFanOutTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(NotificationFanOutTest, self).setUp()
+        self.server.routes.update({
+            ('POST', '/notifications/api/'): self.create_notification,
+            ('POST', '/organizations/api/accounts/1/notifications/'): self.create_notification,
+        })
+
+        self.app = self.make_app()
+
+    def create_notification(self, request):
+        notification = json.loads(request.body.decode('utf-8'))
+        if notification.get('destination') == 'unknown':
+            return (400, {}, {'field_errors': {'destination': ['Invalid destination']}})
+
+        notification['path'] = request.path
+        notification['absolute_url'] = '{0}/notifications/api/1/'.format(self.server.url)
+        return (201, {}, notification)
+
+    def make_identity(self):
+        identity = Identity(uuid=TEST_USER['uuid'], notifications={
+            'count': 0, 'list': '{0}/notifications/api/'.format(self.server.url)
+        })
+        identity._session = self.app._session
+        return identity
+
+    def make_service_account(self):
+        account = ServiceAccount(
+            uuid='1', plan_slug='unittest', account_data={'uuid': '1', 'name': 'Test Account'},
+            notifications_url='{0}/organizations/api/accounts/1/notifications/'.format(self.server.url),
+        )
+        account._session = self.app._session
+        account.prepare_collections()
+        return account
+
+    def test_notifications_are_sent_to_every_destination(self):
+        identity = self.make_identity()
+        account = self.make_service_account()
+        destinations = ['a-uuid', identity, account]
+
+        results = dict(
+            (destinations.index(destination), notification) for destination, notification in
+            self.app.send_notifications(u'Notificação de teste', destinations, tags=['test'])
+        )
+
+        self.assertEqual(results[0].destination, 'a-uuid')
+        self.assertEqual(results[1].destination, TEST_USER['uuid'])
+        self.assertEqual(results[2].path, '/organizations/api/accounts/1/notifications/')
+        for notification in results.values():
+            self.assertTrue(isinstance(notification, Notification))
+            self.assertEqual(notification.body, u'Notificação de teste')
+            self.assertEqual(notification.tags, ['test'])
+
+    def test_failures_are_reported_per_destination(self):
+        results = dict(self.app.send_notifications('Notification', ['a-uuid', 'unknown']))
+
+        self.assertTrue(isinstance(results['a-uuid'], Notification))
+        self.assertTrue(isinstance(results['unknown'], BatchError))
+        self.assertEqual(results['unknown'].error.response.status_code, 400)
+
+    def test_notifications_share_the_application_session(self):
+        list(self.app.send_notifications('Notification', ['uuid-{0}'.format(i) for i in range(20)]))
+
+        self.assertEqual(self.app.pool_stats()['requests'], 20)
+        self.assertTrue(self.server.connections <= 8)
+
+    def test_notifications_are_sent_to_listed_accounts(self):
+        self.server.routes.update({
+            ('OPTIONS', ACCOUNTS_PATH): (200, {'Allow': 'GET, POST, HEAD, OPTIONS'}, {}),
+            ('GET', ACCOUNTS_PATH): (200, {}, [{
+                'uuid': str(index), 'plan_slug': 'unittest',
+                'account_data': {'uuid': str(index), 'name': 'Account {0}'.format(index)},
+                'notifications_url': '{0}/organizations/api/accounts/1/notifications/'.format(self.server.url),
+            } for index in range(3)]),
+        })
+        accounts = list(self.app.accounts.all())
+        self.assertFalse(hasattr(accounts[0], 'notifications'))
+
+        results = list(self.app.send_notifications('Notification', accounts))
+
+        self.assertEqual(len(results), 3)
+        for account, notification in results:
+            self.assertTrue(isinstance(notification, Notification))
+            self.assertEqual(notification.path, '/organizations/api/accounts/1/notifications/')
+
+        account = accounts[0]
+        self.assertEqual(account.send_notification('Direct').path, '/organizations/api/accounts/1/notifications/')
+
+    def test_listed_account_records_are_promoted(self):
+        account_url = '{0}{1}1/'.format(self.server.url, ACCOUNTS_PATH)
+        self.server.routes.update({
+            ('OPTIONS', ACCOUNTS_PATH): (200, {'Allow': 'GET, POST, HEAD, OPTIONS'}, {}),
+            ('GET', ACCOUNTS_PATH): (200, {}, [{
+                'uuid': '1', 'plan_slug': 'unittest', 'url': account_url,
+                'account_data': {'uuid': '1', 'name': 'Account 1'},
+            }]),
+            ('OPTIONS', '{0}1/'.format(ACCOUNTS_PATH)): (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {}),
+            ('GET', '{0}1/'.format(ACCOUNTS_PATH)): (200, {}, {
+                'uuid': '1', 'plan_slug': 'unittest', 'url': account_url,
+                'account_data': {'uuid': '1', 'name': 'Account 1'},
+                'notifications_url': '{0}/organizations/api/accounts/1/notifications/'.format(self.server.url),
+            }),
+        })
+        records = list(self.app.accounts.all(lean=True))
+
+        results = list(self.app.send_notifications('Notification', records))
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][1].path, '/organizations/api/accounts/1/notifications/')
+        self.assertFalse(any(request.path == '/notifications/api/' for request in self.server.requests))
+
+    def test_accounts_are_not_notified_as_identities(self):
+        account = ServiceAccount(name='Test Account', uuid='1')
+
+        self.assertRaises(TypeError, list, self.app.send_notifications('Notification', [account]))
+        self.assertRaises(TypeError, list, self.app.send_notifications('Notification', [object()]))
+        self.assertEqual(self.server.requests, [])
+
+    def test_identity_reuses_its_notifications_collection(self):
+        identity = self.make_identity()
+        identity.send_notification('First')
+        notifications = identity._notifications
+        identity.send_notification('Second')
+
+        self.assertTrue(identity._notifications is notifications)
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+import os
+import six
+import json
+import shutil
+import tempfile
+import unittest
+
+from .helpers import use_cassette as use_pw_cassette
+
+from passaporte_web.cache import LRUCache, SQLiteCache, IdentityCache
+from passaporte_web.main import PassaporteWeb, Profile, Identity, SharedOptions, url_pattern
+from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS, StubServer
+
+__all__ = [
+    'LRUCacheTest', 'SQLiteCacheTest', 'OptionsCacheTest', 'SchemaSnapshotTest', 'SchemaWithoutItemsTest',
+    'IdentityCacheTest', 'SharedIdentityCacheTest',
+]
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_get_returns_default_for_unknown_keys(self):
+        cache = LRUCache()
+        self.assertEqual(cache.get('unknown'), None)
+        self.assertEqual(cache.get('unknown', 'default'), 'default')
+
+    def test_least_recently_used_item_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_items_expire_after_ttl(self):
+        timer = FakeTimer()
+        cache = LRUCache(ttl=10, timer=timer)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=60)
+
+        timer.now += 10
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(cache.items(), [('b', 2)])
+
+    def test_delete_and_clear(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        cache.delete('a')
+        self.assertEqual(cache.get('a'), None)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class SQLiteCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.timer = FakeTimer()
+        self.cache = SQLiteCache(os.path.join(self.directory, 'cache.db'), ttl=10, timer=self.timer)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_values_are_stored_as_json(self):
+        self.cache.set('a', {'name': 'value', 'items': [1, 2]})
+        self.assertEqual(self.cache.get('a'), {'name': 'value', 'items': [1, 2]})
+        self.assertEqual(self.cache.get('unknown', 'default'), 'default')
+
+    def test_items_expire_after_ttl(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=60)
+
+        self.timer.now += 10
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.items(), [('b', 2)])
+
+    def test_tuple_keys(self):
+        self.cache.set(('Profile', 'http://example.com/'), 1)
+        self.assertEqual(self.cache.get(('Profile', 'http://example.com/')), 1)
+        self.assertEqual(self.cache.items(), [(('Profile', 'http://example.com/'), 1)])
+
+    def test_delete_and_clear(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+
+        self.cache.delete('a')
+        self.assertEqual(self.cache.get('a'), None)
+
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+
+class OptionsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        SharedOptions.options_cache = LRUCache()
+
+        with use_pw_cassette('application/collections_options'):
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
+
+        with use_pw_cassette('user/get_by_uuid'):
+            self.user = self.app.users.get(uuid=TEST_USER['uuid'])
+
+    def tearDown(self):
+        SharedOptions.options_cache = None
+
+    def test_url_pattern_replaces_identifiers(self):
+        self.assertEqual(
+            url_pattern('http://example.com/accounts/api/identities/{0}/?x=1'.format(TEST_USER['uuid'])),
+            'http://example.com/accounts/api/identities/{id}/'
+        )
+        self.assertEqual(
+            url_pattern('http://example.com/notifications/api/42/'),
+            'http://example.com/notifications/api/{id}/'
+        )
+
+    def test_load_uses_the_cached_options(self):
+        with use_pw_cassette('profile/read') as cassette:
+            first_profile = Profile.load(self.user.profile_url, session=self.user._session)
+
+        self.assertEqual(cassette.play_count, 2)
+
+        with use_pw_cassette('profile/read') as cassette:
+            second_profile = Profile.load(self.user.profile_url, session=self.user._session)
+
+        self.assertEqual(cassette.play_count, 1)
+        self.assertEqual(sorted(second_profile._meta['fields']), sorted(first_profile._meta['fields']))
+        self.assertEqual(second_profile._meta['allowed_methods'], first_profile._meta['allowed_methods'])
+
+    def test_cached_fields_are_not_shared_between_instances(self):
+        with use_pw_cassette('profile/read'):
+            first_profile = Profile.load(self.user.profile_url, session=self.user._session)
+
+        with use_pw_cassette('profile/read'):
+            second_profile = Profile.load(self.user.profile_url, session=self.user._session)
+
+        second_profile._meta['fields'].append('cpf')
+        self.assertFalse('cpf' in first_profile._meta['fields'])
+
+    def test_lazy_collections_use_the_cached_options(self):
+        with use_pw_cassette('application/collections_options') as cassette:
+            app = PassaporteWeb(**APP_CREDENTIALS)
+            self.assertRaises(ValueError, six.next, app.users.all())
+
+        self.assertEqual(cassette.play_count, 0)
+
+    def test_explicit_load_options_refreshes_the_cache(self):
+        SharedOptions.options_cache.clear()
+
+        with use_pw_cassette('application/collections_options') as cassette:
+            self.app.users.load_options()
+
+        self.assertEqual(cassette.play_count, 1)
+        self.assertEqual(len(SharedOptions.options_cache), 1)
+
+    def test_failed_options_are_not_cached(self):
+        SharedOptions.options_cache.clear()
+        profile_path = '/accounts/api/identities/{0}/profile/'.format(TEST_USER['uuid'])
+
+        with StubServer({('OPTIONS', profile_path): (401, {}, {'detail': 'Unauthorized'})}) as server:
+            profile = Profile(identity_info_url='{0}/accounts/api/identities/{1}'.format(server.url, TEST_USER['uuid']))
+            profile._session = self.app._session
+            profile.load_options()
+            self.assertEqual(len(SharedOptions.options_cache), 0)
+
+            server.routes[('OPTIONS', profile_path)] = (
+                200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {'fields': {'bio': 'CharField'}}
+            )
+            profile.load_options()
+
+        self.assertEqual(SharedOptions.options_cache.get(profile.options_cache_key())['fields'], ['bio'])
+
+
+class SchemaSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        SharedOptions.options_cache = LRUCache()
+        self.directory = tempfile.mkdtemp()
+        self.schema_path = os.path.join(self.directory, 'schema.json')
+
+        with use_pw_cassette('application/collections_options'):
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
+
+        with use_pw_cassette('user/get_by_uuid'):
+            self.user = self.app.users.get(uuid=TEST_USER['uuid'])
+
+        with use_pw_cassette('profile/read'):
+            self.profile = self.user.profile
+
+    def tearDown(self):
+        SharedOptions.options_cache = None
+        shutil.rmtree(self.directory)
+
+    def test_dump_includes_collections_and_discovered_resources(self):
+        self.app.dump_schema(self.schema_path)
+
+        with open(self.schema_path) as schema_file:
+            schema = json.load(schema_file)
+
+        kinds = sorted(entry['kind'] for entry in schema['entries'])
+        self.assertEqual(kinds, ['Identity', 'PWebCollection', 'PWebCollection', 'Profile', 'Users'])
+
+    def test_dump_without_options_cache_includes_the_collections(self):
+        SharedOptions.options_cache = None
+        self.app.dump_schema(self.schema_path)
+
+        with open(self.schema_path) as schema_file:
+            schema = json.load(schema_file)
+
+        self.assertEqual(len(schema['entries']), 3)
+
+    def test_new_process_starts_without_discovery(self):
+        self.app.dump_schema(self.schema_path)
+        SharedOptions.options_cache = None
+
+        with use_pw_cassette('application/collections_options') as cassette:
+            app = PassaporteWeb(schema=self.schema_path, **APP_CREDENTIALS)
+            self.assertRaises(ValueError, six.next, app.users.all())
+
+        self.assertEqual(cassette.play_count, 0)
+
+        with use_pw_cassette('profile/read') as cassette:
+            profile = Profile.load(self.user.profile_url, session=self.user._session)
+
+        self.assertEqual(cassette.play_count, 1)
+        self.assertEqual(sorted(profile._meta['fields']), sorted(self.profile._meta['fields']))
+
+    def test_unknown_schema_version_is_rejected(self):
+        with open(self.schema_path, 'w') as schema_file:
+            json.dump({'version': 0, 'entries': []}, schema_file)
+
+        self.assertRaises(ValueError, self.app.load_schema, self.schema_path)
+
+    def test_refresh_updates_stale_entries(self):
+        SharedOptions.options_cache.clear()
+        with use_pw_cassette('application/collections_options'):
+            for collection in self.app.collections:
+                collection.load_options()
+
+        users_key = self.app.users.options_cache_key()
+        stale_meta = dict(SharedOptions.options_cache.get(users_key), allowed_methods='GET')
+        SharedOptions.options_cache.set(users_key, stale_meta)
+
+        with use_pw_cassette('application/collections_options'):
+            stale_keys = self.app.refresh_schema()
+
+        self.assertEqual(stale_keys, [users_key])
+        self.assertEqual(
+            SharedOptions.options_cache.get(users_key)['allowed_methods'],
+            self.app.users._meta['allowed_methods']
+        )
+
+    def test_refresh_can_run_in_background(self):
+        SharedOptions.options_cache.clear()
+        with use_pw_cassette('application/collections_options'):
+            self.app.users.load_options()
+
+        with use_pw_cassette('application/collections_options') as cassette:
+            self.app.refresh_schema(background=True).join()
+
+        self.assertEqual(cassette.play_count, 1)
+
+
+class GetSetCache(object):
+    """ A cache implementing only the interface required by LRUCache """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+
+class SchemaWithoutItemsTest(unittest.TestCase):
+
+    def setUp(self):
+        SharedOptions.options_cache = GetSetCache()
+        self.directory = tempfile.mkdtemp()
+        self.schema_path = os.path.join(self.directory, 'schema.json')
+
+        with use_pw_cassette('application/collections_options'):
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
+
+    def tearDown(self):
+        SharedOptions.options_cache = None
+        shutil.rmtree(self.directory)
+
+    def test_dump_includes_the_collections(self):
+        self.app.dump_schema(self.schema_path)
+
+        with open(self.schema_path) as schema_file:
+            schema = json.load(schema_file)
+
+        kinds = sorted(entry['kind'] for entry in schema['entries'])
+        self.assertEqual(kinds, ['PWebCollection', 'PWebCollection', 'Users'])
+
+    def test_refresh_updates_stale_collection_entries(self):
+        users_key = self.app.users.options_cache_key()
+        stale_meta = dict(SharedOptions.options_cache.get(users_key), allowed_methods='GET')
+        SharedOptions.options_cache.set(users_key, stale_meta)
+
+        with use_pw_cassette('application/collections_options'):
+            stale_keys = self.app.refresh_schema()
+
+        self.assertEqual(stale_keys, [users_key])
+
+
+class IdentityCacheTest(unittest.TestCase):
+
+    def make_identity_cache(self):
+        return IdentityCache(ttl=60, maxsize=10)
+
+    def setUp(self):
+        self.identity_cache = self.make_identity_cache()
+        with use_pw_cassette('application/collections_options'):
+            self.app = PassaporteWeb(eager=True, identity_cache=self.identity_cache, **APP_CREDENTIALS)
+
+        with use_pw_cassette('user/get_by_uuid'):
+            self.user = self.app.users.get(uuid=TEST_USER['uuid'])
+
+    def test_cached_identities_are_loaded_without_requests(self):
+        with use_pw_cassette('user/get_by_uuid') as cassette:
+            user = self.app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertEqual(cassette.play_count, 0)
+        self.assertTrue(isinstance(user, Identity))
+        self.assertEqual(user.resource_data, self.user.resource_data)
+        self.assertEqual(sorted(user._meta['fields']), sorted(self.user._meta['fields']))
+        self.assertTrue(user._session is self.app._session)
+        self.assertEqual(len(list(user.accounts.from_seed())), 4)
+        self.assertEqual(self.identity_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_identities_loaded_by_email_are_cached(self):
+        with use_pw_cassette('user/get_by_email'):
+            user = self.app.users.get(email=TEST_USER['email'])
+
+        with use_pw_cassette('user/get_by_email') as cassette:
+            cached_user = self.app.users.get(email=TEST_USER['email'])
+
+        self.assertEqual(cassette.play_count, 0)
+        self.assertEqual(cached_user.resource_data, user.resource_data)
+
+    def test_changing_an_identity_does_not_change_the_cache(self):
+        self.user.first_name = 'Changed'
+        user = self.app.users.get(uuid=TEST_USER['uuid'])
+        user.last_name = 'Changed'
+
+        cached_user = self.app.users.get(uuid=TEST_USER['uuid'])
+        self.assertNotEqual(cached_user.first_name, 'Changed')
+        self.assertNotEqual(cached_user.last_name, 'Changed')
+
+    def test_invalidated_identities_are_loaded_again(self):
+        self.identity_cache.invalidate(TEST_USER['uuid'])
+
+        with use_pw_cassette('user/get_by_uuid') as cassette:
+            self.app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertEqual(cassette.play_count, 2)
+        self.assertEqual(self.identity_cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_saved_identities_are_loaded_again(self):
+        self.user.send_partner_news = False
+        self.user.send_myfreecomm_news = False
+        with use_pw_cassette('user/update'):
+            updated_user = self.user.save()
+
+        self.assertTrue(updated_user._identity_cache is self.identity_cache)
+        with use_pw_cassette('user/get_by_uuid') as cassette:
+            self.app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertEqual(cassette.play_count, 2)
+        self.assertEqual(self.identity_cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_lookups_with_other_parameters_are_not_cached(self):
+        with use_pw_cassette('user/get_user_including_expired_accounts') as cassette:
+            user = self.app.users.get(email=TEST_USER['email'], include_expired_accounts=True)
+
+        self.assertEqual(cassette.play_count, 2)
+        self.assertEqual(len(list(user.accounts.from_seed())), 8)
+        self.assertEqual(self.identity_cache.stats(), {'hits': 0, 'misses': 1})
+
+
+class SharedIdentityCacheTest(IdentityCacheTest):
+
+    def make_identity_cache(self):
+        self.directory = tempfile.mkdtemp()
+        backend = SQLiteCache(os.path.join(self.directory, 'identities.db'), ttl=60)
+        return IdentityCache(backend=backend)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
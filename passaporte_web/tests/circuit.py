@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import requests
+
+from passaporte_web.circuit import CircuitBreaker, CircuitOpenError, endpoint_family
+from passaporte_web.tests.helpers import TEST_USER, StubServerTestMixin
+
+__all__ = ['EndpointFamilyTest', 'CircuitBreakerTest', 'CircuitBreakerTransportTest']
+
+HOST = 'http://sandbox.app.passaporteweb.com.br'
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class EndpointFamilyTest(unittest.TestCase):
+
+    def test_families(self):
+        account = '/organizations/api/accounts/a4c9bce4-2a8c-452f-ae13-0a0b69dfd4ba/'
+        identity = '/accounts/api/identities/a4c9bce4-2a8c-452f-ae13-0a0b69dfd4ba/'
+        families = [
+            (identity, 'identities'),
+            (identity + 'profile/', 'identities'),
+            ('/accounts/api/auth/', 'identities'),
+            ('/accounts/api/create/', 'identities'),
+            (account, 'accounts'),
+            ('/organizations/api/identities/a4c9bce4-2a8c-452f-ae13-0a0b69dfd4ba/accounts/', 'accounts'),
+            (account + 'members/', 'members'),
+            ('/notifications/api/accounts/a4c9bce4-2a8c-452f-ae13-0a0b69dfd4ba/', 'notifications'),
+            ('/applications/api/', 'applications'),
+            ('/other/', 'other'),
+        ]
+
+        for path, family in families:
+            self.assertEqual(endpoint_family(HOST + path + '?page=2'), family)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.transitions = []
+        self.breaker = CircuitBreaker(
+            failure_threshold=3, reset_timeout=10, timer=self.timer,
+            on_state_change=lambda *transition: self.transitions.append(transition)
+        )
+        self.url = HOST + '/accounts/api/identities/'
+
+    def request(self, status):
+        family = self.breaker.before_request(self.url)
+        self.breaker.after_request(family, status)
+
+    def open_circuit(self):
+        for i in range(3):
+            self.request(503)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.request(503)
+        self.request(None)
+        self.assertEqual(self.breaker.state('identities'), CircuitBreaker.CLOSED)
+
+        self.request(500)
+        self.assertEqual(self.breaker.state('identities'), CircuitBreaker.OPEN)
+        self.assertEqual(self.transitions, [('identities', 'closed', 'open')])
+
+    def test_successes_reset_the_failure_count(self):
+        for status in (503, 503, 200, 503, 503, 404):
+            self.request(status)
+
+        self.assertEqual(self.breaker.state('identities'), CircuitBreaker.CLOSED)
+
+    def test_open_circuit_fails_fast(self):
+        self.open_circuit()
+        self.timer.now += 4
+
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.before_request(self.url)
+
+        self.assertEqual(context.exception.family, 'identities')
+        self.assertEqual(context.exception.retry_after, 6)
+        self.assertTrue(isinstance(context.exception, requests.RequestException))
+
+    def test_other_families_are_not_affected(self):
+        self.open_circuit()
+
+        self.assertEqual(self.breaker.before_request(HOST + '/organizations/api/accounts/'), 'accounts')
+        self.assertEqual(self.breaker.states(), {'identities': 'open', 'accounts': 'closed'})
+
+    def test_half_open_circuit_allows_a_single_probe(self):
+        self.open_circuit()
+        self.timer.now += 10
+
+        family = self.breaker.before_request(self.url)
+        self.assertEqual(self.breaker.state(family), CircuitBreaker.HALF_OPEN)
+        self.assertRaises(CircuitOpenError, self.breaker.before_request, self.url)
+
+    def test_successful_probe_closes_the_circuit(self):
+        self.open_circuit()
+        self.timer.now += 10
+        self.request(200)
+
+        self.assertEqual(self.breaker.state('identities'), CircuitBreaker.CLOSED)
+        self.assertEqual(self.transitions[1:], [
+            ('identities', 'open', 'half_open'), ('identities', 'half_open', 'closed')
+        ])
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open_circuit()
+        self.timer.now += 10
+        self.request(503)
+
+        self.assertEqual(self.breaker.state('identities'), CircuitBreaker.OPEN)
+        self.timer.now += 5
+        self.assertRaises(CircuitOpenError, self.breaker.before_request, self.url)
+
+
+class CircuitBreakerTransportTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(CircuitBreakerTransportTest, self).setUp()
+        self.server.routes.update({
+            ('OPTIONS', '/accounts/api/create/'): (200, {'Allow': 'POST, OPTIONS'}, {}),
+            ('GET', '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])): (
+                503, {}, {'detail': 'Service unavailable'}
+            ),
+            ('OPTIONS', '/applications/api/'): (200, {'Allow': 'GET, OPTIONS'}, {}),
+        })
+
+        self.timer = FakeTimer()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, timer=self.timer)
+        self.app = self.make_app(circuit_breaker=self.breaker)
+
+    def test_requests_fail_fast_while_the_circuit_is_open(self):
+        for i in range(2):
+            self.assertRaises(requests.HTTPError, self.app.users.get, uuid=TEST_USER['uuid'])
+
+        requests_sent = len(self.server.requests)
+        self.assertRaises(CircuitOpenError, self.app.users.get, uuid=TEST_USER['uuid'])
+        self.assertEqual(len(self.server.requests), requests_sent)
+
+        self.app.applications.load_options()
+        self.assertEqual(self.app.pool_stats()['circuits'], {
+            'identities': 'open', 'applications': 'closed'
+        })
+
+    def test_circuit_breaker_defaults(self):
+        app = self.make_app(circuit_breaker=True)
+
+        adapter = app._session.get_adapter(self.server.url)
+        self.assertTrue(isinstance(adapter.circuit_breaker, CircuitBreaker))
+        self.assertEqual(app.pool_stats()['circuits'], {})
@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 import os
+import json
+import threading
+from collections import namedtuple
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlsplit, parse_qsl
 from vcr import VCR
 
-__all__ = ['use_cassette']
+from passaporte_web.main import PassaporteWeb
+
+__all__ = ['use_cassette', 'StubServer', 'StubServerTestMixin']
 
 def use_cassette(*args, **kwargs):
     return VCR(
@@ -29,3 +37,105 @@ APP_CREDENTIALS = {
     'token': 'qxRSNcIdeA',
     'secret': '1f0AVCZPJbRndF9FNSGMOWMfH9KMUDaX',
 }
+
+
+class StubServer(object):
+    """
+    A local HTTP server answering with canned JSON responses.
+
+    Routes map (method, path) to a (status, headers, content) tuple or to a
+    callable receiving the StubRequest and returning such a tuple.
+    """
+
+    def __init__(self, routes=None):
+        self.routes = dict(routes or {})
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = StubHTTPServer(('127.0.0.1', 0), StubRequestHandler)
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self._server.server_address)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def respond(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+        route = self.routes.get((request.method, request.path), (404, {}, {'detail': 'Not found'}))
+        if callable(route):
+            route = route(request)
+
+        return route
+
+
+class StubServerTestMixin(object):
+    """
+    Runs a StubServer, as self.server, around each test. make_app gives a
+    PassaporteWeb client of it with the test credentials.
+    """
+
+    def setUp(self):
+        super(StubServerTestMixin, self).setUp()
+        self.server = StubServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def make_app(self, **kwargs):
+        return PassaporteWeb(
+            host=self.server.url, token=APP_CREDENTIALS['token'], secret=APP_CREDENTIALS['secret'], **kwargs
+        )
+
+
+StubRequest = namedtuple('StubRequest', ['method', 'path', 'query', 'headers', 'body'])
+
+
+class StubHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.stub.connected()
+
+    def handle_request(self):
+        url_pieces = urlsplit(self.path)
+        content_length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(content_length) if content_length else None
+        request = StubRequest(
+            self.command, url_pieces.path, dict(parse_qsl(url_pieces.query)), self.headers, body
+        )
+
+        status, headers, content = self.server.stub.respond(request)
+        payload = b'' if content is None else json.dumps(content).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_OPTIONS = do_POST = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, *args):
+        pass
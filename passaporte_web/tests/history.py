@@ -1,21 +1,25 @@
 # -*- coding: utf-8 -*-
+import os
 import six
+import shutil
+import tempfile
 import unittest
 
 import requests
 from .helpers import use_cassette as use_pw_cassette
 
-from passaporte_web.main import PassaporteWeb, PWebResource, PWebCollection
-from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS
+from passaporte_web.main import PassaporteWeb, PWebResource, PWebCollection, ServiceAccount
+from passaporte_web.history import HistoryCheckpoints, HistoryConsumer
+from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS, StubServerTestMixin
 
-__all__ = ['AccountHistoryTest']
+__all__ = ['AccountHistoryTest', 'HistoryConsumerTest']
 
 
 class AccountHistoryTest(unittest.TestCase):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
         with use_pw_cassette('user/get_by_uuid'):
             self.user = self.app.users.get(uuid=TEST_USER['uuid'])
@@ -40,3 +44,112 @@ class AccountHistoryTest(unittest.TestCase):
             self.assertTrue('plan_slug' in i.resource_data)
             self.assertTrue('external_id' in i.resource_data)
 
+
+
+class HistoryConsumerTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(HistoryConsumerTest, self).setUp()
+        self.history = {
+            '1': [self.entry('2014-01-01 10:00:00', 'free'), self.entry('2014-01-02 10:00:00', 'paid')],
+            '2': [self.entry('2014-01-03 10:00:00', 'free')],
+        }
+        for uuid in self.history:
+            self.server.routes[('GET', self.history_path(uuid))] = self.list_history
+
+        self.app = self.make_app()
+        self.accounts = [self.make_account(uuid) for uuid in sorted(self.history)]
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoints.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entry(self, created_at, plan_slug):
+        return {'created_at': created_at, 'plan_slug': plan_slug, 'expiration': None}
+
+    def history_path(self, uuid):
+        return '/organizations/api/accounts/{0}/history/'.format(uuid)
+
+    def make_account(self, uuid):
+        account = ServiceAccount(
+            uuid=uuid, name='Account {0}'.format(uuid), plan_slug='free',
+            history_url=self.server.url + self.history_path(uuid),
+        )
+        account._session = self.app._session
+        return account
+
+    def list_history(self, request):
+        return (200, {}, self.history[request.path.split('/')[-3]])
+
+    def consume(self, consumer):
+        return [(record.account.uuid, record.entry.plan_slug) for record in consumer.consume(self.accounts)]
+
+    def test_only_new_entries_are_consumed(self):
+        consumer = HistoryConsumer(HistoryCheckpoints(self.path))
+
+        self.assertEqual(sorted(self.consume(consumer)), [('1', 'free'), ('1', 'paid'), ('2', 'free')])
+        self.assertEqual(self.consume(consumer), [])
+
+        self.history['1'].append(self.entry('2014-01-05 10:00:00', 'premium'))
+        self.assertEqual(self.consume(consumer), [('1', 'premium')])
+
+    def test_checkpoints_are_persisted(self):
+        checkpoints = HistoryCheckpoints(self.path)
+        list(HistoryConsumer(checkpoints).consume(self.accounts))
+        checkpoints.close()
+
+        checkpoints = HistoryCheckpoints(self.path)
+        self.assertEqual(checkpoints.get('2')[0], '2014-01-03 10:00:00')
+        self.assertEqual(self.consume(HistoryConsumer(checkpoints)), [])
+
+    def test_entries_with_the_checkpoint_timestamp_are_not_lost(self):
+        consumer = HistoryConsumer()
+        list(consumer.consume(self.accounts))
+
+        self.history['2'].append(self.entry('2014-01-03 10:00:00', 'paid'))
+        self.assertEqual(self.consume(consumer), [('2', 'paid')])
+        self.assertEqual(len(consumer.checkpoints.get('2')[1]), 2)
+
+    def test_entries_are_consumed_oldest_first(self):
+        self.history['1'].reverse()
+        consumer = HistoryConsumer()
+
+        records = [record for record in self.consume(consumer) if record[0] == '1']
+        self.assertEqual(records, [('1', 'free'), ('1', 'paid')])
+
+    def test_checkpoint_is_advanced_only_after_the_entries_are_consumed(self):
+        consumer = HistoryConsumer(max_in_flight=1)
+        records = consumer.consume(self.accounts[:1])
+        six.next(records)
+        records.close()
+
+        self.assertEqual(consumer.checkpoints.get('1'), None)
+        self.assertEqual(len(self.consume(consumer)), 3)
+
+    def test_newest_first_stops_at_the_checkpoint(self):
+        path = self.history_path('1')
+        self.history['1'].reverse()
+        self.server.routes[('GET', path)] = lambda request: (
+            (200, {'Link': '<{0}{1}?page=2>; rel="next"'.format(self.server.url, path)}, self.history['1'])
+            if request.query.get('page') != '2' else (200, {}, [self.entry('2013-01-01 10:00:00', 'old')])
+        )
+        self.accounts = self.accounts[:1]
+        consumer = HistoryConsumer(newest_first=True)
+        consumer.checkpoints.set('1', '2014-01-01 12:00:00', [])
+
+        self.assertEqual(self.consume(consumer), [('1', 'paid')])
+        self.assertEqual(
+            len([request for request in self.server.requests if request.path == path]), 1
+        )
+
+    def test_failed_accounts_are_reported(self):
+        self.accounts.append(self.make_account('3'))
+        consumer = HistoryConsumer()
+
+        self.assertEqual(len(self.consume(consumer)), 3)
+        self.assertEqual(len(consumer.errors), 1)
+        self.assertEqual(consumer.errors[0].data.uuid, '3')
+        self.assertTrue(isinstance(consumer.errors[0].error, requests.HTTPError))
+        self.assertEqual(consumer.checkpoints.get('3'), None)
@@ -1,19 +1,20 @@
 # -*- coding: utf-8 -*-
+import json
 import unittest
 
 import requests
 from .helpers import use_cassette as use_pw_cassette
 
-from passaporte_web.main import PassaporteWeb, Identity, Profile
-from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS
+from passaporte_web.main import PassaporteWeb, Identity, Profile, AccountMember
+from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS, StubServerTestMixin
 
-__all__ = ['IdentityTest']
+__all__ = ['IdentityTest', 'ProfileRevalidationTest', 'ChangeTrackingTest']
 
 class IdentityTest(unittest.TestCase):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
         with use_pw_cassette('user/get_by_uuid'):
             self.user = self.app.users.get(uuid=TEST_USER['uuid'])
@@ -24,15 +25,34 @@ class IdentityTest(unittest.TestCase):
 
         self.assertTrue(isinstance(profile, Profile))
 
+    def test_user_profile_is_loaded_only_once(self):
+        with use_pw_cassette('profile/read') as cassette:
+            profile = self.user.profile
+            self.assertTrue(self.user.profile is profile)
+            self.assertEqual(cassette.play_count, 2)
+
     def test_user_profile_can_be_updated_with_same_data(self):
         with use_pw_cassette('profile/read'):
             profile = self.user.profile
 
         with use_pw_cassette('profile/update_with_same_data'):
-            profile = profile.save()
+            profile = profile.save(force=True)
 
         self.assertTrue(isinstance(profile, Profile))
 
+    def test_unchanged_user_profile_is_not_sent(self):
+        with use_pw_cassette('profile/read'):
+            profile = self.user.profile
+
+        with use_pw_cassette('profile/update_with_same_data') as cassette:
+            self.assertTrue(profile.save() is profile)
+            self.assertEqual(cassette.play_count, 0)
+
+        profile.bio = u'Um usuário usado em testes'
+        self.assertEqual(profile.changed_fields(), ['bio'])
+        profile.bio = None
+        self.assertEqual(profile.changed_fields(), [])
+
     def test_user_profile_can_be_updated(self):
         with use_pw_cassette('profile/read'):
             profile = self.user.profile
@@ -52,11 +72,11 @@ class IdentityTest(unittest.TestCase):
             profile = self.user.profile
 
         with use_pw_cassette('profile/update_without_permissions'):
-            self.assertRaises(requests.HTTPError, profile.save)
+            self.assertRaises(requests.HTTPError, profile.save, force=True)
 
     def test_user_info_can_be_updated_with_same_data(self):
         with use_pw_cassette('user/update_with_same_data'):
-            user = self.user.save()
+            user = self.user.save(force=True)
 
         self.assertTrue(isinstance(user, Identity))
 
@@ -91,5 +111,187 @@ class IdentityTest(unittest.TestCase):
 
     def test_application_must_have_permission_to_update_user_info(self):
         with use_pw_cassette('user/update_without_permissions'):
-            self.assertRaises(requests.HTTPError, self.user.save)
+            self.assertRaises(requests.HTTPError, self.user.save, force=True)
+
+
+
+class ProfileRevalidationTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(ProfileRevalidationTest, self).setUp()
+        self.identity_path = '/accounts/api/identities/{0}'.format(TEST_USER['uuid'])
+        self.profile_path = '{0}/profile/'.format(self.identity_path)
+        self.server.routes.update({
+            ('GET', self.profile_path): self.read_profile,
+            ('PUT', self.profile_path): self.update_profile,
+            ('OPTIONS', self.profile_path): (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {
+                'fields': {'bio': 'CharField'}
+            }),
+            ('GET', '{0}/'.format(self.identity_path)): (200, {}, {
+                'uuid': TEST_USER['uuid'], 'first_name': 'Identity',
+                'update_info_url': '{0}{1}/'.format(self.server.url, self.identity_path),
+            }),
+        })
+        self.headers = {'ETag': '"v1"', 'Last-Modified': 'Mon, 12 Oct 2026 10:00:00 GMT'}
+        self.bio = u'Primeira versão'
+
+        self.app = self.make_app()
+        self.user = Identity(
+            uuid=TEST_USER['uuid'], profile_url='{0}{1}'.format(self.server.url, self.profile_path),
+            update_info_url='{0}{1}/'.format(self.server.url, self.identity_path),
+        )
+        self.user._session = self.app._session
+
+    def read_profile(self, request):
+        # If-None-Match takes precedence over If-Modified-Since
+        if 'If-None-Match' in request.headers:
+            not_modified = request.headers['If-None-Match'] == self.headers.get('ETag')
+        else:
+            not_modified = request.headers.get('If-Modified-Since') == self.headers.get('Last-Modified')
+
+        if not_modified:
+            return (304, self.headers, None)
+
+        return (200, self.headers, self.profile_data())
+
+    def profile_data(self):
+        return {'bio': self.bio, 'identity_info_url': '{0}{1}'.format(self.server.url, self.identity_path)}
+
+    def update_profile(self, request):
+        self.bio = json.loads(request.body.decode('utf-8'))['bio']
+        self.headers['ETag'] = '"v2"'
+        return (200, self.headers, self.profile_data())
+
+    def profile_requests(self):
+        return [item for item in self.server.requests if item.path == self.profile_path]
+
+    def test_unmodified_profile_is_revalidated_with_etag(self):
+        profile = self.user.profile
+        self.assertTrue(self.user.refresh_profile() is profile)
+
+        request = self.profile_requests()[-1]
+        self.assertEqual(request.method, 'GET')
+        self.assertEqual(request.headers['If-None-Match'], '"v1"')
+
+    def test_unmodified_profile_is_revalidated_with_last_modified(self):
+        del self.headers['ETag']
+        profile = self.user.profile
+        self.assertTrue(self.user.refresh_profile() is profile)
+
+        request = self.profile_requests()[-1]
+        self.assertEqual(request.headers['If-Modified-Since'], 'Mon, 12 Oct 2026 10:00:00 GMT')
+        self.assertFalse('If-None-Match' in request.headers)
+
+    def test_modified_profile_is_loaded_again(self):
+        profile = self.user.profile
+        self.headers['ETag'] = '"v2"'
+        self.bio = u'Segunda versão'
+
+        refreshed = self.user.refresh_profile()
+
+        self.assertFalse(refreshed is profile)
+        self.assertTrue(self.user.profile is refreshed)
+        self.assertEqual(refreshed.bio, u'Segunda versão')
+        self.assertEqual(refreshed._meta['allowed_methods'], profile._meta['allowed_methods'])
+        self.assertEqual(list(refreshed._meta['fields']), ['bio'])
+
+    def test_saved_profile_is_not_revalidated_with_previous_validators(self):
+        profile = self.user.profile
+        profile.bio = u'Segunda versão'
+        saved_profile = profile.save()
+
+        self.assertEqual(profile._meta['validators'], {})
+
+        refreshed = self.user.refresh_profile()
+        request = self.profile_requests()[-1]
+        self.assertFalse('If-None-Match' in request.headers)
+        self.assertFalse('If-Modified-Since' in request.headers)
+        self.assertEqual(refreshed.bio, saved_profile.bio)
+
+    def test_saved_profile_is_not_saved_again_unconditionally(self):
+        self.server.routes[('PUT', self.profile_path)] = self.update_matching_profile
+        self.server.routes[('OPTIONS', self.profile_path)] = (
+            200, {'Allow': 'GET, PUT, HEAD, OPTIONS', 'ETag': '"v1"'}, {'fields': {'bio': 'CharField'}}
+        )
+        profile = self.user.profile
+        profile.bio = u'Segunda versão'
+        profile.save()
+
+        self.assertRaises(requests.HTTPError, profile.save, force=True)
+        self.assertEqual(self.profile_requests()[-1].headers['If-Match'], '"v1"')
+
+    def update_matching_profile(self, request):
+        if request.headers.get('If-Match') != self.headers['ETag']:
+            return (412, {}, None)
+
+        return self.update_profile(request)
+
+    def test_refreshed_identity_loads_its_profile_again(self):
+        profile = self.user.profile
+        self.user.refresh()
+
+        self.assertFalse(self.user.profile is profile)
+        self.assertEqual(len([item for item in self.profile_requests() if item.method == 'GET']), 2)
+
+    def test_refresh_without_loaded_profile_loads_it(self):
+        profile = self.user.refresh_profile()
+
+        self.assertTrue(isinstance(profile, Profile))
+        self.assertEqual(len([item for item in self.profile_requests() if item.method == 'GET']), 1)
+
+
+class ChangeTrackingTest(unittest.TestCase):
+
+    def test_building_an_identity_does_not_copy_its_accounts(self):
+        seed = [{'uuid': str(index), 'name': 'Account', 'plan_slug': 'unittest'} for index in range(5000)]
+        user = Identity(uuid=TEST_USER['uuid'], first_name='Identity', accounts=seed)
+
+        self.assertTrue(user.resource_data['accounts'] is seed)
+        self.assertTrue(user._meta['saved']['accounts'] is seed)
+        self.assertEqual(user.changed_fields(), [])
+
+    def test_assigned_fields_are_changed(self):
+        user = Identity(uuid=TEST_USER['uuid'], first_name='Identity', last_name='Client')
+        user._meta['fields'] = ['first_name', 'last_name']
+
+        user.first_name = 'Other'
+        self.assertEqual(user.changed_fields(), ['first_name'])
+
+        user.first_name = 'Identity'
+        self.assertEqual(user.changed_fields(), [])
+
+    def test_fields_given_by_options_are_not_changed_unless_assigned(self):
+        profile = Profile(bio=u'Bio', nickname='nick', avatar='avatar.png')
+        profile._meta['fields'] = list(Profile.known_fields) + ['avatar']
+        self.assertEqual(profile.changed_fields(), [])
+
+        profile.avatar = 'other.png'
+        self.assertEqual(profile.changed_fields(), ['avatar'])
+
+    def test_read_only_fields_are_not_changed(self):
+        member = AccountMember(roles=['user'], identity={'uuid': TEST_USER['uuid']})
+        member.identity = {'uuid': 'other'}
+        self.assertEqual(member.changed_fields(), [])
+
+        member.roles = ['admin']
+        self.assertEqual(member.changed_fields(), ['roles'])
+
+    def test_fields_changed_in_place_are_changed(self):
+        member = AccountMember(roles=['user'], identity={'uuid': TEST_USER['uuid']})
+        member.roles.append('admin')
+        self.assertEqual(member.changed_fields(), ['roles'])
+
+    def test_resource_data_changed_in_place_is_changed(self):
+        user = Identity(uuid=TEST_USER['uuid'], first_name='Identity', last_name='Client')
+        user._meta['fields'] = ['first_name', 'last_name']
+
+        user.resource_data['last_name'] = 'Other'
+        self.assertEqual(user.changed_fields(), ['last_name'])
+
+    def test_saved_values_are_copied_when_the_fields_are_loaded(self):
+        profile = Profile(bio=u'Bio', nickname='nick', avatar={'url': 'avatar.png'})
+        profile._meta['fields'] = list(Profile.known_fields) + ['avatar']
+        profile.snapshot_fields()
 
+        profile.avatar['url'] = 'other.png'
+        self.assertEqual(profile.changed_fields(), ['avatar'])
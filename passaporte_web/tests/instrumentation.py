@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from passaporte_web.main import Identity, ServiceAccount
+from passaporte_web.cache import IdentityCache
+from passaporte_web.retry import RetryPolicy
+from passaporte_web.instrumentation import (
+    Instrumentation, InstrumentationHook, LatencyAggregator, operation, current_resource_class
+)
+from passaporte_web.tests.helpers import TEST_USER, StubServerTestMixin
+
+__all__ = ['InstrumentationTest', 'LatencyAggregatorTest']
+
+
+class RecordingHook(InstrumentationHook):
+
+    def __init__(self):
+        self.events = []
+
+    def record(self, name, **data):
+        self.events.append(dict(data, event=name))
+
+    def request_started(self, **data):
+        self.record('request_started', **data)
+
+    def request_finished(self, **data):
+        self.record('request_finished', **data)
+
+    def request_retried(self, **data):
+        self.record('request_retried', **data)
+
+    def json_decoded(self, **data):
+        self.record('json_decoded', **data)
+
+    def cache_hit(self, **data):
+        self.record('cache_hit', **data)
+
+    def cache_miss(self, **data):
+        self.record('cache_miss', **data)
+
+    def named(self, name):
+        return [event for event in self.events if event['event'] == name]
+
+
+class InstrumentationTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+
+        identity_path = '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])
+        self.identity = {'uuid': TEST_USER['uuid'], 'update_info_url': self.server.url + identity_path}
+        self.failures = 0
+        self.server.routes.update({
+            ('GET', identity_path): self.get_identity,
+            ('OPTIONS', identity_path): (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {
+                'fields': {'first_name': 'CharField'}
+            }),
+            ('OPTIONS', '/organizations/api/accounts/'): (200, {'Allow': 'GET, HEAD, OPTIONS'}, {}),
+            ('GET', '/organizations/api/accounts/'): (200, {}, [
+                {'uuid': '1', 'plan_slug': 'unittest', 'account_data': {'uuid': '1', 'name': 'Account'}}
+            ]),
+        })
+
+        self.hook = RecordingHook()
+        self.app = self.make_app()
+
+    def make_app(self, **kwargs):
+        return super(InstrumentationTest, self).make_app(instrumentation=Instrumentation([self.hook]), **kwargs)
+
+    def get_identity(self, request):
+        if self.failures:
+            self.failures -= 1
+            return (503, {}, {'detail': 'Service unavailable'})
+
+        return (200, {}, self.identity)
+
+    def test_requests_are_reported_with_family_method_and_resource_class(self):
+        self.app.users.get(uuid=TEST_USER['uuid'])
+
+        started = self.hook.named('request_started')
+        finished = self.hook.named('request_finished')
+        self.assertEqual([(event['method'], event['family']) for event in finished], [
+            ('GET', 'identities'), ('OPTIONS', 'identities')
+        ])
+        self.assertEqual(len(started), 2)
+        for event in started + finished:
+            self.assertTrue(event['resource_class'] is Identity)
+
+        self.assertEqual(finished[0]['status'], 200)
+        self.assertEqual(finished[0]['bytes_out'], 0)
+        self.assertTrue(finished[0]['bytes_in'] > 0)
+        self.assertTrue(finished[0]['duration'] >= 0)
+
+    def test_streamed_responses_are_not_read(self):
+        url = '{0}/organizations/api/accounts/'.format(self.server.url)
+        response = self.app._session.get(url, stream=True)
+
+        self.assertFalse(response._content_consumed)
+        finished = self.hook.named('request_finished')[0]
+        self.assertEqual(finished['bytes_in'], int(response.headers['Content-Length']))
+
+        self.assertEqual(response.json()[0]['uuid'], '1')
+        self.assertEqual(self.hook.named('json_decoded')[0]['size'], finished['bytes_in'])
+
+    def test_collection_iteration_is_attributed_to_the_resource_class(self):
+        accounts = list(self.app.accounts.all())
+
+        self.assertTrue(isinstance(accounts[0], ServiceAccount))
+        self.assertEqual(
+            [(event['method'], event['family'], event['resource_class']) for event in self.hook.named('request_finished')],
+            [('OPTIONS', 'accounts', ServiceAccount), ('GET', 'accounts', ServiceAccount)]
+        )
+
+    def test_json_decoding_is_reported(self):
+        self.app.users.get(uuid=TEST_USER['uuid'])
+
+        decoded = self.hook.named('json_decoded')
+        self.assertTrue(decoded)
+        for event in decoded:
+            self.assertEqual(event['family'], 'identities')
+            self.assertTrue(event['resource_class'] is Identity)
+            self.assertTrue(event['size'] > 0)
+            self.assertTrue(event['duration'] >= 0)
+
+    def test_each_response_is_decoded_once(self):
+        user = self.app.users.get(uuid=TEST_USER['uuid'])
+        user.profile
+        self.app.users.load_options()
+
+        decoded = [(event['method'], event['family']) for event in self.hook.named('json_decoded')]
+        finished = [
+            (event['method'], event['family']) for event in self.hook.named('request_finished')
+            if event['status'] == 200
+        ]
+        self.assertEqual(decoded, finished)
+
+    def test_retries_are_reported(self):
+        app = self.make_app(retry_policy=RetryPolicy(sleep=lambda delay: None))
+        self.failures = 1
+        app.users.get(uuid=TEST_USER['uuid'])
+
+        retried = self.hook.named('request_retried')
+        self.assertEqual(len(retried), 1)
+        self.assertEqual((retried[0]['method'], retried[0]['attempt']), ('GET', 1))
+        self.assertTrue(retried[0]['resource_class'] is Identity)
+
+    def test_cache_hits_and_misses_are_reported(self):
+        app = self.make_app(identity_cache=IdentityCache())
+        app.users.get(uuid=TEST_USER['uuid'])
+        app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertEqual(len(self.hook.named('cache_miss')), 1)
+        hit = self.hook.named('cache_hit')[0]
+        self.assertEqual(
+            (hit['family'], hit['method'], hit['resource_class'], hit['cache']),
+            ('identities', 'GET', Identity, 'identity')
+        )
+
+    def test_instrumentation_is_optional(self):
+        app = super(InstrumentationTest, self).make_app()
+        user = app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertEqual(user.uuid, TEST_USER['uuid'])
+        self.assertEqual(self.hook.events, [])
+
+    def test_operation_context_is_restored(self):
+        with operation(Identity):
+            with operation(ServiceAccount):
+                self.assertTrue(current_resource_class() is ServiceAccount)
+            self.assertTrue(current_resource_class() is Identity)
+
+        self.assertEqual(current_resource_class(), None)
+
+
+class LatencyAggregatorTest(unittest.TestCase):
+
+    def finish(self, aggregator, duration, resource_class=Identity, method='GET'):
+        aggregator.request_finished(
+            family='identities', method=method, resource_class=resource_class, url='', status=200,
+            duration=duration, bytes_in=0, bytes_out=0
+        )
+
+    def test_percentiles_per_operation(self):
+        aggregator = LatencyAggregator()
+        for duration in range(1, 101):
+            self.finish(aggregator, duration / 100.0)
+        self.finish(aggregator, 0.5, method='OPTIONS')
+
+        report = aggregator.report()
+        self.assertEqual(report[('identities', 'GET', 'Identity')], {
+            'count': 100, 'p50': 0.5, 'p95': 0.95, 'p99': 0.99
+        })
+        self.assertEqual(report[('identities', 'OPTIONS', 'Identity')]['p99'], 0.5)
+
+    def test_samples_are_bounded(self):
+        aggregator = LatencyAggregator(samples=10)
+        for duration in range(100):
+            self.finish(aggregator, duration, resource_class=None)
+
+        report = aggregator.report()[('identities', 'GET', None)]
+        self.assertEqual((report['count'], report['p50']), (10, 94))
+
+    def test_aggregator_as_a_hook(self):
+        aggregator = LatencyAggregator()
+        instrumentation = Instrumentation()
+        self.assertTrue(instrumentation.add(aggregator) is aggregator)
+
+        instrumentation.emit(
+            'request_finished', family='accounts', method='GET', resource_class=ServiceAccount,
+            url='', status=200, duration=0.25, bytes_in=10, bytes_out=0
+        )
+        instrumentation.emit('cache_hit', family='accounts', method='GET', resource_class=None, cache='options')
+
+        self.assertEqual(aggregator.report()[('accounts', 'GET', 'ServiceAccount')]['p50'], 0.25)
@@ -1,21 +1,24 @@
 # -*- coding: utf-8 -*-
 import six
+import json
 import unittest
 
 import requests
 from .helpers import use_cassette as use_pw_cassette
 
-from passaporte_web.main import PassaporteWeb, AccountMembers, AccountMember
-from passaporte_web.tests.helpers import TEST_USER, TEST_USER_2, APP_CREDENTIALS
+from passaporte_web.main import PassaporteWeb, AccountMembers, AccountMember, MembershipSyncReport
+from passaporte_web.tests.helpers import TEST_USER, TEST_USER_2, APP_CREDENTIALS, StubServerTestMixin
 
-__all__ = ['AccountMembersTest', 'AccountMemberTest']
+__all__ = ['AccountMembersTest', 'AccountMemberTest', 'MembersSyncTest']
+
+MEMBERS_PATH = '/organizations/api/accounts/1/members/'
 
 
 class AccountMembersTest(unittest.TestCase):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
         with use_pw_cassette('user/get_by_uuid'):
             self.user = self.app.users.get(uuid=TEST_USER['uuid'])
@@ -104,7 +107,7 @@ class AccountMemberTest(unittest.TestCase):
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
         with use_pw_cassette('user/get_by_uuid'):
             self.user = self.app.users.get(uuid=TEST_USER['uuid'])
@@ -240,3 +243,101 @@ class AccountMemberTest(unittest.TestCase):
         with use_pw_cassette('accounts/members/delete_for_owner_account_member'):
             self.assertRaises(requests.HTTPError, account_member.delete)
 
+
+
+class MembersSyncTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(MembersSyncTest, self).setUp()
+        self.members = {
+            'admin': ['admin'], 'user': ['user'], 'owner': ['owner'],
+        }
+        self.server.routes.update({
+            ('GET', MEMBERS_PATH): self.list_members,
+            ('POST', MEMBERS_PATH): self.create_member,
+        })
+        for uuid in list(self.members):
+            self.server.routes[('PUT', self.member_path(uuid))] = self.update_member
+            self.server.routes[('DELETE', self.member_path(uuid))] = self.delete_member
+
+        app = self.make_app()
+        self.collection = AccountMembers(url=self.server.url + MEMBERS_PATH, session=app._session)
+
+    def member_path(self, uuid):
+        return '{0}{1}/'.format(MEMBERS_PATH, uuid)
+
+    def member_data(self, uuid):
+        return {
+            'identity': {'uuid': uuid},
+            'roles': self.members[uuid],
+            'membership_details_url': self.server.url + self.member_path(uuid),
+        }
+
+    def list_members(self, request):
+        return (200, {}, [self.member_data(uuid) for uuid in sorted(self.members)])
+
+    def create_member(self, request):
+        data = json.loads(request.body.decode('utf-8'))
+        self.members[data['identity']] = data['roles'] or ['user']
+        return (201, {}, self.member_data(data['identity']))
+
+    def update_member(self, request):
+        uuid = request.path.split('/')[-2]
+        self.members[uuid] = json.loads(request.body.decode('utf-8'))['roles']
+        return (200, {}, self.member_data(uuid))
+
+    def delete_member(self, request):
+        uuid = request.path.split('/')[-2]
+        if 'owner' in self.members[uuid]:
+            return (403, {}, {'detail': 'Owners cannot be removed'})
+
+        del self.members[uuid]
+        return (204, {}, None)
+
+    def requests(self, method):
+        return [request.path for request in self.server.requests if request.method == method]
+
+    def test_only_the_needed_changes_are_made(self):
+        report = self.collection.sync({
+            'admin': ['admin'], 'user': ['admin', 'user'], 'owner': ['owner'], 'new': ['user'],
+        })
+
+        self.assertTrue(isinstance(report, MembershipSyncReport))
+        self.assertEqual(report.created, ['new'])
+        self.assertEqual(report.updated, ['user'])
+        self.assertEqual(sorted(report.unchanged), ['admin', 'owner'])
+        self.assertEqual((report.deleted, report.errors), ([], []))
+
+        self.assertEqual(len(self.requests('GET')), 1)
+        self.assertEqual(self.requests('POST'), [MEMBERS_PATH])
+        self.assertEqual(self.requests('PUT'), [self.member_path('user')])
+        self.assertEqual(self.requests('DELETE'), [])
+        self.assertEqual(self.members['user'], ['admin', 'user'])
+
+    def test_members_not_given_are_deleted(self):
+        report = self.collection.sync({'owner': ['owner']})
+
+        self.assertEqual(sorted(report.deleted), ['admin', 'user'])
+        self.assertEqual(sorted(self.members), ['owner'])
+        self.assertEqual(len(self.requests('PUT')) + len(self.requests('POST')), 0)
+
+    def test_deleting_can_be_disabled(self):
+        report = self.collection.sync({'admin': ['admin']}, delete=False)
+
+        self.assertEqual(report.unchanged, ['admin'])
+        self.assertEqual(self.requests('DELETE'), [])
+        self.assertEqual(sorted(self.members), ['admin', 'owner', 'user'])
+
+    def test_empty_roles_match_the_default_role(self):
+        report = self.collection.sync({'user': []}, delete=False)
+
+        self.assertEqual(report.unchanged, ['user'])
+        self.assertEqual(self.requests('PUT'), [])
+
+    def test_failed_changes_are_reported(self):
+        report = self.collection.sync({'admin': ['admin'], 'user': ['user']})
+
+        self.assertEqual(report.deleted, [])
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(report.errors[0].data, ('deleted', 'owner', ['owner']))
+        self.assertTrue(isinstance(report.errors[0].error, requests.HTTPError))
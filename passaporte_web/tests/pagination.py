@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import gc
+import time
+import unittest
+
+import six
+import requests
+
+from passaporte_web.main import ServiceAccount
+from passaporte_web.pagination import PageIterator, PageTiming
+from passaporte_web.tests.helpers import StubServerTestMixin
+
+__all__ = ['PageIteratorTest']
+
+ACCOUNTS_PATH = '/organizations/api/accounts/'
+
+
+class PageIteratorTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(PageIteratorTest, self).setUp()
+        self.server.routes.update({
+            ('OPTIONS', ACCOUNTS_PATH): (200, {'Allow': 'GET, HEAD, OPTIONS'}, {}),
+            ('GET', ACCOUNTS_PATH): self.list_accounts,
+        })
+        self.pages = 4
+        self.failing_page = None
+
+        self.app = self.make_app()
+
+    def list_accounts(self, request):
+        page = int(request.query.get('page', 1))
+        if page == self.failing_page:
+            return (500, {}, {'detail': 'Server error'})
+
+        headers = {}
+        if page < self.pages:
+            headers['Link'] = '<{0}{1}?page={2}>; rel="next"'.format(self.server.url, ACCOUNTS_PATH, page + 1)
+
+        return (200, headers, [
+            {'uuid': '{0}-{1}'.format(page, item), 'plan_slug': 'unittest', 'account_data': {
+                'name': 'Account {0}.{1}'.format(page, item)
+            }}
+            for item in range(2)
+        ])
+
+    def page_requests(self):
+        return [item for item in self.server.requests if item.method == 'GET']
+
+    def test_all_returns_a_page_iterator(self):
+        accounts = self.app.accounts.all()
+
+        self.assertTrue(isinstance(accounts, PageIterator))
+        self.assertTrue(isinstance(six.next(accounts), ServiceAccount))
+
+    def test_prefetched_items_are_yielded_in_order(self):
+        expected = [account.name for account in self.app.accounts.all()]
+        accounts = [account.name for account in self.app.accounts.all(prefetch=2)]
+
+        self.assertEqual(len(expected), 8)
+        self.assertEqual(accounts, expected)
+
+    def test_timings_are_kept_for_every_page(self):
+        for prefetch in (0, 2):
+            accounts = self.app.accounts.all(prefetch=prefetch)
+            list(accounts)
+
+            self.assertEqual(len(accounts.timings), self.pages)
+            self.assertTrue(isinstance(accounts.timings[0], PageTiming))
+            self.assertEqual(accounts.timings[0].url, self.server.url + ACCOUNTS_PATH)
+            self.assertEqual(accounts.timings[1].url, self.server.url + ACCOUNTS_PATH + '?page=2')
+            self.assertEqual([timing.items for timing in accounts.timings], [2] * self.pages)
+
+    def test_prefetching_is_bounded(self):
+        self.pages = 10
+        accounts = self.app.accounts.all(prefetch=1)
+        six.next(accounts)
+        time.sleep(0.3)
+
+        # One page queued and another one waiting for room in the queue
+        self.assertEqual(len(self.page_requests()), 3)
+
+        accounts.close()
+        accounts._worker.join(1)
+        self.assertFalse(accounts._worker.is_alive())
+
+    def test_prefetching_stops_when_the_iterator_is_dropped(self):
+        self.pages = 10
+
+        def first_account():
+            accounts = self.app.accounts.all(prefetch=1)
+            for account in accounts:
+                return account, accounts._worker
+
+        account, worker = first_account()
+        gc.collect()
+        worker.join(1)
+
+        self.assertEqual(account.name, 'Account 1.0')
+        self.assertFalse(worker.is_alive())
+
+    def test_errors_are_raised_after_the_prefetched_items(self):
+        self.failing_page = 2
+        accounts = self.app.accounts.all(prefetch=2)
+
+        self.assertEqual(six.next(accounts).name, 'Account 1.0')
+        self.assertEqual(six.next(accounts).name, 'Account 1.1')
+        self.assertRaises(requests.HTTPError, six.next, accounts)
+
+    def test_collection_must_be_iterable(self):
+        self.server.routes[('OPTIONS', ACCOUNTS_PATH)] = (200, {'Allow': 'HEAD, OPTIONS'}, {})
+        app = self.make_app(eager=True)
+
+        self.assertRaises(ValueError, six.next, app.accounts.all(prefetch=2))
+        self.assertEqual(self.page_requests(), [])
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+from collections import namedtuple
+
+import requests
+
+from passaporte_web.main import ServiceAccount
+from passaporte_web.retry import RetryPolicy, RetryBudget
+from passaporte_web.tests.helpers import StubServerTestMixin
+
+__all__ = ['RetryPolicyTest', 'RetryBudgetTest', 'RetryTransportTest']
+
+ACCOUNTS_PATH = '/organizations/api/accounts/'
+
+FakeRequest = namedtuple('FakeRequest', ['method', 'headers'])
+FakeResponse = namedtuple('FakeResponse', ['status_code', 'headers'])
+
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def test_retries_are_limited_by_the_reserve(self):
+        budget = RetryBudget(ratio=0.5, reserve=2)
+
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+    def test_requests_replenish_the_budget(self):
+        budget = RetryBudget(ratio=0.5, reserve=2)
+        budget.withdraw()
+        budget.withdraw()
+
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_balance_does_not_exceed_the_reserve(self):
+        budget = RetryBudget(ratio=0.5, reserve=2)
+        for i in range(10):
+            budget.deposit()
+
+        self.assertEqual(budget.balance, 2)
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(retries=2, backoff=1, max_backoff=5, random=lambda: 0.5)
+
+    def test_only_idempotent_requests_are_retried(self):
+        for method in ('GET', 'HEAD', 'OPTIONS', 'PUT'):
+            self.assertTrue(self.policy.is_retriable(FakeRequest(method, {})))
+
+        for method in ('POST', 'DELETE'):
+            self.assertFalse(self.policy.is_retriable(FakeRequest(method, {})))
+
+    def test_post_with_idempotency_key_is_retried(self):
+        self.assertTrue(self.policy.is_retriable(FakeRequest('POST', {'Idempotency-Key': 'abc'})))
+
+    def test_only_transient_statuses_are_retried(self):
+        request = FakeRequest('GET', {})
+
+        self.assertTrue(self.policy.should_retry(request, 0, FakeResponse(503, {})))
+        self.assertTrue(self.policy.should_retry(request, 0, FakeResponse(429, {})))
+        self.assertFalse(self.policy.should_retry(request, 0, FakeResponse(404, {})))
+        self.assertFalse(self.policy.should_retry(request, 0, FakeResponse(200, {})))
+
+    def test_retries_are_limited(self):
+        request = FakeRequest('GET', {})
+
+        self.assertTrue(self.policy.should_retry(request, 1))
+        self.assertFalse(self.policy.should_retry(request, 2))
+
+    def test_retries_are_limited_by_the_budget(self):
+        self.policy.budget = RetryBudget(reserve=1)
+        request = FakeRequest('GET', {})
+
+        self.assertTrue(self.policy.should_retry(request, 0))
+        self.assertFalse(self.policy.should_retry(request, 0))
+
+    def test_exponential_backoff_with_jitter(self):
+        self.assertEqual([self.policy.delay(attempt) for attempt in range(5)], [0.5, 1, 2, 2.5, 2.5])
+
+        self.policy.jitter = False
+        self.assertEqual([self.policy.delay(attempt) for attempt in range(5)], [1, 2, 4, 5, 5])
+
+    def test_retry_after_is_honored(self):
+        self.assertEqual(self.policy.delay(0, FakeResponse(503, {'Retry-After': '3'})), 3)
+        self.assertEqual(self.policy.delay(0, FakeResponse(503, {'Retry-After': '60'})), 5)
+
+
+class RetryTransportTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(RetryTransportTest, self).setUp()
+        self.failures = 0
+        self.server.routes.update({
+            ('OPTIONS', ACCOUNTS_PATH): self.respond_options,
+            ('POST', ACCOUNTS_PATH): self.create_account,
+        })
+
+        self.delays = []
+        self.policy = RetryPolicy(retries=3, jitter=False, sleep=self.delays.append)
+        self.app = self.make_app(retry_policy=self.policy)
+
+    def should_fail(self):
+        if self.failures:
+            self.failures -= 1
+            return True
+
+        return False
+
+    def respond_options(self, request):
+        if self.should_fail():
+            return (503, {}, {'detail': 'Service unavailable'})
+
+        return (200, {'Allow': 'GET, POST, HEAD, OPTIONS'}, {})
+
+    def create_account(self, request):
+        if self.should_fail():
+            return (503, {}, {'detail': 'Service unavailable'})
+
+        data = json.loads(request.body.decode('utf-8'))
+        return (201, {}, {'uuid': 'new-uuid', 'plan_slug': data['plan_slug'], 'account_data': {
+            'uuid': 'new-uuid', 'name': data['name']
+        }})
+
+    def requests_for(self, method):
+        return [item for item in self.server.requests if item.method == method]
+
+    def test_idempotent_requests_are_retried_with_backoff(self):
+        self.failures = 2
+        self.app.accounts.load_options()
+
+        self.assertEqual(len(self.requests_for('OPTIONS')), 3)
+        self.assertEqual(self.delays, [0.1, 0.2])
+        self.assertEqual(self.app.pool_stats()['retries'], 2)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_last_failure_is_returned_when_retries_are_exhausted(self):
+        self.failures = 10
+        response = self.app._session.options(self.server.url + ACCOUNTS_PATH)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.requests_for('OPTIONS')), 4)
+
+    def test_post_is_not_retried_by_default(self):
+        self.app.accounts.load_options()
+        self.failures = 1
+
+        self.assertRaises(
+            requests.HTTPError, self.app.accounts.create, name='New account', plan_slug='unittest'
+        )
+        self.assertEqual(len(self.requests_for('POST')), 1)
+        self.assertFalse('Idempotency-Key' in self.requests_for('POST')[0].headers)
+
+    def test_post_with_idempotency_key_is_retried(self):
+        self.app.accounts.load_options()
+        self.failures = 1
+
+        account = self.app.accounts.create(
+            name='New account', plan_slug='unittest', idempotency_key='new-account-1'
+        )
+
+        self.assertTrue(isinstance(account, ServiceAccount))
+        posts = self.requests_for('POST')
+        self.assertEqual(len(posts), 2)
+        self.assertEqual([item.headers['Idempotency-Key'] for item in posts], ['new-account-1'] * 2)
+        self.assertEqual(json.loads(posts[1].body.decode('utf-8')), {
+            'name': 'New account', 'plan_slug': 'unittest'
+        })
+
+    def test_no_retries_by_default(self):
+        app = self.make_app()
+        self.failures = 1
+
+        response = app._session.options(self.server.url + ACCOUNTS_PATH)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.requests_for('OPTIONS')), 1)
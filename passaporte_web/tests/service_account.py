@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 import six
 import unittest
+import threading
 
 import requests
 from api_toolkit import Collection
 from .helpers import use_cassette as use_pw_cassette
 
-from passaporte_web.main import PassaporteWeb, Identity, ServiceAccount, Account
-from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS
+from passaporte_web.main import (
+    PassaporteWeb, PWebSessionFactory, Identity, ServiceAccount, Account, AccountRecord, AccountIndex
+)
+from passaporte_web.tests.helpers import TEST_USER, APP_CREDENTIALS, StubServerTestMixin
 
-__all__ = ['IdentityAccountsTest']
+__all__ = ['IdentityAccountsTest', 'IdentityAccountsConcurrencyTest', 'AccountIndexTest']
 
 class CanGetServiceAccount(unittest.TestCase):
     collection = None
@@ -172,6 +175,15 @@ class CanCreateServiceAccount(unittest.TestCase):
                 expiration='10000-01-01',
             )
 
+    def test_create_many_keeps_validation_errors_per_item(self):
+        with use_pw_cassette('accounts/duplicated_account'):
+            results = self.collection.create_many([
+                {'name': 'Test Account', 'plan_slug': 'unittest', 'expiration': None},
+            ])
+
+        self.assertEqual(results.failed, 1)
+        self.assertTrue(isinstance(results[0].error, requests.HTTPError))
+
     def test_create_account_with_expiration_in_the_past_works(self):
         with use_pw_cassette('accounts/create_with_expiration_in_the_past'):
             new_account = self.collection.create(
@@ -223,6 +235,21 @@ class CanLoadServiceAccounts(unittest.TestCase):
         for item in user_accounts:
             self.assertTrue(isinstance(item, ServiceAccount))
 
+    def test_load_lean_accounts(self):
+        with use_pw_cassette('accounts/load_user_accounts'):
+            full_accounts = list(self.user.accounts.all())
+
+        with use_pw_cassette('accounts/load_user_accounts'):
+            lean_accounts = list(self.user.accounts.all(lean=True))
+
+        self.assertEqual(len(lean_accounts), 4)
+        for full, lean in zip(full_accounts, lean_accounts):
+            self.assertTrue(isinstance(lean, AccountRecord))
+            self.assertEqual(
+                (lean.uuid, lean.name, lean.plan_slug, lean.expiration, list(lean.roles), lean.url),
+                (full.uuid, full.name, full.plan_slug, full.expiration, full.roles, full.url)
+            )
+
     def test_load_for_user_without_accounts(self):
         with use_pw_cassette('accounts/load_for_user_without_accounts'):
             user_accounts = list(self.user.accounts.all())
@@ -327,7 +354,7 @@ class IdentityAccountsTest(CanGetServiceAccount, CanCreateServiceAccount, CanLoa
 
     def setUp(self):
         with use_pw_cassette('application/collections_options'):
-            self.app = PassaporteWeb(**APP_CREDENTIALS)
+            self.app = PassaporteWeb(eager=True, **APP_CREDENTIALS)
 
         with use_pw_cassette('user/get_by_uuid'):
             self.user = self.app.users.get(uuid=TEST_USER['uuid'])
@@ -342,7 +369,7 @@ class IdentityAccountsTest(CanGetServiceAccount, CanCreateServiceAccount, CanLoa
 
         with use_pw_cassette('accounts/load_options_and_update'):
             service_account.load_options()
-            updated_service_account = service_account.save()
+            updated_service_account = service_account.save(force=True)
 
         self.assertEqual(sorted(service_account._meta['fields']), ['expiration', 'plan_slug'])
         self.assertEqual(updated_service_account.plan_slug, service_account.plan_slug)
@@ -353,7 +380,7 @@ class IdentityAccountsTest(CanGetServiceAccount, CanCreateServiceAccount, CanLoa
 
         with use_pw_cassette('accounts/load_options_and_update'):
             service_account.load_options()
-            updated_service_account = service_account.save()
+            updated_service_account = service_account.save(force=True)
 
         self.assertEqual(
             sorted(service_account.resource_data.keys()), [
@@ -378,7 +405,7 @@ class IdentityAccountsTest(CanGetServiceAccount, CanCreateServiceAccount, CanLoa
 
                 if isinstance(item, ServiceAccount):
                     item.load_options()
-                    updated_item = item.save()
+                    updated_item = item.save(force=True)
                 else:
                     # Accounts cannot be manipulated directly
                     continue
@@ -386,6 +413,106 @@ class IdentityAccountsTest(CanGetServiceAccount, CanCreateServiceAccount, CanLoa
                 self.assertEqual(name, updated_item.name)
                 self.assertEqual(uuid, updated_item.uuid)
 
+    def test_lean_accounts_from_seed(self):
+        seeded = list(self.user.accounts.from_seed())
+        records = list(self.user.accounts.from_seed(lean=True))
+
+        self.assertEqual([record.uuid for record in records], [item.uuid for item in seeded])
+        self.assertEqual([record.name for record in records], [item.name for item in seeded])
+        self.assertEqual(records[0].roles, tuple(seeded[0].roles))
+
+    def test_seeded_account_by_uuid(self):
+        seeded = list(self.user.accounts.from_seed())
+        account = self.user.accounts.by_uuid(seeded[1].uuid)
+
+        self.assertTrue(isinstance(account, ServiceAccount))
+        self.assertEqual(account.resource_data, seeded[1].resource_data)
+        self.assertTrue(account._session is self.user._session)
+        self.assertFalse(account is self.user.accounts.by_uuid(seeded[1].uuid))
+
+    def test_service_account_without_service_data_is_an_account(self):
+        for data in ({'name': 'Other', 'uuid': '1'}, {'account_data': {'name': 'Other', 'uuid': '1'}}):
+            account = ServiceAccount(**data)
+            self.assertTrue(isinstance(account, Account))
+            self.assertEqual(account.resource_data, {'name': 'Other', 'uuid': '1'})
+
+        self.assertTrue(isinstance(ServiceAccount(name='Other', uuid='1', plan_slug='unittest'), ServiceAccount))
+
+    def test_unknown_seeded_account_by_uuid(self):
+        self.assertEqual(self.user.accounts.by_uuid('00000000-0000-0000-0000-000000000000'), None)
+        self.assertEqual(self.user.accounts.by_uuid('unknown', default=False), False)
+
+    def test_find_seeded_accounts(self):
+        owned = self.user.accounts.find(role='owner')
+
+        self.assertEqual([account.plan_slug for account in owned], ['seller', 'unittest-updated'])
+        self.assertTrue(all(isinstance(account, ServiceAccount) for account in owned))
+        self.assertEqual([account.uuid for account in self.user.accounts.find(plan_slug='unittest', role='admin')],
+                         ['e5ab6f2f-a4eb-431b-8c12-9411fd8a872d'])
+        self.assertEqual(self.user.accounts.find(plan_slug='unittest', role='owner'), [])
+        self.assertEqual(len(self.user.accounts.find(expired=False)), 4)
+
+    def test_index_built_from_a_single_fetch(self):
+        with use_pw_cassette('accounts/load_user_accounts'):
+            index = self.user.accounts.build_index(fetch=True)
+
+        self.assertTrue(self.user.accounts.index is index)
+        account = self.user.accounts.by_uuid(self.healty_account)
+        self.assertEqual(account.uuid, self.healty_account)
+        self.assertTrue(account._session is self.user._session)
+
+    def test_index_is_updated_by_create(self):
+        self.assertEqual(len(self.user.accounts.index), 4)
+
+        with use_pw_cassette('accounts/create_with_name'):
+            new_account = self.user.accounts.create(
+                name='No account with this name exists',
+                plan_slug='unittest',
+                expiration=None,
+            )
+
+        self.assertEqual(len(self.user.accounts.index), 5)
+        self.assertEqual(self.user.accounts.by_uuid(new_account.uuid).resource_data, new_account.resource_data)
+        self.assertTrue(new_account.uuid in [item.uuid for item in self.user.accounts.find(plan_slug='unittest')])
+
+    def test_accounts_created_before_indexing_are_found(self):
+        with use_pw_cassette('accounts/create_with_name'):
+            new_account = self.user.accounts.create(
+                name='No account with this name exists',
+                plan_slug='unittest',
+                expiration=None,
+            )
+
+        self.assertEqual(self.user.accounts.by_uuid(new_account.uuid).resource_data, new_account.resource_data)
+        self.assertEqual(len(self.user.accounts.index), 5)
+        self.assertEqual(len(self.user.resource_data['accounts']), 4)
+
+    def test_seeded_accounts_are_not_copied(self):
+        self.assertTrue(self.user.accounts._seed is self.user.resource_data['accounts'])
+        self.assertEqual(self.user.accounts._index, None)
+
+    def test_lean_accounts_are_read_only(self):
+        record = six.next(self.user.accounts.from_seed(lean=True))
+
+        self.assertRaises(AttributeError, setattr, record, 'plan_slug', 'other')
+        self.assertRaises(AttributeError, setattr, record, 'extra', 'value')
+        self.assertEqual(record.account.resource_data, {'name': record.name, 'uuid': record.uuid})
+
+    def test_lean_account_can_be_promoted(self):
+        with use_pw_cassette('accounts/load_user_accounts'):
+            records = list(self.user.accounts.all(lean=True))
+        record = [item for item in records if item.uuid == self.healty_account][0]
+
+        with use_pw_cassette('accounts/get'):
+            account = record.promote()
+
+        self.assertTrue(isinstance(account, ServiceAccount))
+        self.assertEqual(account.uuid, record.uuid)
+        self.assertTrue(account._session is self.app._session)
+
+    def test_lean_listing_requires_a_lean_representation(self):
+        self.assertRaises(ValueError, self.app.users.all, lean=True)
+
     def test_user_accounts_cannot_be_deleted(self):
         with use_pw_cassette('accounts/load_user_accounts'):
             first_account = six.next(self.user.accounts.all())
@@ -404,3 +531,104 @@ class IdentityAccountsTest(CanGetServiceAccount, CanCreateServiceAccount, CanLoa
         expected_url = self.collection.url
         self.test_get_using_invalid_credentials()
         self.assertEqual(self.collection.url, expected_url)
+
+
+class AccountIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = AccountIndex([
+            {'uuid': '1', 'name': 'One', 'plan_slug': 'free', 'roles': ['owner'], 'expiration': None},
+            {'account_data': {'uuid': '2', 'name': 'Two'}, 'plan_slug': 'paid', 'roles': ['owner', 'admin'],
+             'expiration': '2014-01-01 00:00:00'},
+            {'uuid': '3', 'name': 'Three', 'plan_slug': 'paid', 'roles': ['user'], 'expiration': '2030-01-01'},
+        ])
+
+    def uuids(self, items):
+        return [AccountIndex.item_uuid(item) for item in items]
+
+    def test_get_by_uuid_in_both_formats(self):
+        self.assertEqual(self.index.get('1')['name'], 'One')
+        self.assertEqual(self.index.get('2')['account_data']['name'], 'Two')
+        self.assertEqual(self.index.get('4'), None)
+
+    def test_find_intersects_filters(self):
+        self.assertEqual(self.uuids(self.index.find(plan_slug='paid')), ['2', '3'])
+        self.assertEqual(self.uuids(self.index.find(role='owner')), ['1', '2'])
+        self.assertEqual(self.uuids(self.index.find(plan_slug='paid', role='owner')), ['2'])
+        self.assertEqual(self.uuids(self.index.find()), ['1', '2', '3'])
+
+    def test_find_by_expiration_status(self):
+        self.assertEqual(self.uuids(self.index.find(expired=True, today='2020-01-01')), ['2'])
+        self.assertEqual(self.uuids(self.index.find(expired=False, today='2020-01-01')), ['1', '3'])
+        self.assertEqual(self.uuids(self.index.find(expired=True, today='2031-01-01')), ['2', '3'])
+
+    def test_adding_a_known_uuid_replaces_its_data(self):
+        self.index.add({'uuid': '1', 'name': 'One', 'plan_slug': 'paid', 'roles': ['user'], 'expiration': None})
+
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.uuids(self.index.find(plan_slug='free')), [])
+        self.assertEqual(self.uuids(self.index.find(role='user')), ['1', '3'])
+
+
+class IdentityAccountsConcurrencyTest(StubServerTestMixin, unittest.TestCase):
+    account_uuids = [
+        'a4c9bce4-2a8c-452f-ae13-0a0b69dfd4ba',
+        '678abf63-eb1e-433d-9f0d-f46b44ab741d',
+        '5f15f7b5-a7f6-4a35-8573-0da53d303e18',
+        '48aeff34-20c9-4039-bd97-d815020e8b44',
+    ]
+    threads = 16
+    iterations = 25
+
+    def setUp(self):
+        super(IdentityAccountsConcurrencyTest, self).setUp()
+
+        accounts = [
+            {'uuid': uuid, 'name': 'Account {0}'.format(uuid), 'plan_slug': 'unittest', 'roles': ['owner']}
+            for uuid in self.account_uuids
+        ]
+        for item in accounts:
+            account_path = '/organizations/api/accounts/{0}/'.format(item['uuid'])
+            self.server.routes[('GET', account_path)] = (200, {}, dict(item, url=self.server.url + account_path))
+            self.server.routes[('OPTIONS', account_path)] = (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {})
+
+        identity_accounts_path = '/organizations/api/identities/{0}/accounts/'.format(TEST_USER['uuid'])
+        self.server.routes[('GET', identity_accounts_path)] = (200, {}, accounts)
+
+        self.user = Identity(
+            uuid=TEST_USER['uuid'], accounts=accounts,
+            update_info_url='{0}/accounts/api/identities/{1}/'.format(self.server.url, TEST_USER['uuid']),
+        )
+        self.user._session = PWebSessionFactory.make(
+            token=APP_CREDENTIALS['token'], secret=APP_CREDENTIALS['secret']
+        )
+        self.user.prepare_collections()
+
+    def hammer(self, thread_number, errors):
+        try:
+            for i in range(self.iterations):
+                if (thread_number + i) % 2:
+                    uuid = self.account_uuids[i % len(self.account_uuids)]
+                    account = self.user.accounts.get(uuid)
+                    assert account.uuid == uuid, 'Got {0} instead of {1}'.format(account.uuid, uuid)
+                else:
+                    accounts = list(self.user.accounts.all())
+                    assert len(accounts) == len(self.account_uuids)
+        except Exception as e:
+            errors.append(e)
+
+    def test_accounts_can_be_shared_between_threads(self):
+        expected_url = self.user.accounts.url
+        errors = []
+        workers = [
+            threading.Thread(target=self.hammer, args=(i, errors))
+            for i in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.user.accounts.url, expected_url)
+        self.assertEqual(len(self.server.requests), self.threads * self.iterations * 3 // 2)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import unittest
+
+import requests
+
+from passaporte_web.main import Identity
+from passaporte_web.singleflight import SingleFlight
+from passaporte_web.tests.helpers import TEST_USER, StubServerTestMixin
+
+__all__ = ['SingleFlightTest', 'CoalescedLoadTest']
+
+
+def run_concurrently(function, count):
+    results = [None] * count
+    errors = []
+
+    def target(index):
+        try:
+            results[index] = function()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, errors
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.runs = 0
+
+    def slow_call(self):
+        self.runs += 1
+        self.started.set()
+        self.release.wait()
+        return {'runs': self.runs}
+
+    def start_leader(self, results):
+        leader = threading.Thread(target=lambda: results.append(self.single_flight.do('key', self.slow_call)))
+        leader.start()
+        self.started.wait()
+        return leader
+
+    def test_concurrent_calls_share_the_result(self):
+        results = []
+        leader = self.start_leader(results)
+        followers = [
+            threading.Thread(target=lambda: results.append(self.single_flight.do('key', self.slow_call)))
+            for index in range(3)
+        ]
+        for follower in followers:
+            follower.start()
+        while self.single_flight.collapsed < 3:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(self.runs, 1)
+        self.assertEqual(results, [({'runs': 1}, True)] * 4)
+        self.assertEqual((self.single_flight.calls, self.single_flight.collapsed), (1, 3))
+
+    def test_calls_without_followers_are_not_shared(self):
+        self.release.set()
+
+        self.assertEqual(self.single_flight.do('key', self.slow_call), ({'runs': 1}, False))
+        self.assertEqual(self.single_flight.do('key', self.slow_call), ({'runs': 2}, False))
+        self.assertEqual(self.single_flight.collapsed, 0)
+
+    def test_errors_are_raised_to_every_caller(self):
+        def fail():
+            self.started.set()
+            self.release.wait()
+            raise ValueError('failed')
+
+        errors = []
+
+        def call():
+            try:
+                self.single_flight.do('key', fail)
+            except ValueError as error:
+                errors.append(error)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        self.started.wait()
+        follower = threading.Thread(target=call)
+        follower.start()
+        while not self.single_flight.collapsed:
+            time.sleep(0.001)
+        self.release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(self.single_flight._calls, {})
+
+    def test_interruptions_are_raised_to_every_caller(self):
+        def interrupted():
+            self.started.set()
+            self.release.wait()
+            raise KeyboardInterrupt()
+
+        results = []
+        interruptions = []
+
+        def call():
+            try:
+                results.append(self.single_flight.do('key', interrupted))
+            except KeyboardInterrupt as interruption:
+                interruptions.append(interruption)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        self.started.wait()
+        follower = threading.Thread(target=call)
+        follower.start()
+        while not self.single_flight.collapsed:
+            time.sleep(0.001)
+        self.release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(interruptions), 2)
+        self.assertEqual(self.single_flight._calls, {})
+
+
+class CoalescedLoadTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(CoalescedLoadTest, self).setUp()
+        self.identity_path = '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])
+        self.server.routes.update({
+            ('GET', self.identity_path): self.read_identity,
+            ('OPTIONS', self.identity_path): (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {
+                'fields': {'first_name': 'CharField'}
+            }),
+        })
+        self.status = 200
+
+        self.app = self.make_app(coalesce=True)
+
+    def read_identity(self, request):
+        time.sleep(0.1)
+        if self.status != 200:
+            return (self.status, {}, {'detail': 'Unavailable'})
+
+        return (200, {}, {
+            'uuid': TEST_USER['uuid'], 'first_name': 'Identity', 'accounts': [],
+            'update_info_url': '{0}{1}'.format(self.server.url, self.identity_path),
+        })
+
+    def requests(self, method):
+        return [item for item in self.server.requests if item.method == method]
+
+    def pool_stats(self):
+        return self.app._session.get_adapter(self.server.url).pool_stats()
+
+    def test_concurrent_loads_share_one_request(self):
+        users, errors = run_concurrently(lambda: self.app.users.get(uuid=TEST_USER['uuid']), 8)
+
+        self.assertEqual(errors, [])
+        self.assertEqual((len(self.requests('GET')), len(self.requests('OPTIONS'))), (1, 1))
+        self.assertEqual(self.pool_stats()['coalesced'], 7)
+
+        # Every caller gets its own copy
+        self.assertEqual(len(set(id(user) for user in users)), 8)
+        for user in users:
+            self.assertTrue(isinstance(user, Identity))
+            self.assertEqual(user.first_name, 'Identity')
+            self.assertEqual(list(user._meta['fields']), ['first_name'])
+            self.assertTrue(user._session is self.app._session)
+
+        users[0].first_name = 'Changed'
+        self.assertEqual(users[1].first_name, 'Identity')
+        self.assertEqual(users[1].changed_fields(), [])
+
+    def test_sequential_loads_are_not_coalesced(self):
+        first = self.app.users.get(uuid=TEST_USER['uuid'])
+        second = self.app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertFalse(first is second)
+        self.assertEqual(len(self.requests('GET')), 2)
+        self.assertEqual(self.pool_stats()['coalesced'], 0)
+
+    def test_errors_are_raised_to_every_caller(self):
+        self.status = 503
+        users, errors = run_concurrently(lambda: self.app.users.get(uuid=TEST_USER['uuid']), 4)
+
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(isinstance(error, requests.HTTPError) for error in errors))
+        self.assertEqual(len(self.requests('GET')), 1)
+
+    def test_loads_with_other_options_are_not_coalesced(self):
+        url = '{0}{1}'.format(self.server.url, self.identity_path)
+        run_concurrently(lambda: Identity.load(url, session=self.app._session), 2)
+        run_concurrently(lambda: Identity.load(url, session=self.app._session, load_options=False), 1)
+
+        self.assertEqual(len(self.requests('GET')), 2)
+
+    def test_coalescing_is_optional(self):
+        app = self.make_app()
+        run_concurrently(lambda: app.users.get(uuid=TEST_USER['uuid']), 3)
+
+        self.assertEqual(len(self.requests('GET')), 3)
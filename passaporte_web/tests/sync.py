@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from passaporte_web.sync import AccountSync
+from passaporte_web.tests.helpers import StubServerTestMixin
+
+__all__ = ['AccountSyncTest']
+
+ACCOUNTS_PATH = '/organizations/api/accounts/'
+
+
+class AccountSyncTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(AccountSyncTest, self).setUp()
+        self.server.routes.update({
+            ('OPTIONS', ACCOUNTS_PATH): (200, {'Allow': 'GET, POST, HEAD, OPTIONS'}, {}),
+            ('GET', ACCOUNTS_PATH): self.list_accounts,
+        })
+        self.accounts = dict(
+            (uuid, self.account_data(uuid, expiration))
+            for uuid, expiration in (('1', None), ('2', '2014-06-01 00:00:00'), ('3', '2020-01-01 00:00:00'))
+        )
+
+        self.app = self.make_app()
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot.sqlite')
+        self.sync = AccountSync(self.path)
+
+    def tearDown(self):
+        self.sync.close()
+        shutil.rmtree(self.directory)
+
+    def account_data(self, uuid, expiration=None, plan_slug='unittest'):
+        return {
+            'plan_slug': plan_slug, 'expiration': expiration,
+            'account_data': {'uuid': uuid, 'name': 'Account {0}'.format(uuid)},
+        }
+
+    def list_accounts(self, request):
+        # Two pages, to make sure the listing is streamed
+        uuids = sorted(self.accounts)
+        if request.query.get('page') == '2':
+            return (200, {}, [self.accounts[uuid] for uuid in uuids[2:]])
+
+        link = '<{0}{1}?page=2>; rel="next"'.format(self.server.url, ACCOUNTS_PATH)
+        return (200, {'Link': link}, [self.accounts[uuid] for uuid in uuids[:2]])
+
+    def changes(self, today='2014-01-01'):
+        return [(change.kind, change.uuid) for change in self.sync.run(self.app.accounts.all(), today=today)]
+
+    def test_first_run_adds_every_account(self):
+        changes = list(self.sync.run(self.app.accounts.all(), today='2014-01-01'))
+
+        self.assertEqual([(change.kind, change.uuid) for change in changes], [
+            ('added', '1'), ('added', '2'), ('added', '3'),
+        ])
+        self.assertEqual(changes[0].account.name, 'Account 1')
+        self.assertEqual(len(self.sync), 3)
+
+    def test_only_changed_accounts_are_yielded(self):
+        self.changes()
+        self.assertEqual(self.changes(), [])
+
+        self.accounts['2'] = self.account_data('2', '2014-06-01 00:00:00', plan_slug='premium')
+        self.accounts['4'] = self.account_data('4')
+        self.assertEqual(self.changes(), [('changed', '2'), ('added', '4')])
+
+    def test_accounts_are_expired_once(self):
+        self.changes()
+
+        self.assertEqual(self.changes(today='2015-01-01'), [('expired', '2')])
+        self.assertEqual(self.changes(today='2015-01-01'), [])
+        self.assertEqual(self.changes(today='2021-01-01'), [('expired', '3')])
+
+    def test_accounts_no_longer_listed_are_removed(self):
+        self.changes()
+        del self.accounts['1']
+
+        self.assertEqual(self.changes(), [('removed', '1')])
+        self.assertEqual(len(self.sync), 2)
+        self.assertEqual(self.changes(), [])
+
+    def test_snapshot_is_persisted(self):
+        self.changes()
+        self.sync.close()
+
+        self.sync = AccountSync(self.path)
+        self.assertEqual(self.changes(), [])
+
+    def test_interrupted_runs_keep_the_previous_snapshot(self):
+        self.changes()
+        self.accounts['1'] = self.account_data('1', plan_slug='premium')
+        self.accounts['4'] = self.account_data('4')
+
+        changes = self.sync.run(self.app.accounts.all(), today='2014-01-01')
+        self.assertEqual(next(changes).uuid, '1')
+        changes.close()
+
+        self.assertEqual(len(self.sync), 3)
+        self.assertEqual(self.changes(), [('changed', '1'), ('added', '4')])
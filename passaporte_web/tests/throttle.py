@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import unittest
+import threading
+
+from passaporte_web.throttle import TokenBucket, AdaptiveConcurrency
+
+__all__ = ['TokenBucketTest', 'AdaptiveConcurrencyTest']
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=2, capacity=2, timer=self.clock, sleep=self.clock.sleep)
+
+    def test_bursts_are_limited_by_the_capacity(self):
+        self.assertEqual(self.bucket.try_acquire(), 0.0)
+        self.assertEqual(self.bucket.try_acquire(), 0.0)
+        self.assertEqual(self.bucket.try_acquire(), 0.5)
+
+    def test_tokens_are_refilled_over_time(self):
+        self.bucket.try_acquire(2)
+        self.clock.now += 0.5
+
+        self.assertEqual(self.bucket.try_acquire(), 0.0)
+        self.assertEqual(self.bucket.try_acquire(), 0.5)
+
+    def test_refill_does_not_exceed_the_capacity(self):
+        self.clock.now += 60
+
+        self.assertEqual(self.bucket.try_acquire(2), 0.0)
+        self.assertEqual(self.bucket.try_acquire(), 0.5)
+
+    def test_acquire_waits_for_a_token(self):
+        for i in range(4):
+            self.bucket.acquire()
+
+        self.assertEqual(self.clock.slept, [0.5, 0.5])
+
+    def test_rate_must_be_positive(self):
+        self.assertRaises(ValueError, TokenBucket, rate=0)
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.concurrency = AdaptiveConcurrency(initial=4, minimum=1, maximum=6, latency_target=1.0)
+
+    def release_many(self, count, status=200, latency=0.1):
+        for i in range(count):
+            self.concurrency.acquire()
+            self.concurrency.release(status, latency)
+
+    def test_limit_grows_by_about_one_after_a_window_of_successes(self):
+        self.release_many(3)
+        self.assertEqual(self.concurrency.limit, 4)
+        self.release_many(2)
+        self.assertEqual(self.concurrency.limit, 5)
+
+    def test_limit_is_bounded_by_the_maximum(self):
+        self.release_many(100)
+        self.assertEqual(self.concurrency.limit, 6)
+
+    def test_overload_halves_the_limit(self):
+        for status in (429, 503, None):
+            self.concurrency = AdaptiveConcurrency(initial=4)
+            self.release_many(1, status=status)
+            self.assertEqual(self.concurrency.limit, 2)
+
+    def test_slow_responses_halve_the_limit(self):
+        self.release_many(1, latency=1.5)
+        self.assertEqual(self.concurrency.limit, 2)
+
+    def test_limit_is_bounded_by_the_minimum(self):
+        self.release_many(10, status=503)
+        self.assertEqual(self.concurrency.limit, 1)
+
+    def test_acquire_blocks_at_the_limit(self):
+        self.concurrency = AdaptiveConcurrency(initial=1)
+        self.concurrency.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            self.concurrency.acquire()
+            acquired.set()
+
+        waiting = threading.Thread(target=acquire)
+        waiting.start()
+        self.assertFalse(acquired.wait(0.1))
+
+        self.concurrency.release(200, 0.1)
+        waiting.join(1)
+        self.assertTrue(acquired.is_set())
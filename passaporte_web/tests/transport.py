@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import threading
+import unittest
+
+import requests
+from api_toolkit.entities import str_keys
+
+from passaporte_web.transport import PWebAdapter, PWebResponse
+from passaporte_web.throttle import AdaptiveConcurrency
+from passaporte_web.tests.helpers import TEST_USER, StubServerTestMixin
+
+__all__ = ['SharedTransportTest', 'ThrottledTransportTest', 'ResponseDecodingTest']
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SharedTransportTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(SharedTransportTest, self).setUp()
+
+        identity_path = '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])
+        self.server.routes.update({
+            ('GET', identity_path): (200, {}, {
+                'uuid': TEST_USER['uuid'], 'update_info_url': self.server.url + identity_path,
+            }),
+            ('OPTIONS', identity_path): (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {}),
+            ('OPTIONS', '/organizations/api/accounts/'): (200, {'Allow': 'GET, HEAD, OPTIONS'}, {}),
+            ('OPTIONS', '/applications/api/'): (200, {'Allow': 'GET, HEAD, OPTIONS'}, {}),
+            ('OPTIONS', '/accounts/api/create/'): (200, {'Allow': 'POST, OPTIONS'}, {}),
+            ('GET', '/accounts/api/auth/'): (200, {}, {
+                'uuid': TEST_USER['uuid'], 'update_info_url': self.server.url + identity_path,
+            }),
+        })
+
+        self.app = self.make_app(pool_connections=2, pool_maxsize=4)
+
+    def test_collections_share_a_single_session(self):
+        sessions = set(id(collection._session) for collection in self.app.collections)
+        self.assertEqual(len(sessions), 1)
+
+    def test_resources_share_the_application_session(self):
+        user = self.app.users.get(uuid=TEST_USER['uuid'])
+        self.assertTrue(user._session is self.app._session)
+        self.assertTrue(user.accounts._session is self.app._session)
+
+    def test_transport_options_configure_the_adapter(self):
+        adapter = self.app._session.get_adapter(self.server.url)
+
+        self.assertTrue(isinstance(adapter, PWebAdapter))
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter._pool_block, False)
+
+    def test_collections_reuse_the_pooled_connection(self):
+        for collection in self.app.collections:
+            collection.load_options()
+        for i in range(5):
+            self.app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertEqual(len(self.server.requests), 13)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_authentication_reuses_the_pooled_connection(self):
+        self.app.users.load_options()
+        for i in range(3):
+            user = self.app.users.authenticate(email=TEST_USER['email'], password=TEST_USER['password'])
+
+        self.assertEqual(user.uuid, TEST_USER['uuid'])
+        self.assertEqual(self.server.connections, 1)
+
+        auth_request = self.server.requests[-1]
+        self.assertEqual(auth_request.path, '/accounts/api/auth/')
+        self.assertEqual(
+            auth_request.headers['Authorization'],
+            requests.auth._basic_auth_str(TEST_USER['email'], TEST_USER['password'])
+        )
+
+    def test_pool_stats(self):
+        for collection in self.app.collections:
+            collection.load_options()
+
+        stats = self.app.pool_stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['peak_in_flight'], 1)
+        self.assertEqual(stats['pools'], 1)
+        self.assertEqual(stats['pool_maxsize'], 4)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['idle_connections'], 1)
+        self.assertEqual(stats['utilization'], 0)
+        self.assertEqual(stats['pool_block'], False)
+
+    def test_pool_block_makes_pool_maxsize_a_hard_limit(self):
+        self.server.routes[('GET', '/slow/')] = lambda request: time.sleep(0.1) or (200, {}, {})
+        app = self.make_app(pool_maxsize=1, pool_block=True)
+        threads = [
+            threading.Thread(target=app._session.get, args=(self.server.url + '/slow/',))
+            for index in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = app.pool_stats()
+        self.assertEqual(stats['pool_block'], True)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_idle_connections_are_dropped_after_keepalive_timeout(self):
+        timer = FakeTimer()
+        adapter = PWebAdapter(keepalive_timeout=5, timer=timer)
+        self.app._session.mount('http://', adapter)
+
+        self.app.users.load_options()
+        timer.now += 1
+        self.app.accounts.load_options()
+        timer.now += 10
+        self.app.applications.load_options()
+
+        self.assertEqual(self.server.connections, 2)
+
+
+class ThrottledTransportTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(ThrottledTransportTest, self).setUp()
+        self.status = 200
+        self.server.routes.update({
+            ('OPTIONS', '/organizations/api/accounts/'): lambda request: (self.status, {'Allow': 'GET, OPTIONS'}, {}),
+            ('OPTIONS', '/applications/api/'): lambda request: (self.status, {'Allow': 'GET, OPTIONS'}, {}),
+            ('OPTIONS', '/accounts/api/create/'): lambda request: (self.status, {'Allow': 'POST, OPTIONS'}, {}),
+        })
+
+    def test_rate_limit_is_shared_by_all_collections(self):
+        app = self.make_app(rate_limit=20, rate_burst=1)
+        adapter = app._session.get_adapter(self.server.url)
+
+        started = time.time()
+        for collection in app.collections * 2:
+            collection.load_options()
+
+        # After the first request, each one waits for a new token
+        self.assertTrue(time.time() - started >= 5 / 20.0)
+        self.assertEqual(adapter.rate_limiter.rate, 20)
+
+    def test_concurrency_limit_decreases_on_overload(self):
+        concurrency = AdaptiveConcurrency(initial=8)
+        app = self.make_app(adaptive_concurrency=concurrency)
+
+        self.status = 503
+        app.users.load_options()
+        self.assertEqual(app.pool_stats()['concurrency_limit'], 4)
+        app.accounts.load_options()
+        self.assertEqual(app.pool_stats()['concurrency_limit'], 2)
+
+        self.status = 200
+        for i in range(4):
+            app.applications.load_options()
+        self.assertEqual(app.pool_stats()['concurrency_limit'], 3)
+        self.assertEqual(concurrency.in_flight, 0)
+
+    def test_adaptive_concurrency_defaults(self):
+        app = self.make_app(adaptive_concurrency=True)
+        adapter = app._session.get_adapter(self.server.url)
+
+        self.assertTrue(isinstance(adapter.concurrency, AdaptiveConcurrency))
+        self.assertEqual(app.pool_stats()['concurrency_limit'], 4)
+
+    def test_no_throttling_by_default(self):
+        app = self.make_app()
+        adapter = app._session.get_adapter(self.server.url)
+
+        self.assertEqual((adapter.rate_limiter, adapter.concurrency), (None, None))
+        self.assertEqual(app.pool_stats()['concurrency_limit'], None)
+
+
+class ResponseDecodingTest(StubServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(ResponseDecodingTest, self).setUp()
+        identity_path = '/accounts/api/identities/{0}/'.format(TEST_USER['uuid'])
+        self.server.routes.update({
+            ('GET', identity_path): (200, {}, {
+                'uuid': TEST_USER['uuid'], 'update_info_url': self.server.url + identity_path,
+            }),
+            ('OPTIONS', identity_path): (200, {'Allow': 'GET, PUT, HEAD, OPTIONS'}, {
+                'fields': {'first_name': 'CharField'}
+            }),
+        })
+        self.loaded = []
+
+    def loads(self, content):
+        self.loaded.append(content)
+        return json.loads(content.decode('utf-8'))
+
+    def test_responses_decode_their_body_once(self):
+        app = self.make_app()
+        response = app._session.get('{0}/accounts/api/identities/{1}/'.format(self.server.url, TEST_USER['uuid']))
+
+        self.assertTrue(isinstance(response, PWebResponse))
+        self.assertTrue(response.json() is response.json())
+        self.assertTrue(response.json(object_hook=str_keys) is response.json())
+        self.assertFalse(response.json(object_hook=dict) is response.json())
+
+    def test_json_backend_is_used_once_per_response(self):
+        app = self.make_app(json_backend=self.loads)
+        user = app.users.get(uuid=TEST_USER['uuid'])
+
+        self.assertEqual(user.uuid, TEST_USER['uuid'])
+        self.assertEqual(list(user._meta['fields']), ['first_name'])
+        self.assertEqual(len(self.loaded), 2)
+
+    def test_json_backend_by_module_name(self):
+        app = self.make_app(json_backend='json')
+        adapter = app._session.get_adapter(self.server.url)
+
+        self.assertTrue(adapter.json_loads is json.loads)
+        self.assertEqual(app.users.get(uuid=TEST_USER['uuid']).uuid, TEST_USER['uuid'])
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+__all__ = ['TokenBucket', 'AdaptiveConcurrency']
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket, refilled at ``rate`` tokens per second up to
+    ``capacity`` tokens. acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity=None, timer=time.time, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.timer = timer
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = timer()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.timer()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """ Takes the tokens if they are available, returning the seconds to wait otherwise """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            self.sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+    """
+    Limits the requests in flight, adjusting the limit AIMD style: it grows by about
+    ``increase`` each time ``limit`` requests succeed, and is multiplied by
+    ``decrease`` when the server is overloaded (429 or 503 responses, errors or,
+    with latency_target, responses slower than latency_target seconds).
+    """
+    overload_statuses = (429, 503)
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1, decrease=0.5,
+                 latency_target=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, status=None, latency=None):
+        """ Frees a slot. A status of None means the request failed without a response """
+        overloaded = (
+            status is None or status in self.overload_statuses or
+            (self.latency_target is not None and latency is not None and latency > self.latency_target)
+        )
+
+        with self._condition:
+            self._in_flight -= 1
+            if overloaded:
+                self._limit = max(self.minimum, self._limit * self.decrease)
+            else:
+                self._limit = min(self.maximum, self._limit + self.increase / self._limit)
+            self._condition.notify_all()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import importlib
+
+from requests import Response
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+from requests.exceptions import ConnectionError, Timeout
+from api_toolkit.entities import str_keys
+
+from .circuit import CircuitBreaker, endpoint_family
+from .instrumentation import current_resource_class
+from .retry import RetryPolicy
+from .singleflight import SingleFlight
+from .throttle import TokenBucket, AdaptiveConcurrency
+
+__all__ = ['PWebAdapter', 'PWebResponse']
+
+
+def resolve_json_backend(backend):
+    """ Resolves backend, a module name such as 'ujson' or 'orjson' or a loads callable """
+    if backend is None or callable(backend):
+        return backend
+
+    return importlib.import_module(backend).loads
+
+
+class PWebResponse(Response):
+    """
+    A Response whose body is decoded only once, no matter how many times json()
+    is called, optionally by a faster json_loads. The time spent decoding it is
+    reported to the instrumentation.
+
+    Callers share the decoded content, which must not be changed.
+    """
+    instrumentation = None
+    resource_class = None
+    json_loads = None
+    timer = time.time
+
+    def json(self, **kwargs):
+        """
+        The decoded body, the same object for every caller: it is read-only, copy
+        it before making changes. Other keyword arguments give a new decoding.
+        """
+        # Resources are built with str_keys, which only matters in python 2
+        if kwargs and kwargs != {'object_hook': str_keys}:
+            return self.decode(**kwargs)
+
+        try:
+            return self._decoded
+        except AttributeError:
+            pass
+
+        if self.json_loads is not None:
+            self._decoded = self.decode(loads=self.json_loads)
+        else:
+            self._decoded = self.decode(object_hook=str_keys)
+
+        return self._decoded
+
+    def decode(self, loads=None, **kwargs):
+        started = self.timer()
+        if loads is not None:
+            content = loads(self.content)
+        else:
+            content = super(PWebResponse, self).json(**kwargs)
+
+        if self.instrumentation is not None:
+            self.instrumentation.emit(
+                'json_decoded', family=endpoint_family(self.url), method=self.request.method,
+                resource_class=self.resource_class, duration=self.timer() - started,
+                size=len(self.content)
+            )
+        return content
+
+
+class PWebAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter which keeps track of the utilization of its connection pools
+    and drops the pooled connections after keepalive_timeout seconds without use.
+
+    pool_maxsize only bounds the connections kept in each pool: more of them are
+    opened (and then discarded) when needed, unless pool_block is set, which makes
+    the requests wait for a pooled connection instead.
+
+    With rate_limit, at most that many requests per second are sent, allowing
+    bursts of rate_burst requests. With adaptive_concurrency (True or an
+    AdaptiveConcurrency), the requests in flight are limited by a limit which
+    adapts to the latency and to the overload responses of the server.
+
+    With retry_policy (True or a RetryPolicy), failed requests are sent again
+    when the policy allows it. With circuit_breaker (True or a CircuitBreaker),
+    requests to failing endpoint families fail fast with CircuitOpenError.
+
+    With instrumentation (an Instrumentation), the timing and size of each request
+    are reported to its hooks.
+
+    The responses decode their JSON body only once, using json_backend (a loads
+    callable or the name of a module providing it, like 'ujson') when given.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOLSIZE, pool_maxsize=DEFAULT_POOLSIZE,
+                 max_retries=0, pool_block=False, keepalive_timeout=None, rate_limit=None, rate_burst=None,
+                 adaptive_concurrency=None, retry_policy=None, circuit_breaker=None,
+                 instrumentation=None, json_backend=None, coalesce=None, timer=time.time):
+        self.keepalive_timeout = keepalive_timeout
+        self.timer = timer
+        self.rate_limiter = None
+        if rate_limit is not None:
+            self.rate_limiter = TokenBucket(rate_limit, capacity=rate_burst, timer=timer)
+        if adaptive_concurrency is True:
+            adaptive_concurrency = AdaptiveConcurrency()
+        self.concurrency = adaptive_concurrency or None
+        if retry_policy is True:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy or None
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker(timer=timer)
+        self.circuit_breaker = circuit_breaker or None
+        self.instrumentation = instrumentation
+        self.json_loads = resolve_json_backend(json_backend)
+        if coalesce is True:
+            coalesce = SingleFlight()
+        self.single_flight = coalesce or None
+        self._retries = 0
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._last_used = None
+        super(PWebAdapter, self).__init__(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries,
+            pool_block=pool_block
+        )
+
+    def send(self, request, **kwargs):
+        policy = self.retry_policy
+        if policy is None:
+            return self.send_once(request, **kwargs)
+
+        policy.record(request)
+        attempt = 0
+        while True:
+            try:
+                response = self.send_once(request, **kwargs)
+            except (ConnectionError, Timeout):
+                if not policy.should_retry(request, attempt):
+                    raise
+                delay = policy.delay(attempt)
+            else:
+                if not policy.should_retry(request, attempt, response):
+                    return response
+                delay = policy.delay(attempt, response)
+                # Reading the whole body gives the connection back to the pool
+                response.content
+                response.close()
+
+            with self._stats_lock:
+                self._retries += 1
+            if self.instrumentation is not None:
+                self.instrumentation.emit(
+                    'request_retried', family=endpoint_family(request.url), method=request.method,
+                    resource_class=current_resource_class(), url=request.url, attempt=attempt + 1,
+                    delay=delay
+                )
+            policy.sleep(delay)
+            attempt += 1
+
+    def send_once(self, request, **kwargs):
+        if self.circuit_breaker is not None:
+            family = self.circuit_breaker.before_request(request.url)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+
+        with self._stats_lock:
+            now = self.timer()
+            if (self.keepalive_timeout is not None and self._in_flight == 0
+                    and self._last_used is not None and now - self._last_used > self.keepalive_timeout):
+                # The server has probably closed these connections already
+                self.poolmanager.clear()
+
+            self._in_flight += 1
+            self._requests += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            event = {
+                'family': endpoint_family(request.url), 'method': request.method,
+                'resource_class': current_resource_class(), 'url': request.url,
+                'bytes_out': len(request.body or b''),
+            }
+            instrumentation.emit('request_started', **event)
+
+        started = self.timer()
+        status = None
+        bytes_in = 0
+        try:
+            response = super(PWebAdapter, self).send(request, **kwargs)
+            status = response.status_code
+            if instrumentation is not None:
+                bytes_in = self.body_size(response, kwargs.get('stream'))
+            return response
+        finally:
+            finished = self.timer()
+            with self._stats_lock:
+                self._in_flight -= 1
+                self._last_used = finished
+
+            if instrumentation is not None:
+                instrumentation.emit(
+                    'request_finished', status=status, duration=finished - started,
+                    bytes_in=bytes_in, **event
+                )
+
+            if self.concurrency is not None:
+                self.concurrency.release(status, finished - started)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.after_request(family, status)
+
+    @staticmethod
+    def body_size(response, stream):
+        """ The size of the body, read unless it is streamed. None when it is unknown """
+        if not stream or response._content_consumed:
+            return len(response.content)
+
+        content_length = response.headers.get('Content-Length')
+        return int(content_length) if content_length else None
+
+    def build_response(self, request, resp):
+        built = super(PWebAdapter, self).build_response(request, resp)
+
+        response = PWebResponse()
+        response.__dict__.update(built.__dict__)
+        response.json_loads = self.json_loads
+        if self.instrumentation is not None:
+            response.instrumentation = self.instrumentation
+            response.resource_class = current_resource_class()
+            response.timer = self.timer
+        return response
+
+    def pool_stats(self):
+        pools = [self.poolmanager.pools[key] for key in self.poolmanager.pools.keys()]
+        with self._stats_lock:
+            return {
+                'concurrency_limit': self.concurrency.limit if self.concurrency is not None else None,
+                'circuits': self.circuit_breaker.states() if self.circuit_breaker is not None else {},
+                'requests': self._requests,
+                'retries': self._retries,
+                'coalesced': self.single_flight.collapsed if self.single_flight is not None else 0,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'pools': len(pools),
+                'pool_connections': self._pool_connections,
+                'pool_maxsize': self._pool_maxsize,
+                'pool_block': self._pool_block,
+                'connections_opened': sum(pool.num_connections for pool in pools),
+                # Empty slots of the pool queues are filled with None
+                'idle_connections': sum(
+                    1 for pool in pools if pool.pool for connection in list(pool.pool.queue)
+                    if connection is not None
+                ),
+                # Above 1 when connections are opened beyond pool_maxsize, without pool_block
+                'utilization': self._in_flight / float(self._pool_maxsize * max(len(pools), 1)),
+            }
@@ -31,6 +31,7 @@ setuptools.setup(
     packages=["passaporte_web"],
     include_package_data=True,  # declarations in MANIFEST.in
     install_requires=open(join(dirname(__file__), 'requirements.txt')).readlines(),
+    extras_require={'async': ['aiohttp>=3.0']},
     tests_require=['tox>=1.6.1', 'virtualenv>=1.11.2'],
     cmdclass = {'test': Tox},
     test_suite='passaporte_web.tests',